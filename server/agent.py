@@ -6,18 +6,26 @@
 
 from __future__ import annotations
 
-import json
+import logging
+import time
 import uuid
 from typing import AsyncGenerator
 
-from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langchain_core.messages import ToolMessage, message_chunk_to_message
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_openai import ChatOpenAI
 
 from config import settings
 from models import CardData, CardType, Evidence, StreamChunk
+import context_builder
 import database as db
-from skill_loader import load_all_skills
+import follow_ups
+from intent import detect_intent
+import llm_cache
+import llm_client
+from serialization import dumps_str
+import sse
+from skill_router import skill_router
+from tool_executor import execute_tool_calls
 
 # ── 导入所有 Tools ────────────────────────────────────
 
@@ -43,6 +51,21 @@ ALL_TOOLS = [
 
 TOOL_MAP = {t.name: t for t in ALL_TOOLS}
 
+logger = logging.getLogger("agent")
+
+# ── 快捷操作 ──────────────────────────────────────────
+
+QUICK_ACTIONS = [
+    {"id": "trends", "icon": "🔥", "label": "热点趋势", "prompt": "最近有什么热点可以用来创作？"},
+    {"id": "promote", "icon": "🚀", "label": "推歌建议", "prompt": "帮我分析一下我该推哪首歌"},
+    {"id": "portrait", "icon": "👥", "label": "听众画像", "prompt": "帮我看看我的听众画像"},
+    {"id": "data", "icon": "📊", "label": "数据分析", "prompt": "最近播放量有什么变化？"},
+    {"id": "creation_flow", "icon": "✨", "label": "全流程创作", "prompt": "帮我从热点到创作一条龙完成"},
+    {"id": "promo_flow", "icon": "📋", "label": "全链路宣推", "prompt": "帮我做一套完整宣推方案"},
+]
+
+QUICK_ACTION_PROMPTS = frozenset(a["prompt"] for a in QUICK_ACTIONS)
+
 # ── System Prompt ─────────────────────────────────────
 
 SYSTEM_PROMPT = """你是「腾讯音乐人 AI 助手」，一个专业的音乐人工作流 Copilot。
@@ -79,48 +102,24 @@ SYSTEM_PROMPT = """你是「腾讯音乐人 AI 助手」，一个专业的音乐
 """
 
 
-def _get_system_prompt() -> str:
-    """动态生成包含当前已加载 Skills 的 System Prompt"""
-    skills = load_all_skills()
-    skills_text = ""
-    for s in skills:
-        skills_text += f"### 技能名称：{s.name}\n"
-        skills_text += f"**描述**: {s.description}\n"
-        skills_text += f"**触发词**: {', '.join(s.trigger_keywords)}\n"
-        skills_text += f"**执行步骤与指令**:\n{s.instructions}\n\n"
-    
-    if not skills_text.strip():
-        skills_text = "目前没有注册的高级技能。"
-        
-    return SYSTEM_PROMPT.replace("{skills_prompt}", skills_text.strip())
+_system_prompt_cache: tuple[str, str] | None = None
 
 
-# ── Agent 核心 ─────────────────────────────────────────
-
-def _get_llm() -> ChatOpenAI:
-    return ChatOpenAI(
-        api_key=settings.LLM_API_KEY,
-        base_url=settings.LLM_BASE_URL,
-        model=settings.LLM_MODEL,
-        temperature=settings.LLM_TEMPERATURE,
-        streaming=True,
-    )
-
+def _get_system_prompt(skills_prompt: str) -> str:
+    """System Prompt：技能段落由 skill_router 给出（前缀缓存布局下为只随技能版本变化的索引）"""
+    global _system_prompt_cache
+    if _system_prompt_cache is None or _system_prompt_cache[0] != skills_prompt:
+        _system_prompt_cache = (skills_prompt, SYSTEM_PROMPT.replace("{skills_prompt}", skills_prompt))
+    return _system_prompt_cache[1]
 
-def _build_messages(history: list[dict], user_msg: str) -> list:
-    """构建 LangChain 消息列表"""
-    messages = [SystemMessage(content=_get_system_prompt())]
 
-    for msg in history[-20:]:  # 保留最近 20 条历史
-        role = msg.get("role", "user")
-        content = msg.get("content", "")
-        if role == "user":
-            messages.append(HumanMessage(content=content))
-        elif role == "assistant":
-            messages.append(AIMessage(content=content))
+# ── Agent 核心 ─────────────────────────────────────────
 
-    messages.append(HumanMessage(content=user_msg))
-    return messages
+def _cache_route(user_msg: str, plan: context_builder.ContextPlan) -> str:
+    """无历史的快捷操作走 quick_action 路由（较长 TTL），其余为普通对话"""
+    if not plan.kept and user_msg.strip() in QUICK_ACTION_PROMPTS:
+        return llm_cache.ROUTE_QUICK_ACTION
+    return llm_cache.ROUTE_CHAT
 
 
 def _generate_title(user_msg: str) -> str:
@@ -212,220 +211,200 @@ def _extract_cards(tool_name: str, tool_result: dict) -> list[dict]:
     return cards
 
 
-def _parse_follow_ups(raw: str) -> list[str]:
-    """将 LLM 生成的后续建议（问题或话题）解析为列表。"""
-    if not raw:
-        return []
-
-    text = raw.strip()
-    if not text:
-        return []
-
-    # 优先 JSON 格式
-    try:
-        data = json.loads(text)
-        if isinstance(data, dict):
-            items = data.get("suggestions") or data.get("questions") or data.get("topics")
-        else:
-            items = data
-        if isinstance(items, list):
-            parsed = [str(i).strip() for i in items if str(i).strip()]
-            return parsed[:3]
-    except Exception:
-        pass
-
-    # 兜底：按行解析
-    result: list[str] = []
-    for line in text.splitlines():
-        cleaned = line.strip()
-        cleaned = cleaned.lstrip("-•")
-        cleaned = cleaned.strip()
-        cleaned = cleaned.removeprefix("1.").removeprefix("2.").removeprefix("3.").strip()
-        if cleaned:
-            result.append(cleaned)
-        if len(result) >= 3:
-            break
-    return result[:3]
-
-
-def _build_follow_up_prompt(user_msg: str, assistant_reply: str) -> str:
-    return f"""你是一个对话助手，请基于本轮问答生成 3 条后续建议。
-要求：
-1) 必须和用户当前主题强相关，帮助用户继续探索。
-2) 根据语境自动选择输出形态：
-   - 如果用户明显还在探索/比较/决策，输出“追问句”（建议以问号结尾）。
-   - 如果本轮回答已较完整，输出“关联话题短语”（不加句号、不加解释，不写完整陈述句）。
-3) 三条保持同一风格（全是追问句或全是话题短语），避免重复。
-4) 追问句建议 8-24 个中文字符；话题短语建议 4-12 个中文字符。
-5) 不要出现解释文字。
-6) 仅返回 JSON 数组字符串，例如：[\"建议1\", \"建议2\", \"建议3\"]
-
-用户问题：{user_msg}
-助手回答：{assistant_reply}
-"""
-
-
-async def _generate_follow_ups(llm: ChatOpenAI, user_msg: str, assistant_reply: str) -> list[str]:
-    """生成后续追问建议。"""
-    if not assistant_reply.strip():
-        return []
-
-    prompt = _build_follow_up_prompt(user_msg, assistant_reply)
-    try:
-        resp = await llm.ainvoke([HumanMessage(content=prompt)])
-        return _parse_follow_ups(resp.content or "")
-    except Exception:
-        return []
-
-
-
-async def chat(user_msg: str, conversation_id: str | None = None) -> AsyncGenerator[str, None]:
+async def chat(
+    user_msg: str,
+    conversation_id: str | None = None,
+    coalesce: bool = True,
+) -> AsyncGenerator[bytes, None]:
     """处理用户消息，流式返回响应。
 
-    产出 Server-Sent Events (SSE) 格式的 JSON chunks。
+    产出 Server-Sent Events (SSE) 格式的 JSON chunks；coalesce 为 True 时合并相邻 token 帧。
     """
+    async for frame in sse.encode_stream(_chat_events(user_msg, conversation_id), coalesce=coalesce):
+        yield frame
+
+
+async def _chat_events(user_msg: str, conversation_id: str | None) -> AsyncGenerator[dict, None]:
+    """对话主流程，按顺序产出 token / card / error / done / follow_ups 事件"""
     # 1. 创建或获取会话
-    if not conversation_id or not db.get_conversation(conversation_id):
-        conversation_id = db.create_conversation(_generate_title(user_msg))
+    if not conversation_id or not await db.get_conversation(conversation_id):
+        conversation_id = await db.create_conversation(_generate_title(user_msg))
 
     # 2. 保存用户消息
-    db.save_message(conversation_id, "user", user_msg)
-
-    # 3. 加载历史
-    history = db.get_messages(conversation_id, limit=20)
+    await db.save_message(conversation_id, "user", user_msg)
+
+    # 3. 加载最近历史（含刚存的用户消息，优先命中缓存）与滚动摘要
+    history_limit = settings.CONTEXT_HISTORY_LIMIT
+    history = await db.get_recent_messages(conversation_id, limit=history_limit)
+    summary_row = await db.get_summary(conversation_id)
+
+    # 关键词意图：分类与技能触发词一次扫描得出
+    intent = detect_intent(user_msg)
+    if intent.skills or intent.categories:
+        logger.info(f"[Agent] 意图 — 技能 {list(intent.skills)}, 分类 {list(intent.categories)}")
+
+    # 只为相关技能注入完整执行步骤
+    route = skill_router.route(user_msg, history[:-1], intent)
+    logger.info(
+        f"[Agent] 技能路由 — 展开 {list(route.matched)}, "
+        f"技能段落约 {route.routed_tokens}/{route.full_tokens} tokens（节省 {route.saved_tokens}）"
+    )
 
-    # 4. 构建消息
-    messages = _build_messages(history[:-1], user_msg)  # 排除刚存的用户消息
+    # 4. 按 token 预算构建消息（排除刚存的用户消息）；
+    #    前缀缓存布局下 System Prompt 只含技能索引，命中技能的执行步骤放在末尾
+    if settings.PROMPT_LAYOUT == context_builder.PREFIX_CACHE:
+        system_prompt, tail = _get_system_prompt(route.index_prompt), route.active_prompt or None
+    else:
+        system_prompt, tail = _get_system_prompt(route.skills_prompt), None
+    plan = context_builder.build_context(
+        system_prompt,
+        history[:-1],
+        user_msg,
+        summary=summary_row["summary"] if summary_row else None,
+        tail=tail,
+    )
+    messages = plan.messages
+    logger.info(f"[Agent] 上下文 — 历史 {len(plan.kept)}/{len(history) - 1} 条, 约 {plan.total_tokens} tokens")
 
-    # 5. 初始化 LLM（绑定工具）
-    llm = _get_llm()
-    llm_with_tools = llm.bind_tools(ALL_TOOLS)
+    # 5. 获取共享的 LLM 实例与预绑定工具的 Runnable
+    llm = llm_client.get_llm()
+    llm_with_tools = llm_client.get_llm_with_tools(ALL_TOOLS)
+    tool_schema_hash = llm_client.get_tool_schema_hash(ALL_TOOLS)
+    cache_route = _cache_route(user_msg, plan)
 
     # 6. 调用 LLM
     all_cards = []
     full_content = ""
+    failed = False
     message_id = uuid.uuid4().hex[:16]
 
     try:
-        # 第一轮：LLM 决定是否调用工具
-        import logging
-        logger = logging.getLogger("agent")
-        logger.info("[Agent] 第一轮调用 LLM (ainvoke)...")
-        response = await llm_with_tools.ainvoke(messages)
-        logger.info(f"[Agent] 第一轮完成 — content长度={len(response.content or '')}, tool_calls数量={len(response.tool_calls or [])}")
-
-        # 处理工具调用
-        if response.tool_calls:
-            # 如果 LLM 同时返回了文本内容（如"好的，正在为您查询…"），先发给前端
-            if response.content:
-                full_content += response.content
-                token_chunk = json.dumps({
-                    "type": "token",
-                    "content": response.content,
-                }, ensure_ascii=False)
-                yield f"data: {token_chunk}\n\n"
-
-            # 执行所有工具调用
-            tool_messages = [response]
-            for tool_call in response.tool_calls:
-                tool_name = tool_call["name"]
-                tool_args = tool_call["args"]
-                tool_fn = TOOL_MAP.get(tool_name)
-                logger.info(f"[Agent] 调用工具: {tool_name}, 参数: {tool_args}")
-
-                if tool_fn:
-                    try:
-                        result = await tool_fn.ainvoke(tool_args)
-                        if isinstance(result, str):
-                            result = json.loads(result)
-                        logger.info(f"[Agent] 工具 {tool_name} 返回成功")
-                    except Exception as e:
-                        logger.error(f"[Agent] 工具 {tool_name} 执行失败: {e}")
-                        result = {"error": str(e)}
-
-                    # 提取卡片
-                    cards = _extract_cards(tool_name, result)
-                    all_cards.extend(cards)
-
-                    # 发送卡片 chunk
-                    for card in cards:
-                        card_chunk = json.dumps({
-                            "type": "card",
-                            "card": card,
-                        }, ensure_ascii=False)
-                        yield f"data: {card_chunk}\n\n"
-
-                    # 构建工具响应消息
-                    from langchain_core.messages import ToolMessage
-                    tool_messages.append(
-                        ToolMessage(
-                            content=json.dumps(result, ensure_ascii=False),
-                            tool_call_id=tool_call["id"],
-                        )
+        # 多轮工具循环：每轮流式调用 LLM，文本 token 立即下发，tool_call 增量边收边拼；
+        # 达到 AGENT_MAX_TOOL_ROUNDS 后最后一轮不再绑定工具，强制模型给出最终回答
+        max_rounds = max(0, settings.AGENT_MAX_TOOL_ROUNDS)
+        for round_no in range(1, max_rounds + 2):
+            with_tools = round_no <= max_rounds
+            runnable = llm_with_tools if with_tools else llm
+            schema_hash = tool_schema_hash if with_tools else None
+
+            # 命中响应缓存时直接回放，否则流式调用 LLM 并写入缓存
+            cache_key = None
+            cached = None
+            if llm_cache.route_ttl(cache_route) > 0:
+                cache_key = llm_cache.make_key(
+                    messages, settings.LLM_MODEL, settings.LLM_TEMPERATURE, schema_hash,
+                )
+                cached = await llm_cache.get(cache_key, cache_route)
+
+            if cached is not None:
+                logger.info(f"[Agent] 第 {round_no} 轮命中 LLM 缓存 ({cache_route})")
+                for piece in llm_cache.replay_chunks(cached.content):
+                    full_content += piece
+                    yield {"type": "token", "content": piece}
+                response = cached.to_message()
+            else:
+                logger.info(f"[Agent] 第 {round_no} 轮调用 LLM (astream)...")
+                response = None
+                started = time.monotonic()
+                ttft = None
+                async for chunk in runnable.astream(messages):
+                    if ttft is None:
+                        ttft = time.monotonic() - started
+                    response = chunk if response is None else response + chunk
+                    if chunk.content:
+                        full_content += chunk.content
+                        yield {"type": "token", "content": chunk.content}
+                usage = llm_client.parse_usage(response)
+                if usage is not None:
+                    llm_client.prompt_cache_stats.record(usage, ttft)
+                    logger.info(
+                        f"[Agent] 第 {round_no} 轮 usage — 输入 {usage.input_tokens} tokens, "
+                        f"前缀缓存命中 {usage.cached_tokens} ({usage.hit_ratio:.0%}), "
+                        f"首 token {ttft * 1000 if ttft is not None else 0:.0f}ms"
+                    )
+                if cache_key is not None and response is not None:
+                    await llm_cache.put(cache_key, cache_route, response, schema_hash)
+
+            tool_calls = response.tool_calls if response is not None else []
+            logger.info(f"[Agent] 第 {round_no} 轮完成 — 总回复长度={len(full_content)}, tool_calls数量={len(tool_calls)}")
+            if not tool_calls:
+                break
+
+            # 并发执行所有工具调用：卡片按完成顺序推送，ToolMessage 保持原始顺序
+            outcomes: list = [None] * len(tool_calls)
+            async for outcome in execute_tool_calls(
+                tool_calls,
+                TOOL_MAP,
+                max_concurrency=settings.TOOL_MAX_CONCURRENCY,
+                timeout=settings.TOOL_TIMEOUT,
+            ):
+                outcomes[outcome.index] = outcome
+                if outcome.name not in TOOL_MAP:
+                    continue
+
+                # 提取卡片
+                cards = _extract_cards(outcome.name, outcome.result)
+                all_cards.extend(cards)
+
+                # 发送卡片 chunk
+                for card in cards:
+                    yield {"type": "card", "card": card}
+
+            # 构建工具响应消息，进入下一轮
+            messages.append(message_chunk_to_message(response))
+            for outcome in outcomes:
+                messages.append(
+                    ToolMessage(
+                        content=dumps_str(outcome.result),
+                        tool_call_id=outcome.tool_call["id"],
                     )
-                else:
-                    logger.warning(f"[Agent] 未找到工具: {tool_name}")
-
-            # 第二轮：LLM 基于工具结果生成最终回答
-            logger.info("[Agent] 第二轮调用 LLM (astream)...")
-            messages.extend(tool_messages)
-            async for chunk in llm.astream(messages):
-                if chunk.content:
-                    full_content += chunk.content
-                    token_chunk = json.dumps({
-                        "type": "token",
-                        "content": chunk.content,
-                    }, ensure_ascii=False)
-                    yield f"data: {token_chunk}\n\n"
-            logger.info(f"[Agent] 第二轮完成 — 总回复长度={len(full_content)}")
-
-        else:
-            # 无工具调用，直接流式输出
-            logger.info("[Agent] 无工具调用，直接流式输出...")
-            async for chunk in llm_with_tools.astream(messages):
-                if chunk.content:
-                    full_content += chunk.content
-                    token_chunk = json.dumps({
-                        "type": "token",
-                        "content": chunk.content,
-                    }, ensure_ascii=False)
-                    yield f"data: {token_chunk}\n\n"
+                )
 
     except Exception as e:
+        failed = True
         error_msg = f"抱歉，处理您的请求时遇到了问题：{str(e)}"
         full_content = error_msg
-        error_chunk = json.dumps({
-            "type": "error",
-            "content": error_msg,
-        }, ensure_ascii=False)
-        yield f"data: {error_chunk}\n\n"
-
-    # 7. 生成并发送 follow-up 问题
-    follow_ups = await _generate_follow_ups(llm, user_msg, full_content)
-    if follow_ups:
-        follow_up_chunk = json.dumps({
-            "type": "follow_ups",
-            "questions": follow_ups,
-        }, ensure_ascii=False)
-        yield f"data: {follow_up_chunk}\n\n"
-
-    # 8. 保存助手消息
-    db.save_message(
+        yield {"type": "error", "content": error_msg}
+
+    # 7. 保存助手消息（追问建议由后台任务写回）
+    await db.save_message(
         conversation_id,
         "assistant",
         full_content,
         cards=[c for c in all_cards] if all_cards else None,
-        follow_ups=follow_ups if follow_ups else None,
+        msg_id=message_id,
+    )
+
+    # 8. 后台启动 follow-up 生成，不阻塞 done
+    follow_up_task = None
+    if not failed and full_content.strip():
+        follow_up_task = follow_ups.schedule(message_id, conversation_id, llm, user_msg, full_content)
+
+    # 9. 窗口外的早前消息在后台增量并入摘要
+    window_start = plan.kept[0]["created_at"] if plan.kept else history[-1]["created_at"]
+    context_builder.schedule_fold(
+        conversation_id,
+        llm,
+        plan,
+        summary_row,
+        window_start=window_start,
+        maybe_truncated=len(history) >= history_limit,
+        ahead_until=history[-1]["created_at"],
     )
 
-    # 9. 更新会话标题（首次对话）
+    # 10. 更新会话标题（首次对话）
     if len(history) <= 1:
-        db.update_conversation_title(conversation_id, _generate_title(user_msg))
+        await db.update_conversation_title(conversation_id, _generate_title(user_msg))
 
-    # 10. 发送完成 chunk
-    done_chunk = json.dumps({
+    # 11. 发送完成 chunk
+    yield {
         "type": "done",
         "conversation_id": conversation_id,
         "message_id": message_id,
-    }, ensure_ascii=False)
-    yield f"data: {done_chunk}\n\n"
+    }
+
+    # 12. 迟到的 follow-up 事件；超时则由 follow_ups 接口补取
+    if follow_up_task is not None:
+        questions = await follow_ups.wait(follow_up_task, settings.FOLLOW_UP_TIMEOUT)
+        if questions:
+            yield {"type": "follow_ups", "questions": questions}
@@ -0,0 +1,112 @@
+"""全文检索基准 — 生成大量模拟消息后测量 /api/search 所用查询的延迟
+
+用法：
+    python bench_search.py --rows 1000000 --db /tmp/search_bench.db
+
+数据库已存在且行数足够时直接复用，不重新生成。
+"""
+
+import argparse
+import asyncio
+import random
+import sqlite3
+import statistics
+import time
+import uuid
+from pathlib import Path
+
+import database as db
+import fts
+import payload_store
+
+_PHRASES = [
+    "帮我做一套完整宣推方案", "上个月的推广计划效果怎么样", "最近有什么热点可以用来创作",
+    "结算规则是怎样的", "我的歌被侵权了怎么维权", "听众画像显示主要是一线城市的年轻人",
+    "建议在抖音和小红书同步投放", "播放量环比下降了百分之十二", "审核一般需要多久",
+    "这首歌适合在晚间时段推送", "预算 2000 元可以覆盖三个平台", "TME 音乐人扶持计划报名中",
+]
+_CARD_TITLES = ["宣推投放计划", "听众画像", "热点趋势", "投后复盘报告", "跨平台表现", "推歌建议"]
+
+_QUERIES = ["宣推方案", "推广计划", "侵权", "抖音", "投后复盘", "一线城市 年轻人", "TME", "结算", "不存在的内容"]
+
+
+def _generate(path: Path, rows: int, per_conversation: int = 40) -> None:
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    (existing,) = conn.execute("SELECT COUNT(*) FROM message").fetchone()
+    rows -= existing
+    batch_payloads, batch_msgs, batch_fts = {}, [], []
+    conv_id = None
+    start = time.perf_counter()
+    for i in range(rows):
+        if i % per_conversation == 0:
+            conv_id = uuid.uuid4().hex[:16]
+            conn.execute(
+                "INSERT INTO conversation (id, title, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                (conv_id, random.choice(_PHRASES)[:12], "2026-01-01T00:00:00", "2026-01-01T00:00:00"),
+            )
+        content = "，".join(random.sample(_PHRASES, 3)) + f"（第 {i} 条）"
+        cards, cards_ref = None, None
+        if i % 2:
+            cards = [{"type": "x", "title": random.choice(_CARD_TITLES), "data": {}}]
+            encoded = payload_store.encode(cards)
+            batch_payloads[encoded.hash] = (encoded.hash, encoded.codec, encoded.data, encoded.raw_size)
+            cards_ref = encoded.hash
+        msg_id = uuid.uuid4().hex[:16]
+        created = f"2026-01-01T00:00:00.{i:09d}"
+        batch_msgs.append((msg_id, conv_id, "assistant" if i % 2 else "user", content, cards_ref, created))
+        batch_fts.append((msg_id, fts.index_text(content), fts.index_text(db._card_titles(cards))))
+        if len(batch_msgs) >= 10000 or i == rows - 1:
+            conn.executemany(db._PAYLOAD_INSERT, batch_payloads.values())
+            conn.executemany(
+                "INSERT INTO message (id, conversation_id, role, content, cards_ref, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                batch_msgs,
+            )
+            conn.executemany(db._FTS_INSERT, batch_fts)
+            conn.commit()
+            batch_payloads, batch_msgs, batch_fts = {}, [], []
+            print(f"\r生成 {i + 1}/{rows} 条…", end="", flush=True)
+    if rows > 0:
+        print(f"\n生成完成，用时 {time.perf_counter() - start:.1f}s")
+    conn.close()
+
+
+async def _bench(repeat: int) -> None:
+    print(f"{'查询':<16}{'命中(首页)':>10}{'p50 ms':>10}{'p95 ms':>10}{'翻页 ms':>10}")
+    for query in _QUERIES:
+        timings = []
+        for _ in range(repeat):
+            t = time.perf_counter()
+            results, cursor = await db.search_messages(query, limit=20)
+            timings.append((time.perf_counter() - t) * 1000)
+        page_ms = 0.0
+        if cursor:
+            t = time.perf_counter()
+            await db.search_messages(query, limit=20, cursor=cursor)
+            page_ms = (time.perf_counter() - t) * 1000
+        timings.sort()
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        print(f"{query:<16}{len(results):>10}{statistics.median(timings):>10.1f}{p95:>10.1f}{page_ms:>10.1f}")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="FTS5 history search benchmark")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--db", default="/tmp/search_bench.db")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    db.DB_PATH = Path(args.db)
+    await db.init_db()
+    await db.close_db()
+    _generate(db.DB_PATH, args.rows)
+    await db.init_db()
+    try:
+        await _bench(args.repeat)
+    finally:
+        await db.close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
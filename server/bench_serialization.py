@@ -0,0 +1,108 @@
+"""序列化微基准 — 对比标准库 json 旧路径与 serialization / sse 新路径
+
+用真实工具结果生成的卡片作为负载，分别测量：
+- SSE token 帧、card 帧的编码
+- 消息列表 REST 响应（旧：jsonable_encoder + JSONResponse；新：JSONBytesResponse）
+- 数据库 JSON 列（卡片）的解码
+
+用法：
+    python bench_serialization.py --messages 50 --number 2000
+"""
+
+import argparse
+import json
+import timeit
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+import serialization
+import sse
+from agent import TOOL_MAP, _extract_cards
+
+_TOOL_CALLS = [
+    ("get_promotion_report", {"song_name": "月光信箱"}),
+    ("get_audience_portrait", {"song_name": "月光信箱"}),
+    ("analyze_cross_platform", {"song_name": "月光信箱"}),
+    ("recommend_songs_to_promote", {"budget": 2000}),
+    ("get_trending_topics", {"limit": 5}),
+]
+
+
+def _old_dumps(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _old_event(event: dict) -> bytes:
+    return b"data: " + _old_dumps(event) + b"\n\n"
+
+
+def _old_rest(content) -> bytes:
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def _new_rest(content) -> bytes:
+    return serialization.json_response(content).body
+
+
+def _cards() -> list[dict]:
+    cards = []
+    for name, args in _TOOL_CALLS:
+        cards.extend(_extract_cards(name, TOOL_MAP[name].invoke(args)))
+    return cards
+
+
+def _messages(cards: list[dict], count: int) -> list[dict]:
+    messages = []
+    for i in range(count):
+        message = {
+            "id": f"{i:016x}",
+            "conversation_id": "0" * 16,
+            "role": "assistant" if i % 2 else "user",
+            "content": "根据近 14 天的数据，《月光信箱》的播放量环比上升 12%，主要增量来自抖音。" * 3,
+            "follow_ups": ["如何继续提升完播率？", "下一步投放预算怎么分配？"] if i % 2 else None,
+            "created_at": f"2026-01-01T00:00:{i % 60:02d}.000000",
+        }
+        if i % 2:
+            message["cards"] = [cards[i // 2 % len(cards)]]
+        messages.append(message)
+    return messages
+
+
+def _parsed(value):
+    if not isinstance(value, bytes):
+        return value
+    return json.loads(value.removeprefix(b"data: "))
+
+
+def _run(label: str, old, new, number: int) -> None:
+    assert _parsed(old()) == _parsed(new()), label
+    old_us = min(timeit.repeat(old, number=number, repeat=5)) / number * 1e6
+    new_us = min(timeit.repeat(new, number=number, repeat=5)) / number * 1e6
+    print(f"{label:<24}{old_us:>12.2f}{new_us:>12.2f}{old_us / new_us:>10.1f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="JSON serialization microbenchmark")
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    cards = _cards()
+    report = next(c for c in cards if c["card_type"] == "data_report")
+    messages = _messages(cards, args.messages)
+    token = {"type": "token", "content": "播放量环比上升 12%，"}
+    card_event = {"type": "card", "card": report}
+    column = _old_dumps(cards)
+
+    print(f"encoder: {'orjson' if serialization.orjson is not None else 'json (stdlib)'}; "
+          f"卡片 {len(cards)} 张，报告卡片 {len(_old_dumps(report))} 字节，消息 {args.messages} 条")
+    print(f"{'路径':<20}{'旧 µs':>12}{'新 µs':>12}{'加速':>11}")
+    _run("SSE token 帧", lambda: _old_event(token), lambda: sse.encode_event(token), args.number * 10)
+    _run("SSE card 帧", lambda: _old_event(card_event), lambda: sse.encode_event(card_event), args.number)
+    _run("REST 消息列表", lambda: _old_rest(messages), lambda: _new_rest(messages), max(1, args.number // 20))
+    _run("JSON 列解码", lambda: json.loads(column), lambda: serialization.loads(column), args.number)
+
+
+if __name__ == "__main__":
+    main()
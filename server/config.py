@@ -13,26 +13,126 @@ class Settings:
     LLM_MODEL: str = os.getenv("LLM_MODEL", "gpt-4o-mini")
     LLM_TEMPERATURE: float = float(os.getenv("LLM_TEMPERATURE", "0.7"))
 
+    # --- LLM HTTP 连接池 ---
+    LLM_HTTP_MAX_CONNECTIONS: int = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "100"))
+    LLM_HTTP_MAX_KEEPALIVE: int = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "20"))
+    LLM_HTTP_KEEPALIVE_EXPIRY: float = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", "60"))
+    LLM_HTTP_TIMEOUT: float = float(os.getenv("LLM_HTTP_TIMEOUT", "120"))
+    LLM_HTTP2: bool = os.getenv("LLM_HTTP2", "false").lower() in ("1", "true", "yes")
+
+    # --- Prompt 布局 ---
+    # prefix_cache：System Prompt 逐字节稳定、每轮变化的内容放在末尾，便于服务商前缀缓存；inline：全部放在 System Prompt
+    PROMPT_LAYOUT: str = os.getenv("PROMPT_LAYOUT", "prefix_cache")
+    # 流式响应是否请求 usage（含缓存命中 token），服务商不支持 stream_options 时关闭
+    LLM_STREAM_USAGE: bool = os.getenv("LLM_STREAM_USAGE", "true").lower() in ("1", "true", "yes")
+
+    # --- Tool Execution ---
+    TOOL_MAX_CONCURRENCY: int = int(os.getenv("TOOL_MAX_CONCURRENCY", "4"))
+    TOOL_TIMEOUT: float = float(os.getenv("TOOL_TIMEOUT", "15"))
+    AGENT_MAX_TOOL_ROUNDS: int = int(os.getenv("AGENT_MAX_TOOL_ROUNDS", "5"))
+
+    # --- Tool Cache ---
+    # 各工具结果的缓存 TTL（秒），<= 0 表示不缓存；过期后 STALE_TTL 内先返回旧值并后台刷新
+    TOOL_CACHE_ENABLED: bool = os.getenv("TOOL_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+    TOOL_CACHE_MAX_ENTRIES: int = int(os.getenv("TOOL_CACHE_MAX_ENTRIES", "256"))
+    TOOL_CACHE_STALE_TTL: float = float(os.getenv("TOOL_CACHE_STALE_TTL", "300"))
+    TOOL_CACHE_TTL_TRENDS: float = float(os.getenv("TOOL_CACHE_TTL_TRENDS", "300"))
+    TOOL_CACHE_TTL_ANALYTICS: float = float(os.getenv("TOOL_CACHE_TTL_ANALYTICS", "1800"))
+    TOOL_CACHE_TTL_PROMOTION: float = float(os.getenv("TOOL_CACHE_TTL_PROMOTION", "1800"))
+    TOOL_CACHE_TTL_RAGFLOW: float = float(os.getenv("TOOL_CACHE_TTL_RAGFLOW", "600"))
+
+    # --- Context ---
+    # 单轮输入 token 预算（本地估算），超出部分的早前消息并入滚动摘要
+    CONTEXT_MAX_TOKENS: int = int(os.getenv("CONTEXT_MAX_TOKENS", "12000"))
+    CONTEXT_HISTORY_LIMIT: int = int(os.getenv("CONTEXT_HISTORY_LIMIT", "50"))
+    CONTEXT_MESSAGE_MAX_TOKENS: int = int(os.getenv("CONTEXT_MESSAGE_MAX_TOKENS", "2000"))
+    CONTEXT_CARD_MAX_CHARS: int = int(os.getenv("CONTEXT_CARD_MAX_CHARS", "600"))
+    CONTEXT_SUMMARY_MAX_TOKENS: int = int(os.getenv("CONTEXT_SUMMARY_MAX_TOKENS", "500"))
+    CONTEXT_SUMMARY_MIN_MESSAGES: int = int(os.getenv("CONTEXT_SUMMARY_MIN_MESSAGES", "4"))
+    CONTEXT_SUMMARY_BATCH: int = int(os.getenv("CONTEXT_SUMMARY_BATCH", "40"))
+
+    # --- Skills ---
+    # 技能目录变更检查间隔（秒），< 0 表示只在启动时加载
+    SKILLS_RELOAD_INTERVAL: float = float(os.getenv("SKILLS_RELOAD_INTERVAL", "2"))
+    # 技能路由：只展开与对话相关的技能；参与匹配的最近用户消息数、与技能描述共享的最少 bigram 数（0 表示不匹配描述）
+    SKILL_ROUTING_ENABLED: bool = os.getenv("SKILL_ROUTING_ENABLED", "true").lower() in ("1", "true", "yes")
+    SKILL_ROUTING_HISTORY: int = int(os.getenv("SKILL_ROUTING_HISTORY", "3"))
+    SKILL_ROUTING_DESC_MIN_OVERLAP: int = int(os.getenv("SKILL_ROUTING_DESC_MIN_OVERLAP", "3"))
+
+    # --- LLM Cache ---
+    # 各路由的缓存 TTL（秒），<= 0 表示该路由不缓存
+    LLM_CACHE_TTL_QUICK_ACTION: float = float(os.getenv("LLM_CACHE_TTL_QUICK_ACTION", "1800"))
+    LLM_CACHE_TTL_CHAT: float = float(os.getenv("LLM_CACHE_TTL_CHAT", "300"))
+    LLM_CACHE_MEMORY_SIZE: int = int(os.getenv("LLM_CACHE_MEMORY_SIZE", "1024"))
+    LLM_CACHE_REPLAY_CHUNK: int = int(os.getenv("LLM_CACHE_REPLAY_CHUNK", "16"))
+
+    # --- Follow-ups ---
+    FOLLOW_UP_TIMEOUT: float = float(os.getenv("FOLLOW_UP_TIMEOUT", "8"))
+    FOLLOW_UP_CACHE_SIZE: int = int(os.getenv("FOLLOW_UP_CACHE_SIZE", "512"))
+
     # --- Server ---
     HOST: str = os.getenv("HOST", "0.0.0.0")
     PORT: int = int(os.getenv("PORT", "8000"))
+    # 关闭时等待后台任务（追问生成、摘要折叠）完成的最长秒数，超时后取消
+    SHUTDOWN_TASK_TIMEOUT: float = float(os.getenv("SHUTDOWN_TASK_TIMEOUT", "10"))
     CORS_ORIGINS: list[str] = os.getenv(
         "CORS_ORIGINS", "http://localhost:5173,http://localhost:3000"
     ).split(",")
 
+    # --- SSE ---
+    # token 帧合并：时间窗口（毫秒）与缓冲字节上限，任一达到即刷出
+    SSE_COALESCE_MS: float = float(os.getenv("SSE_COALESCE_MS", "40"))
+    SSE_COALESCE_BYTES: int = int(os.getenv("SSE_COALESCE_BYTES", "2048"))
+
     # --- Database ---
     DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./musician_ai.db")
+    DB_READ_POOL_SIZE: int = int(os.getenv("DB_READ_POOL_SIZE", "4"))
+    DB_BUSY_TIMEOUT_MS: int = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+    # 写后队列：单批最大操作数、首个操作入队后的最长等待时间
+    DB_WRITE_BATCH_SIZE: int = int(os.getenv("DB_WRITE_BATCH_SIZE", "256"))
+    DB_WRITE_FLUSH_MS: float = float(os.getenv("DB_WRITE_FLUSH_MS", "20"))
+    # 最近历史缓存：每个会话缓存的消息条数、总字节上限、过期时间（秒）
+    HISTORY_CACHE_WINDOW: int = int(os.getenv("HISTORY_CACHE_WINDOW", "50"))
+    HISTORY_CACHE_MAX_BYTES: int = int(os.getenv("HISTORY_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+    HISTORY_CACHE_TTL: float = float(os.getenv("HISTORY_CACHE_TTL", "600"))
+    # 全文检索：只对最新的若干条命中计算相关度排序
+    SEARCH_MAX_CANDIDATES: int = int(os.getenv("SEARCH_MAX_CANDIDATES", "2000"))
+    # 消息大字段（tool_calls / cards / evidence）：达到该字节数才压缩、zlib 压缩级别、解码结果缓存上限
+    PAYLOAD_COMPRESS_MIN_BYTES: int = int(os.getenv("PAYLOAD_COMPRESS_MIN_BYTES", "256"))
+    PAYLOAD_COMPRESS_LEVEL: int = int(os.getenv("PAYLOAD_COMPRESS_LEVEL", "6"))
+    PAYLOAD_CACHE_MAX_BYTES: int = int(os.getenv("PAYLOAD_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
 
     # --- Knowledge Base ---
     KNOWLEDGE_BASE_DIR: str = os.getenv(
         "KNOWLEDGE_BASE_DIR",
         os.path.join(os.path.dirname(__file__), "knowledge_base"),
     )
+    # 持久化索引目录（mmap 加载，多 worker 共享）与源文件变更检查间隔（秒，< 0 表示只在启动时检查）
+    KNOWLEDGE_INDEX_DIR: str = os.getenv(
+        "KNOWLEDGE_INDEX_DIR",
+        os.path.join(os.path.dirname(__file__), ".knowledge_index"),
+    )
+    KNOWLEDGE_RELOAD_INTERVAL: float = float(os.getenv("KNOWLEDGE_RELOAD_INTERVAL", "30"))
+    # 检索后端：bm25 / dense / hybrid；稠密向量维度与最低相似度
+    KNOWLEDGE_SEARCH_BACKEND: str = os.getenv("KNOWLEDGE_SEARCH_BACKEND", "hybrid")
+    KNOWLEDGE_DENSE_DIM: int = int(os.getenv("KNOWLEDGE_DENSE_DIM", "768"))
+    KNOWLEDGE_DENSE_MIN_SCORE: float = float(os.getenv("KNOWLEDGE_DENSE_MIN_SCORE", "0.1"))
 
     # --- RAGFlow ---
     RAGFLOW_BASE_URL: str = os.getenv("RAGFLOW_BASE_URL", "http://localhost:9380")
     RAGFLOW_API_KEY: str = os.getenv("RAGFLOW_API_KEY", "")
     RAGFLOW_KB_ID: list[str] = os.getenv("RAGFLOW_KB_ID", "").split(",") if os.getenv("RAGFLOW_KB_ID") else []
+    # 单次检索的总截止时间（含重试），超过 HEDGE_DELAY 未返回时并行启动本地检索
+    RAGFLOW_DEADLINE: float = float(os.getenv("RAGFLOW_DEADLINE", "5"))
+    RAGFLOW_CONNECT_TIMEOUT: float = float(os.getenv("RAGFLOW_CONNECT_TIMEOUT", "2"))
+    RAGFLOW_HEDGE_DELAY: float = float(os.getenv("RAGFLOW_HEDGE_DELAY", "1.5"))
+    RAGFLOW_MAX_CONNECTIONS: int = int(os.getenv("RAGFLOW_MAX_CONNECTIONS", "20"))
+    # 重试次数与退避基数（秒），退避为带抖动的指数退避
+    RAGFLOW_MAX_RETRIES: int = int(os.getenv("RAGFLOW_MAX_RETRIES", "2"))
+    RAGFLOW_RETRY_BACKOFF: float = float(os.getenv("RAGFLOW_RETRY_BACKOFF", "0.2"))
+    # 熔断：连续失败次数阈值与冷却时间（秒）
+    RAGFLOW_BREAKER_THRESHOLD: int = int(os.getenv("RAGFLOW_BREAKER_THRESHOLD", "5"))
+    RAGFLOW_BREAKER_RESET: float = float(os.getenv("RAGFLOW_BREAKER_RESET", "30"))
 
 
 settings = Settings()
@@ -0,0 +1,254 @@
+"""上下文组装 — 按 token 预算挑选历史消息，并用滚动摘要保留早前对话
+
+- 使用本地估算（中日韩字符约 1 token/字，其它文本约 4 字符/token）计算 token，不依赖网络
+- 从最新消息往前装填，直到用完 CONTEXT_MAX_TOKENS 扣除 System Prompt、摘要与本轮问题后的余量
+- 历史中的工具卡片以压缩文本形式保留，单条超长消息截断首尾
+- 移出窗口的消息在回答结束后由后台任务增量并入会话摘要（存库），摘要从不整体重算
+- 前缀缓存布局（PROMPT_LAYOUT=prefix_cache）：System Prompt 逐字节稳定，每轮变化的内容
+  （如本轮相关技能的执行步骤）作为 tail 放在本轮用户消息之前，使服务商的 Prompt 前缀缓存
+  能覆盖 System Prompt、摘要与历史消息
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import re
+from dataclasses import dataclass, field
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+from langchain_openai import ChatOpenAI
+
+from config import settings
+from serialization import dumps_str
+import database as db
+
+logger = logging.getLogger("agent")
+
+_CJK_RE = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯＀-￯　-〿]")
+
+# 每条消息的角色 / 分隔符开销
+_MESSAGE_OVERHEAD = 4
+
+# Prompt 布局
+PREFIX_CACHE = "prefix_cache"
+INLINE = "inline"
+
+
+# ── Token 估算 ────────────────────────────────────────
+
+def estimate_tokens(text: str) -> int:
+    """本地 token 估算：CJK 字符按 1 token，其余按 4 字符 1 token"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    """超长文本保留首尾，中间省略"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # 以字符为单位粗略截取，首尾各占一半预算
+    keep = max(1, max_tokens // 2)
+    head, tail = text[:keep], text[-keep:]
+    while estimate_tokens(head) > keep and len(head) > 1:
+        head = head[: len(head) * 3 // 4]
+    while estimate_tokens(tail) > keep and len(tail) > 1:
+        tail = tail[-(len(tail) * 3 // 4):]
+    return f"{head}\n……（内容过长，已省略）……\n{tail}"
+
+
+# ── 历史渲染 ──────────────────────────────────────────
+
+def _render_cards(cards: list[dict] | None) -> str:
+    if not cards:
+        return ""
+    lines = []
+    for card in cards:
+        data = dumps_str(card.get("data", {}))
+        if len(data) > settings.CONTEXT_CARD_MAX_CHARS:
+            data = data[: settings.CONTEXT_CARD_MAX_CHARS] + "…"
+        lines.append(f"[工具结果·{card.get('title', '')}] {data}")
+    return "\n".join(lines)
+
+
+def render_history_message(msg: dict) -> str:
+    """历史消息的文本形式：正文 + 压缩后的卡片数据"""
+    content = msg.get("content") or ""
+    if msg.get("role") == "assistant":
+        cards_text = _render_cards(msg.get("cards"))
+        if cards_text:
+            content = f"{content}\n\n{cards_text}" if content else cards_text
+    return _truncate(content, settings.CONTEXT_MESSAGE_MAX_TOKENS)
+
+
+def _to_message(role: str, content: str) -> BaseMessage | None:
+    if role == "user":
+        return HumanMessage(content=content)
+    if role == "assistant":
+        return AIMessage(content=content)
+    return None
+
+
+# ── 组装 ──────────────────────────────────────────────
+
+@dataclass
+class ContextPlan:
+    messages: list[BaseMessage]
+    total_tokens: int
+    kept: list[dict] = field(default_factory=list)
+    evicted: list[dict] = field(default_factory=list)   # 已加载但未装入窗口的消息（时间正序）
+
+
+def _format_summary(summary: str) -> str:
+    return f"## 早前对话摘要\n以下是本会话更早内容的摘要，供参考：\n{summary}"
+
+
+def build_context(
+    system_prompt: str,
+    history: list[dict],
+    user_msg: str,
+    summary: str | None = None,
+    tail: str | None = None,
+) -> ContextPlan:
+    """按 token 预算组装 LangChain 消息列表。
+
+    history 为本轮用户消息之前的历史（时间正序）；tail 为每轮变化的上下文，
+    以 SystemMessage 放在本轮用户消息之前。
+    """
+    system_messages: list[BaseMessage] = [SystemMessage(content=system_prompt)]
+    used = estimate_tokens(system_prompt) + _MESSAGE_OVERHEAD
+    if summary:
+        summary_text = _format_summary(summary)
+        system_messages.append(SystemMessage(content=summary_text))
+        used += estimate_tokens(summary_text) + _MESSAGE_OVERHEAD
+    used += estimate_tokens(user_msg) + _MESSAGE_OVERHEAD
+    tail_messages: list[BaseMessage] = []
+    if tail:
+        tail_messages.append(SystemMessage(content=tail))
+        used += estimate_tokens(tail) + _MESSAGE_OVERHEAD
+
+    budget = settings.CONTEXT_MAX_TOKENS - used
+    kept: list[tuple[dict, BaseMessage]] = []
+    cut = 0
+    for i in range(len(history) - 1, -1, -1):
+        msg = history[i]
+        text = render_history_message(msg)
+        converted = _to_message(msg.get("role", "user"), text)
+        if converted is None:
+            continue
+        cost = estimate_tokens(text) + _MESSAGE_OVERHEAD
+        if cost > budget:
+            cut = i + 1
+            break
+        budget -= cost
+        kept.append((msg, converted))
+    kept.reverse()
+
+    messages = system_messages + [m for _, m in kept] + tail_messages + [HumanMessage(content=user_msg)]
+    return ContextPlan(
+        messages=messages,
+        total_tokens=settings.CONTEXT_MAX_TOKENS - budget,
+        kept=[d for d, _ in kept],
+        evicted=history[:cut],
+    )
+
+
+# ── 滚动摘要 ──────────────────────────────────────────
+
+def _build_summary_prompt(previous: str | None, messages: list[dict]) -> str:
+    transcript = "\n".join(
+        f"{'用户' if m.get('role') == 'user' else '助手'}：{render_history_message(m)}"
+        for m in messages
+    )
+    return f"""你负责维护一段对话的滚动摘要。请把「新增对话」合并进「已有摘要」，输出更新后的完整摘要。
+要求：
+1) 保留用户的身份信息、作品名、预算、偏好、已确认的结论和待办事项。
+2) 保留工具给出的关键数据（指标、时间、平台），去掉寒暄与重复内容。
+3) 使用中文要点列表，不超过 {settings.CONTEXT_SUMMARY_MAX_TOKENS} 字。
+4) 只输出摘要本身。
+
+已有摘要：
+{previous or "（无）"}
+
+新增对话：
+{transcript}
+"""
+
+
+async def _fold(conversation_id: str, llm: ChatOpenAI, before: str, ahead_until: str) -> None:
+    """将摘要覆盖点之后、before（窗口起点）之前的消息并入摘要。
+
+    这些消息已离开上下文窗口，有多少并入多少；不足 CONTEXT_SUMMARY_MIN_MESSAGES 条时，
+    顺带并入窗口内最早的几条（ahead_until 之前）凑满一批，之后几轮滑出窗口的消息已被覆盖，
+    不必每轮都调用一次 LLM。提前并入的消息在窗口滑过之前会同时出现在摘要与原文中。
+    """
+    current = await db.get_summary(conversation_id)
+    after = current["covered_until"] if current else None
+    pending = await db.get_messages_between(
+        conversation_id,
+        after=after,
+        before=before,
+        limit=settings.CONTEXT_SUMMARY_BATCH,
+    )
+    if not pending:
+        return
+    if len(pending) < settings.CONTEXT_SUMMARY_MIN_MESSAGES:
+        pending = await db.get_messages_between(
+            conversation_id,
+            after=after,
+            before=ahead_until,
+            limit=settings.CONTEXT_SUMMARY_MIN_MESSAGES,
+        )
+
+    prompt = _build_summary_prompt(current["summary"] if current else None, pending)
+    resp = await llm.ainvoke([HumanMessage(content=prompt)])
+    summary = (resp.content or "").strip()
+    if not summary:
+        return
+    await db.save_summary(
+        conversation_id,
+        summary,
+        covered_until=pending[-1]["created_at"],
+        token_count=estimate_tokens(summary),
+    )
+    logger.info(f"[Context] 会话 {conversation_id} 摘要已并入 {len(pending)} 条消息")
+
+
+_folding: dict[str, asyncio.Task] = {}
+
+
+def schedule_fold(
+    conversation_id: str,
+    llm: ChatOpenAI,
+    plan: ContextPlan,
+    summary_row: dict | None,
+    window_start: str,
+    maybe_truncated: bool,
+    ahead_until: str | None = None,
+) -> None:
+    """后台把窗口之前、尚未摘要的消息增量并入摘要（同一会话同时只跑一个任务）。
+
+    window_start 为本轮上下文中最早一条消息的 created_at；maybe_truncated 表示
+    本轮加载的历史已达上限，数据库中可能还有更早、未摘要的消息；ahead_until 为
+    提前并入的上界（不含），通常是本轮用户消息的 created_at，默认等于 window_start。
+    """
+    if conversation_id in _folding:
+        return
+    covered_until = summary_row["covered_until"] if summary_row else ""
+    if plan.evicted:
+        if plan.evicted[-1]["created_at"] <= covered_until:
+            return
+    elif not maybe_truncated:
+        return
+
+    async def _run() -> None:
+        try:
+            await _fold(conversation_id, llm, window_start, ahead_until or window_start)
+        except Exception as e:
+            logger.error(f"[Context] 会话 {conversation_id} 摘要更新失败: {e}")
+
+    task = asyncio.create_task(_run())
+    _folding[conversation_id] = task
+    task.add_done_callback(lambda _: _folding.pop(conversation_id, None))
@@ -1,122 +1,662 @@
-"""SQLite 对话持久化"""
+"""SQLite 对话持久化 — 基于 aiosqlite 的异步存储层
+
+- 单写连接：所有写操作经同一条长连接串行提交（SQLite 同一时刻只允许一个写者）
+- 写后队列：消息写入与会话更新先入队，由后台任务按批合并为一次事务提交（group commit），
+  flush 延迟有上限，关闭时保证落盘；同一会话的读操作会先等待其未提交的写入
+- 读连接池：若干条长连接，读操作彼此并发，不阻塞事件循环
+- 最近历史缓存：对话主链路读取最新 N 条消息时优先命中进程内缓存（见 history_cache），
+  命中时与 conversation.message_count 比对，其它进程写入的消息不会被缓存遮住
+- WAL 及其它 PRAGMA 只在建立连接时设置一次
+- 会话消息数由触发器维护在 conversation.message_count；会话列表按 (updated_at, id)
+  键集分页，每页的代价与消息总量无关
+- 消息按 (conversation_id, created_at, id) 复合索引读取，支持双向游标分页，
+  可选择不返回 tool_calls / cards / evidence 等大字段
+- 全文检索：FTS5 表 message_fts 索引消息正文与卡片标题（中文按字 bigram 与单字切分，见 fts），
+  与消息写入在同一事务中增量维护
+- 大字段（tool_calls / cards / evidence）压缩后存入 payload 表、按内容哈希去重，读取时只解码
+  请求的字段（见 payload_store）
+"""
 
 from __future__ import annotations
 
-import json
+import asyncio
+import base64
+import logging
 import sqlite3
 import uuid
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
+from typing import AsyncIterator
+
+import aiosqlite
+
+import fts
+import payload_store
+from config import settings
+from serialization import dumps, dumps_str, loads
+from history_cache import HistoryCache
 
 DB_PATH = Path(__file__).parent / "musician_ai.db"
 
+logger = logging.getLogger("database")
+
+_JSON_FIELDS = ("follow_ups",)
+
+# 不含大字段（tool_calls / cards / evidence）的消息列
+_LIGHT_COLUMNS = "id, conversation_id, role, content, follow_ups, created_at"
+
+# 对话上下文（历史渲染 / 滚动摘要）只用到卡片
+_HISTORY_FIELDS = ("cards",)
+
+history_cache = HistoryCache(
+    window=settings.HISTORY_CACHE_WINDOW,
+    max_bytes=settings.HISTORY_CACHE_MAX_BYTES,
+    ttl=settings.HISTORY_CACHE_TTL,
+)
+
+
+# ── 连接池 ────────────────────────────────────────────
+
+class _ConnectionPool:
+    """一条写连接 + N 条读连接的长连接池"""
+
+    def __init__(self, path: Path, readers: int):
+        self._path = path
+        self._reader_count = max(1, readers)
+        self._writer: aiosqlite.Connection | None = None
+        self._write_lock = asyncio.Lock()
+        self._readers: asyncio.Queue[aiosqlite.Connection] = asyncio.Queue()
+        self._all_readers: list[aiosqlite.Connection] = []
+
+    async def _connect(self) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(str(self._path))
+        conn.row_factory = sqlite3.Row
+        await conn.execute("PRAGMA journal_mode=WAL")
+        await conn.execute("PRAGMA synchronous=NORMAL")
+        await conn.execute(f"PRAGMA busy_timeout={settings.DB_BUSY_TIMEOUT_MS}")
+        await conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    async def open(self) -> None:
+        self._writer = await self._connect()
+        for _ in range(self._reader_count):
+            conn = await self._connect()
+            self._all_readers.append(conn)
+            self._readers.put_nowait(conn)
+
+    async def close(self) -> None:
+        async with self._write_lock:
+            if self._writer is not None:
+                await self._writer.close()
+                self._writer = None
+        for conn in self._all_readers:
+            await conn.close()
+        self._all_readers.clear()
+
+    @asynccontextmanager
+    async def reader(self) -> AsyncIterator[aiosqlite.Connection]:
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def writer(self) -> AsyncIterator[aiosqlite.Connection]:
+        """独占写连接；正常退出时提交，异常时回滚"""
+        async with self._write_lock:
+            conn = self._writer
+            try:
+                yield conn
+                await conn.commit()
+            except BaseException:
+                await conn.rollback()
+                raise
+
+
+# ── 写后队列（group commit） ─────────────────────────
+
+@dataclass
+class _WriteOp:
+    conv_id: str | None
+    statements: list[tuple[str, tuple]]
+    future: asyncio.Future
+    touch: str | None = None      # 需要写入 conversation.updated_at 的时间
+    barrier: bool = False         # 屏障：到达即立刻提交当前批次
+
+
+class _WriteBehindQueue:
+    """将多个并发流的写操作合并成批，一次事务提交。
+
+    - 一批最多 DB_WRITE_BATCH_SIZE 个操作，首个操作入队后最多等待 DB_WRITE_FLUSH_MS
+    - 同一批内对同一会话的 updated_at 更新只执行一次
+    - 批量提交失败时逐个重试，只有真正出错的操作会收到异常
+    """
+
+    def __init__(self, pool: _ConnectionPool, max_batch: int, flush_interval: float):
+        self._pool = pool
+        self._max_batch = max(1, max_batch)
+        self._flush_interval = max(0.0, flush_interval)
+        self._queue: asyncio.Queue[_WriteOp] = asyncio.Queue()
+        self._pending: dict[str, list[asyncio.Future]] = {}
+        self._task: asyncio.Task | None = None
+        self._closed = False
+
+    def _ensure_running(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def submit(
+        self,
+        conv_id: str | None,
+        statements: list[tuple[str, tuple]],
+        touch: str | None = None,
+        barrier: bool = False,
+    ) -> asyncio.Future:
+        if self._closed:
+            raise RuntimeError("数据库写队列已关闭")
+        future = asyncio.get_running_loop().create_future()
+        # 调用方可以不等待结果；避免未读取的异常产生告警
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        if conv_id is not None and statements:
+            self._pending.setdefault(conv_id, []).append(future)
+        self._queue.put_nowait(_WriteOp(conv_id, statements, future, touch, barrier))
+        self._ensure_running()
+        return future
+
+    def has_pending(self, conv_id: str | None = None) -> bool:
+        if conv_id is None:
+            return bool(self._pending)
+        return conv_id in self._pending
+
+    async def wait_for(self, conv_id: str) -> None:
+        """读己之写：等待该会话所有已入队的写操作提交"""
+        if conv_id in self._pending:
+            await self.flush()
+
+    async def flush(self) -> None:
+        """立即提交队列中已有的全部写操作"""
+        if self._closed:
+            return
+        await self.submit(None, [], barrier=True)
+
+    async def close(self) -> None:
+        """提交剩余写操作并停止后台任务"""
+        if self._closed:
+            return
+        if self._task is not None and not self._task.done():
+            await self.flush()
+        self._closed = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self._flush_interval
+            while len(batch) < self._max_batch and not batch[-1].barrier:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._commit(batch)
+
+    @staticmethod
+    async def _apply(conn: aiosqlite.Connection, ops: list[_WriteOp]) -> None:
+        touched: dict[str, str] = {}
+        for op in ops:
+            for sql, params in op.statements:
+                await conn.execute(sql, params)
+            if op.touch and op.conv_id:
+                touched[op.conv_id] = max(op.touch, touched.get(op.conv_id, ""))
+        for conv_id, ts in touched.items():
+            await conn.execute(
+                "UPDATE conversation SET updated_at = ? WHERE id = ?",
+                (ts, conv_id),
+            )
+
+    async def _commit(self, batch: list[_WriteOp]) -> None:
+        ops = [op for op in batch if op.statements]
+        results: dict[int, BaseException | None] = {}
+        if ops:
+            try:
+                async with self._pool.writer() as conn:
+                    await self._apply(conn, ops)
+            except Exception as e:
+                logger.warning(f"[DB] 批量提交失败，逐条重试 ({len(ops)} 个操作): {e}")
+                for op in ops:
+                    try:
+                        async with self._pool.writer() as conn:
+                            await self._apply(conn, [op])
+                    except Exception as op_error:
+                        logger.error(f"[DB] 写入失败: {op_error}")
+                        results[id(op)] = op_error
+
+        for op in batch:
+            if op.conv_id is not None and op.statements:
+                futures = self._pending.get(op.conv_id)
+                if futures is not None:
+                    futures.remove(op.future)
+                    if not futures:
+                        del self._pending[op.conv_id]
+            if op.future.done():
+                continue
+            error = results.get(id(op))
+            if error is not None:
+                op.future.set_exception(error)
+            else:
+                op.future.set_result(None)
+
+
+_pool: _ConnectionPool | None = None
+_writes: _WriteBehindQueue | None = None
+_pool_lock = asyncio.Lock()
+
+
+async def _get_pool() -> _ConnectionPool:
+    global _pool, _writes
+    if _pool is None:
+        async with _pool_lock:
+            if _pool is None:
+                pool = _ConnectionPool(DB_PATH, settings.DB_READ_POOL_SIZE)
+                await pool.open()
+                _writes = _WriteBehindQueue(
+                    pool,
+                    settings.DB_WRITE_BATCH_SIZE,
+                    settings.DB_WRITE_FLUSH_MS / 1000,
+                )
+                _pool = pool
+    return _pool
+
+
+async def _get_writes() -> _WriteBehindQueue:
+    await _get_pool()
+    return _writes
+
+
+async def flush() -> None:
+    """等待所有已入队的写操作落盘"""
+    if _writes is not None:
+        await _writes.flush()
+
+
+def encode_cursor(*values) -> str:
+    """键集分页游标：排序键编码为不透明字符串"""
+    raw = dumps(values)
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> list:
+    """解析游标；格式不合法时抛出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = loads(raw)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError("无效的分页游标") from e
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("无效的分页游标")
+    return values
+
+
+def _card_titles(cards: list | None) -> str:
+    return " ".join(str(c.get("title") or "") for c in cards or [] if isinstance(c, dict))
+
+
+_FTS_INSERT = "INSERT INTO message_fts (rowid, body, titles) VALUES ((SELECT rowid FROM message WHERE id = ?), ?, ?)"
+
+
+async def _backfill_fts(conn: aiosqlite.Connection, batch: int = 5000) -> None:
+    """为已有消息建立全文索引（首次创建 message_fts 或分词方式变化时执行一次）"""
+    last, total = 0, 0
+    while True:
+        rows = await conn.execute_fetchall(
+            """SELECT m.rowid, m.content, m.cards, p.codec, p.data
+               FROM message m LEFT JOIN payload p ON p.hash = m.cards_ref
+               WHERE m.rowid > ? ORDER BY m.rowid LIMIT ?""",
+            (last, batch),
+        )
+        if not rows:
+            break
+        entries = []
+        for rowid, content, inline_cards, codec, data in rows:
+            if data is not None:
+                cards = payload_store.decode(codec, data)
+            else:
+                cards = loads(inline_cards) if inline_cards else None
+            entries.append((rowid, fts.index_text(content), fts.index_text(_card_titles(cards))))
+        await conn.executemany("INSERT INTO message_fts (rowid, body, titles) VALUES (?, ?, ?)", entries)
+        last, total = rows[-1][0], total + len(rows)
+    if total:
+        logger.info(f"[DB] 已为 {total} 条历史消息建立全文索引")
+
+
+def _decode_row(row: sqlite3.Row) -> dict:
+    d = dict(row)
+    for field in _JSON_FIELDS:
+        if d.get(field):
+            d[field] = loads(d[field])
+    return d
+
+
+# ── 大字段 payload ────────────────────────────────────
+
+_PAYLOAD_INSERT = "INSERT OR IGNORE INTO payload (hash, codec, data, raw_size) VALUES (?, ?, ?, ?)"
+
+
+def _message_columns(fields: tuple[str, ...]) -> str:
+    return _LIGHT_COLUMNS + "".join(f", {f}_ref" for f in fields)
+
+
+async def _fetch_payloads(conn: aiosqlite.Connection, digests: set[str], chunk: int = 500) -> dict:
+    """哈希 -> 解码结果；优先取进程内缓存，其余一次查询取出后解压"""
+    values: dict = {}
+    missing = []
+    for digest in digests:
+        found, value = payload_store.decoded_cache.get(digest)
+        if found:
+            values[digest] = value
+        else:
+            missing.append(digest)
+    for i in range(0, len(missing), chunk):
+        part = missing[i:i + chunk]
+        rows = await conn.execute_fetchall(
+            f"SELECT hash, codec, data, raw_size FROM payload WHERE hash IN ({','.join('?' * len(part))})",
+            part,
+        )
+        for digest, codec, data, raw_size in rows:
+            value = values[digest] = payload_store.decode(codec, data)
+            payload_store.decoded_cache.put(digest, value, raw_size)
+    return values
+
+
+async def _decode_rows(
+    conn: aiosqlite.Connection,
+    rows: list[sqlite3.Row],
+    fields: tuple[str, ...],
+) -> list[dict]:
+    """解码消息行；fields 中的大字段按 *_ref 取出 payload，其余大字段不返回"""
+    messages = [_decode_row(r) for r in rows]
+    refs = {m[f"{f}_ref"] for m in messages for f in fields if m[f"{f}_ref"]}
+    values = await _fetch_payloads(conn, refs) if refs else {}
+    for m in messages:
+        for f in fields:
+            ref = m.pop(f"{f}_ref")
+            m[f] = values.get(ref) if ref else None
+    return messages
+
+
+# PRAGMA user_version 记录已完成的一次性数据迁移，达到该版本后启动时不再扫描消息表
+_USER_VERSION_PAYLOADS = 1
+# 全文索引加入单字 token，旧索引需要重建
+_USER_VERSION_FTS_UNIGRAMS = 2
+_USER_VERSION = _USER_VERSION_FTS_UNIGRAMS
+
+
+async def _migrate_payloads(conn: aiosqlite.Connection, batch: int = 1000) -> None:
+    """旧版本内联存储的大字段迁移到 payload 表（只处理尚未迁移的行）"""
+    last, total = 0, 0
+    while True:
+        rows = await conn.execute_fetchall(
+            """SELECT rowid, tool_calls, cards, evidence FROM message
+               WHERE rowid > ? AND (tool_calls IS NOT NULL OR cards IS NOT NULL OR evidence IS NOT NULL)
+               ORDER BY rowid LIMIT ?""",
+            (last, batch),
+        )
+        if not rows:
+            break
+        for row in rows:
+            refs = {}
+            for field in payload_store.PAYLOAD_FIELDS:
+                if row[field]:
+                    encoded = payload_store.encode(loads(row[field]))
+                    await conn.execute(
+                        _PAYLOAD_INSERT,
+                        (encoded.hash, encoded.codec, encoded.data, encoded.raw_size),
+                    )
+                    refs[field] = encoded.hash
+            await conn.execute(
+                """UPDATE message SET tool_calls = NULL, cards = NULL, evidence = NULL,
+                       tool_calls_ref = ?, cards_ref = ?, evidence_ref = ?
+                   WHERE rowid = ?""",
+                (refs.get("tool_calls"), refs.get("cards"), refs.get("evidence"), row["rowid"]),
+            )
+            # 与插入触发器一致：同一条消息引用同一份 payload 只计一次
+            for digest in set(refs.values()):
+                await conn.execute("UPDATE payload SET refs = refs + 1 WHERE hash = ?", (digest,))
+        last, total = rows[-1]["rowid"], total + len(rows)
+    if total:
+        logger.info(f"[DB] 已将 {total} 条历史消息的大字段迁移到 payload 表")
 
-def _get_conn() -> sqlite3.Connection:
-    conn = sqlite3.connect(str(DB_PATH))
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA journal_mode=WAL")
-    return conn
-
-
-def init_db() -> None:
-    """创建表结构"""
-    conn = _get_conn()
-    conn.executescript(
-        """
-        CREATE TABLE IF NOT EXISTS conversation (
-            id          TEXT PRIMARY KEY,
-            title       TEXT NOT NULL DEFAULT '新对话',
-            created_at  TEXT NOT NULL,
-            updated_at  TEXT NOT NULL
-        );
-
-        CREATE TABLE IF NOT EXISTS message (
-            id              TEXT PRIMARY KEY,
-            conversation_id TEXT NOT NULL,
-            role            TEXT NOT NULL,
-            content         TEXT NOT NULL DEFAULT '',
-            tool_calls      TEXT,
-            cards           TEXT,
-            follow_ups      TEXT,
-            evidence        TEXT,
-            created_at      TEXT NOT NULL,
-            FOREIGN KEY (conversation_id) REFERENCES conversation(id)
-        );
-
-        CREATE INDEX IF NOT EXISTS idx_msg_conv ON message(conversation_id);
-        """
-    )
 
-    # 兼容已存在的数据库（旧版本没有 follow_ups 列）
-    cols = conn.execute("PRAGMA table_info(message)").fetchall()
-    if not any(c[1] == "follow_ups" for c in cols):
-        conn.execute("ALTER TABLE message ADD COLUMN follow_ups TEXT")
+async def init_db() -> None:
+    """建立连接池并创建表结构"""
+    pool = await _get_pool()
+    async with pool.writer() as conn:
+        await conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS conversation (
+                id            TEXT PRIMARY KEY,
+                title         TEXT NOT NULL DEFAULT '新对话',
+                created_at    TEXT NOT NULL,
+                updated_at    TEXT NOT NULL,
+                message_count INTEGER NOT NULL DEFAULT 0
+            );
 
-    conn.commit()
-    conn.close()
+            CREATE TABLE IF NOT EXISTS message (
+                id              TEXT PRIMARY KEY,
+                conversation_id TEXT NOT NULL,
+                role            TEXT NOT NULL,
+                content         TEXT NOT NULL DEFAULT '',
+                tool_calls      TEXT,
+                cards           TEXT,
+                follow_ups      TEXT,
+                evidence        TEXT,
+                created_at      TEXT NOT NULL,
+                tool_calls_ref  TEXT,
+                cards_ref       TEXT,
+                evidence_ref    TEXT,
+                FOREIGN KEY (conversation_id) REFERENCES conversation(id)
+            );
+
+            -- 大字段内容，按哈希去重；refs 为引用它的消息数
+            CREATE TABLE IF NOT EXISTS payload (
+                hash     TEXT PRIMARY KEY,
+                codec    TEXT NOT NULL,
+                data     BLOB NOT NULL,
+                raw_size INTEGER NOT NULL,
+                refs     INTEGER NOT NULL DEFAULT 0
+            );
+
+            CREATE INDEX IF NOT EXISTS idx_payload_orphan ON payload(refs) WHERE refs <= 0;
+
+            CREATE INDEX IF NOT EXISTS idx_msg_conv_created ON message(conversation_id, created_at, id);
+
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key         TEXT PRIMARY KEY,
+                route       TEXT NOT NULL,
+                schema_hash TEXT,
+                value       TEXT NOT NULL,
+                created_at  REAL NOT NULL,
+                expires_at  REAL NOT NULL
+            );
+
+            CREATE INDEX IF NOT EXISTS idx_llm_cache_expires ON llm_cache(expires_at);
+
+            CREATE TABLE IF NOT EXISTS conversation_summary (
+                conversation_id TEXT PRIMARY KEY,
+                summary         TEXT NOT NULL,
+                covered_until   TEXT NOT NULL,
+                token_count     INTEGER NOT NULL DEFAULT 0,
+                updated_at      TEXT NOT NULL
+            );
+            """
+        )
+
+        # 兼容已存在的数据库（旧版本没有 follow_ups 列）
+        cols = await conn.execute_fetchall("PRAGMA table_info(message)")
+        if not any(c[1] == "follow_ups" for c in cols):
+            await conn.execute("ALTER TABLE message ADD COLUMN follow_ups TEXT")
+
+        # 旧版本没有 message_count 列：补列并一次性回填
+        cols = await conn.execute_fetchall("PRAGMA table_info(conversation)")
+        if not any(c[1] == "message_count" for c in cols):
+            await conn.execute("ALTER TABLE conversation ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0")
+            await conn.execute(
+                """UPDATE conversation SET message_count =
+                   (SELECT COUNT(*) FROM message WHERE message.conversation_id = conversation.id)"""
+            )
+
+        # 旧版本大字段内联存储：补引用列（数据在建立全文索引之后迁移）
+        cols = await conn.execute_fetchall("PRAGMA table_info(message)")
+        for field in payload_store.PAYLOAD_FIELDS:
+            if not any(c[1] == f"{field}_ref" for c in cols):
+                await conn.execute(f"ALTER TABLE message ADD COLUMN {field}_ref TEXT")
+
+        # 一次性迁移与 user_version 的更新在同一事务中提交：中途失败时下次启动会重新执行
+        user_version = (await conn.execute_fetchall("PRAGMA user_version"))[0][0]
+        fts_exists = await conn.execute_fetchall(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'message_fts'"
+        )
+        if not fts_exists:
+            await conn.execute(
+                "CREATE VIRTUAL TABLE message_fts USING fts5(body, titles, tokenize = 'unicode61 remove_diacritics 2')"
+            )
+            await _backfill_fts(conn)
+        elif user_version < _USER_VERSION_FTS_UNIGRAMS:
+            await conn.execute("DELETE FROM message_fts")
+            await _backfill_fts(conn)
+        if user_version < _USER_VERSION_PAYLOADS:
+            await _migrate_payloads(conn)
+        if user_version < _USER_VERSION:
+            await conn.execute(f"PRAGMA user_version = {_USER_VERSION}")
+
+        await conn.executescript(
+            """
+            DROP INDEX IF EXISTS idx_msg_conv;
+            CREATE INDEX IF NOT EXISTS idx_conv_updated ON conversation(updated_at, id);
+
+            CREATE TRIGGER IF NOT EXISTS trg_message_count_insert AFTER INSERT ON message
+            BEGIN
+                UPDATE conversation SET message_count = message_count + 1 WHERE id = NEW.conversation_id;
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS trg_message_count_delete AFTER DELETE ON message
+            BEGIN
+                UPDATE conversation SET message_count = message_count - 1 WHERE id = OLD.conversation_id;
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS trg_payload_refs_insert AFTER INSERT ON message
+            BEGIN
+                UPDATE payload SET refs = refs + 1
+                WHERE hash IN (NEW.tool_calls_ref, NEW.cards_ref, NEW.evidence_ref);
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS trg_payload_refs_delete AFTER DELETE ON message
+            BEGIN
+                UPDATE payload SET refs = refs - 1
+                WHERE hash IN (OLD.tool_calls_ref, OLD.cards_ref, OLD.evidence_ref);
+            END;
+            """
+        )
+
+
+async def close_db() -> None:
+    """提交剩余写操作并关闭连接池（应用关闭时调用）"""
+    global _pool, _writes
+    if _writes is not None:
+        await _writes.close()
+        _writes = None
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
 
 
 # ── 会话 ──────────────────────────────────────────────
 
-def create_conversation(title: str = "新对话") -> str:
+async def create_conversation(title: str = "新对话") -> str:
     conv_id = uuid.uuid4().hex[:16]
     now = datetime.now().isoformat()
-    conn = _get_conn()
-    conn.execute(
+    writes = await _get_writes()
+    writes.submit(conv_id, [(
         "INSERT INTO conversation (id, title, created_at, updated_at) VALUES (?, ?, ?, ?)",
         (conv_id, title, now, now),
-    )
-    conn.commit()
-    conn.close()
+    )])
+    history_cache.start_conversation(conv_id)
     return conv_id
 
 
-def update_conversation_title(conv_id: str, title: str) -> None:
-    conn = _get_conn()
-    conn.execute(
-        "UPDATE conversation SET title = ?, updated_at = ? WHERE id = ?",
-        (title, datetime.now().isoformat(), conv_id),
+async def update_conversation_title(conv_id: str, title: str) -> None:
+    writes = await _get_writes()
+    writes.submit(
+        conv_id,
+        [("UPDATE conversation SET title = ? WHERE id = ?", (title, conv_id))],
+        touch=datetime.now().isoformat(),
     )
-    conn.commit()
-    conn.close()
-
-
-def list_conversations(limit: int = 50) -> list[dict]:
-    conn = _get_conn()
-    rows = conn.execute(
-        """
-        SELECT c.id, c.title, c.updated_at,
-               COUNT(m.id) as message_count
-        FROM conversation c
-        LEFT JOIN message m ON m.conversation_id = c.id
-        GROUP BY c.id
-        ORDER BY c.updated_at DESC
-        LIMIT ?
-        """,
-        (limit,),
-    ).fetchall()
-    conn.close()
-    return [dict(r) for r in rows]
-
-
-def get_conversation(conv_id: str) -> dict | None:
-    conn = _get_conn()
-    row = conn.execute("SELECT * FROM conversation WHERE id = ?", (conv_id,)).fetchone()
-    conn.close()
+
+
+async def list_conversations(limit: int = 50, cursor: str | None = None) -> tuple[list[dict], str | None]:
+    """按最近更新时间倒序分页，返回 (本页会话, 下一页游标)；没有下一页时游标为 None"""
+    pool = await _get_pool()
+    if cursor:
+        updated_at, conv_id = decode_cursor(cursor, 2)
+        where, params = "WHERE (updated_at, id) < (?, ?)", (updated_at, conv_id)
+    else:
+        where, params = "", ()
+    async with pool.reader() as conn:
+        rows = await conn.execute_fetchall(
+            f"""
+            SELECT id, title, updated_at, message_count
+            FROM conversation
+            {where}
+            ORDER BY updated_at DESC, id DESC
+            LIMIT ?
+            """,
+            (*params, limit + 1),
+        )
+    items = [dict(r) for r in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit and items:
+        next_cursor = encode_cursor(items[-1]["updated_at"], items[-1]["id"])
+    return items, next_cursor
+
+
+async def get_conversation(conv_id: str) -> dict | None:
+    pool = await _get_pool()
+    await _writes.wait_for(conv_id)
+    async with pool.reader() as conn:
+        async with conn.execute("SELECT * FROM conversation WHERE id = ?", (conv_id,)) as cur:
+            row = await cur.fetchone()
     return dict(row) if row else None
 
 
-def delete_conversation(conv_id: str) -> None:
-    conn = _get_conn()
-    conn.execute("DELETE FROM message WHERE conversation_id = ?", (conv_id,))
-    conn.execute("DELETE FROM conversation WHERE id = ?", (conv_id,))
-    conn.commit()
-    conn.close()
+async def delete_conversation(conv_id: str) -> None:
+    writes = await _get_writes()
+    await writes.submit(conv_id, [
+        ("DELETE FROM message_fts WHERE rowid IN (SELECT rowid FROM message WHERE conversation_id = ?)", (conv_id,)),
+        ("DELETE FROM message WHERE conversation_id = ?", (conv_id,)),
+        ("DELETE FROM payload WHERE refs <= 0", ()),
+        ("DELETE FROM conversation_summary WHERE conversation_id = ?", (conv_id,)),
+        ("DELETE FROM conversation WHERE id = ?", (conv_id,)),
+    ])
+    history_cache.invalidate(conv_id)
 
 
 # ── 消息 ──────────────────────────────────────────────
 
-def save_message(
+async def save_message(
     conversation_id: str,
     role: str,
     content: str,
@@ -124,50 +664,349 @@ def save_message(
     cards: list | None = None,
     follow_ups: list[str] | None = None,
     evidence: list | None = None,
+    msg_id: str | None = None,
 ) -> str:
-    msg_id = uuid.uuid4().hex[:16]
+    """写入一条消息并返回消息 id。
+
+    写入进入写后队列，由后台任务批量提交，本函数返回时消息尚未落盘。提交失败只记录日志，
+    调用方无法感知持久化错误；同一进程内的读取会先等待该会话未提交的写入（读己之写）。
+    flush() 只保证已入队的写操作结束，同样不反馈单个操作的失败。
+    """
+    msg_id = msg_id or uuid.uuid4().hex[:16]
     now = datetime.now().isoformat()
-    conn = _get_conn()
-    conn.execute(
+    statements = []
+    refs = {}
+    for field, value in (("tool_calls", tool_calls), ("cards", cards), ("evidence", evidence)):
+        if value:
+            encoded = payload_store.encode(value)
+            statements.append((_PAYLOAD_INSERT, (encoded.hash, encoded.codec, encoded.data, encoded.raw_size)))
+            payload_store.decoded_cache.put(encoded.hash, value, encoded.raw_size)
+            refs[field] = encoded.hash
+    statements.append((
         """INSERT INTO message
-           (id, conversation_id, role, content, tool_calls, cards, follow_ups, evidence, created_at)
+           (id, conversation_id, role, content, follow_ups, created_at, tool_calls_ref, cards_ref, evidence_ref)
            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
         (
             msg_id,
             conversation_id,
             role,
             content,
-            json.dumps(tool_calls) if tool_calls else None,
-            json.dumps(cards) if cards else None,
-            json.dumps(follow_ups) if follow_ups else None,
-            json.dumps(evidence) if evidence else None,
+            dumps_str(follow_ups) if follow_ups else None,
             now,
+            refs.get("tool_calls"),
+            refs.get("cards"),
+            refs.get("evidence"),
         ),
+    ))
+    statements.append((
+        _FTS_INSERT,
+        (msg_id, fts.index_text(content), fts.index_text(_card_titles(cards))),
+    ))
+    writes = await _get_writes()
+    writes.submit(conversation_id, statements, touch=now)
+    history_cache.append(conversation_id, {
+        "id": msg_id,
+        "conversation_id": conversation_id,
+        "role": role,
+        "content": content,
+        "follow_ups": follow_ups or None,
+        "created_at": now,
+        "cards": cards or None,
+    })
+    return msg_id
+
+
+async def update_message_follow_ups(
+    msg_id: str,
+    follow_ups: list[str],
+    conversation_id: str | None = None,
+) -> None:
+    writes = await _get_writes()
+    writes.submit(
+        conversation_id,
+        [("UPDATE message SET follow_ups = ? WHERE id = ?", (dumps_str(follow_ups), msg_id))],
+    )
+    if conversation_id is not None:
+        history_cache.update_message(conversation_id, msg_id, follow_ups=follow_ups or None)
+
+
+async def get_message(msg_id: str, conversation_id: str | None = None) -> dict | None:
+    pool = await _get_pool()
+    if conversation_id is not None:
+        await _writes.wait_for(conversation_id)
+    elif _writes.has_pending():
+        await _writes.flush()
+    fields = payload_store.PAYLOAD_FIELDS
+    async with pool.reader() as conn:
+        rows = await conn.execute_fetchall(
+            f"SELECT {_message_columns(fields)} FROM message WHERE id = ?", (msg_id,)
+        )
+        messages = await _decode_rows(conn, rows, fields)
+    return messages[0] if messages else None
+
+
+@dataclass
+class MessagePage:
+    messages: list[dict]                # 时间正序
+    next_cursor: str | None = None      # 继续向后（更新的消息）翻页
+    prev_cursor: str | None = None      # 继续向前（更早的消息）翻页
+
+
+async def get_messages(
+    conversation_id: str,
+    limit: int = 50,
+    cursor: str | None = None,
+    backward: bool = False,
+    include_payloads: bool = True,
+) -> MessagePage:
+    """按 (created_at, id) 游标分页读取消息。
+
+    backward=False：从 cursor 之后（无游标时从最早的消息）向后读；
+    backward=True：读取 cursor 之前（无游标时为最新）的 limit 条。结果均为时间正序。
+    """
+    pool = await _get_pool()
+    await _writes.wait_for(conversation_id)
+    params: list = [conversation_id]
+    where = "conversation_id = ?"
+    if cursor:
+        params.extend(decode_cursor(cursor, 2))
+        where += " AND (created_at, id) < (?, ?)" if backward else " AND (created_at, id) > (?, ?)"
+    order = "DESC" if backward else "ASC"
+    fields = payload_store.PAYLOAD_FIELDS if include_payloads else ()
+    async with pool.reader() as conn:
+        rows = await conn.execute_fetchall(
+            f"""SELECT {_message_columns(fields)} FROM message
+                WHERE {where}
+                ORDER BY created_at {order}, id {order}
+                LIMIT ?""",
+            (*params, limit + 1),
+        )
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if backward:
+            rows.reverse()
+        messages = await _decode_rows(conn, rows, fields)
+    page = MessagePage(messages)
+    if messages:
+        first, last = messages[0], messages[-1]
+        # 向某个方向翻页时，反方向一定还有（游标所指的）消息
+        if has_more if backward else bool(cursor):
+            page.prev_cursor = encode_cursor(first["created_at"], first["id"])
+        if bool(cursor) if backward else has_more:
+            page.next_cursor = encode_cursor(last["created_at"], last["id"])
+    return page
+
+
+async def _message_count(conn: aiosqlite.Connection, conversation_id: str) -> int:
+    rows = await conn.execute_fetchall(
+        "SELECT message_count FROM conversation WHERE id = ?", (conversation_id,)
     )
-    conn.execute(
-        "UPDATE conversation SET updated_at = ? WHERE id = ?",
-        (now, conversation_id),
+    return rows[0][0] if rows else 0
+
+
+async def get_recent_messages(conversation_id: str, limit: int = 20) -> list[dict]:
+    """返回会话最新的 limit 条消息（按时间正序），优先命中历史缓存。
+
+    大字段只含 cards（上下文渲染只用到卡片）。
+    """
+    pool = await _get_pool()
+    cached = history_cache.get(conversation_id, limit)
+    if cached is not None:
+        # 本进程有未提交的写入时，缓存已包含这些消息而数据库计数尚未更新，此时以缓存为准
+        if _writes.has_pending(conversation_id):
+            return list(cached)
+        async with pool.reader() as conn:
+            count = await _message_count(conn, conversation_id)
+        if count == history_cache.message_count(conversation_id):
+            return list(cached)
+        history_cache.mark_stale(conversation_id)
+
+    generation = history_cache.generation(conversation_id)
+    window = max(limit, history_cache.window)
+    await _writes.wait_for(conversation_id)
+    async with pool.reader() as conn:
+        # 先读计数再读消息：期间若有其它进程写入，计数偏小，下次命中时会重新加载
+        count = await _message_count(conn, conversation_id)
+        rows = await conn.execute_fetchall(
+            f"""SELECT {_message_columns(_HISTORY_FIELDS)} FROM message
+                WHERE conversation_id = ?
+                ORDER BY created_at DESC, id DESC
+                LIMIT ?""",
+            (conversation_id, window),
+        )
+        messages = await _decode_rows(conn, rows[::-1], _HISTORY_FIELDS)
+    history_cache.put(
+        conversation_id, messages, complete=len(rows) < window, generation=generation, message_count=count,
     )
-    conn.commit()
-    conn.close()
-    return msg_id
+    return messages[-limit:] if limit > 0 else []
 
 
-def get_messages(conversation_id: str, limit: int = 50) -> list[dict]:
-    conn = _get_conn()
-    rows = conn.execute(
-        """SELECT * FROM message
-           WHERE conversation_id = ?
-           ORDER BY created_at ASC
-           LIMIT ?""",
-        (conversation_id, limit),
-    ).fetchall()
-    conn.close()
+async def get_messages_between(
+    conversation_id: str,
+    after: str | None,
+    before: str,
+    limit: int = 100,
+) -> list[dict]:
+    """返回 created_at 位于 (after, before) 区间内的消息（时间正序），大字段只含 cards"""
+    pool = await _get_pool()
+    await _writes.wait_for(conversation_id)
+    async with pool.reader() as conn:
+        rows = await conn.execute_fetchall(
+            f"""SELECT {_message_columns(_HISTORY_FIELDS)} FROM message
+                WHERE conversation_id = ? AND created_at > ? AND created_at < ?
+                ORDER BY created_at ASC, id ASC
+                LIMIT ?""",
+            (conversation_id, after or "", before, limit),
+        )
+        return await _decode_rows(conn, rows, _HISTORY_FIELDS)
+
+
+# ── 全文检索 ──────────────────────────────────────────
+
+async def search_messages(
+    query: str,
+    limit: int = 20,
+    cursor: str | None = None,
+    conversation_id: str | None = None,
+) -> tuple[list[dict], str | None]:
+    """按相关度（bm25，卡片标题权重更高）检索消息，返回 (结果, 下一页游标)。
+
+    只对最新的 SEARCH_MAX_CANDIDATES 条命中计算相关度并排序，高频词在海量历史中
+    的查询代价因此有上限。
+    """
+    expression = fts.match_expression(query)
+    if expression is None:
+        return [], None
+    offset = int(decode_cursor(cursor, 1)[0]) if cursor else 0
+    params: list = [expression]
+    where = "message_fts MATCH ?"
+    if conversation_id:
+        where += " AND rowid IN (SELECT rowid FROM message WHERE conversation_id = ?)"
+        params.append(conversation_id)
+
+    pool = await _get_pool()
+    async with pool.reader() as conn:
+        rows = await conn.execute_fetchall(
+            f"""SELECT m.id, m.conversation_id, m.role, m.content, m.cards_ref, m.created_at,
+                       c.title AS conversation_title, hit.score
+                FROM (
+                    SELECT rowid, bm25(message_fts, 1.0, 2.0) AS score
+                    FROM message_fts
+                    WHERE {where}
+                    ORDER BY rowid DESC
+                    LIMIT ?
+                ) AS hit
+                JOIN message m ON m.rowid = hit.rowid
+                JOIN conversation c ON c.id = m.conversation_id
+                ORDER BY hit.score
+                LIMIT ? OFFSET ?""",
+            (*params, settings.SEARCH_MAX_CANDIDATES, limit + 1, offset),
+        )
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        terms = [t.lower() for t in fts.query_terms(query)]
+        # 只命中卡片标题时，片段取自标题
+        title_only = {
+            r["cards_ref"] for r in rows
+            if r["cards_ref"] and not any(t in (r["content"] or "").lower() for t in terms)
+        }
+        cards = await _fetch_payloads(conn, title_only) if title_only else {}
+
     results = []
-    for r in rows:
-        d = dict(r)
-        for field in ("tool_calls", "cards", "follow_ups", "evidence"):
-            if d.get(field):
-                d[field] = json.loads(d[field])
-        results.append(d)
-    return results
+    for row in rows:
+        text = row["content"] or ""
+        if row["cards_ref"] in cards:
+            text = _card_titles(cards[row["cards_ref"]])
+        snippet, highlights = fts.snippet(text, query)
+        results.append({
+            "message_id": row["id"],
+            "conversation_id": row["conversation_id"],
+            "conversation_title": row["conversation_title"],
+            "role": row["role"],
+            "created_at": row["created_at"],
+            "snippet": snippet,
+            "highlights": highlights,
+            "score": round(-row["score"], 4),
+        })
+    next_cursor = encode_cursor(offset + limit) if has_more else None
+    return results, next_cursor
+
+
+# ── 会话摘要 ──────────────────────────────────────────
+
+def _summary_key(conversation_id: str) -> str:
+    # 摘要写入单独排队，读取摘要时只需等待摘要自身的写入，不会触发整条会话的 flush
+    return f"summary:{conversation_id}"
+
+
+async def get_summary(conversation_id: str) -> dict | None:
+    pool = await _get_pool()
+    await _writes.wait_for(_summary_key(conversation_id))
+    async with pool.reader() as conn:
+        async with conn.execute(
+            "SELECT * FROM conversation_summary WHERE conversation_id = ?",
+            (conversation_id,),
+        ) as cur:
+            row = await cur.fetchone()
+    return dict(row) if row else None
+
+
+async def save_summary(
+    conversation_id: str,
+    summary: str,
+    covered_until: str,
+    token_count: int,
+) -> None:
+    writes = await _get_writes()
+    writes.submit(_summary_key(conversation_id), [(
+        """INSERT INTO conversation_summary
+           (conversation_id, summary, covered_until, token_count, updated_at)
+           VALUES (?, ?, ?, ?, ?)
+           ON CONFLICT(conversation_id) DO UPDATE SET
+               summary = excluded.summary,
+               covered_until = excluded.covered_until,
+               token_count = excluded.token_count,
+               updated_at = excluded.updated_at""",
+        (conversation_id, summary, covered_until, token_count, datetime.now().isoformat()),
+    )])
+
+
+# ── LLM 响应缓存 ──────────────────────────────────────
+
+async def llm_cache_get(key: str, now: float) -> dict | None:
+    pool = await _get_pool()
+    async with pool.reader() as conn:
+        async with conn.execute(
+            "SELECT value, expires_at FROM llm_cache WHERE key = ? AND expires_at > ?",
+            (key, now),
+        ) as cur:
+            row = await cur.fetchone()
+    return dict(row) if row else None
+
+
+async def llm_cache_put(
+    key: str,
+    route: str,
+    schema_hash: str | None,
+    value: str,
+    expires_at: float,
+) -> None:
+    writes = await _get_writes()
+    writes.submit(None, [(
+        """INSERT OR REPLACE INTO llm_cache (key, route, schema_hash, value, created_at, expires_at)
+           VALUES (?, ?, ?, ?, ?, ?)""",
+        (key, route, schema_hash, value, datetime.now().timestamp(), expires_at),
+    )])
+
+
+async def llm_cache_delete(keep_schema_hash: str | None = None, now: float | None = None) -> None:
+    """keep_schema_hash 为空时清空全部；否则删除 Schema 不一致或已过期的条目"""
+    writes = await _get_writes()
+    if keep_schema_hash is None:
+        await writes.submit(None, [("DELETE FROM llm_cache", ())])
+    else:
+        await writes.submit(None, [(
+            """DELETE FROM llm_cache
+               WHERE (schema_hash IS NOT NULL AND schema_hash != ?) OR expires_at <= ?""",
+            (keep_schema_hash, now or 0),
+        )])
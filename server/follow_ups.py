@@ -0,0 +1,173 @@
+"""后续追问建议 — 脱离 SSE 主链路的后台生成
+
+回答结束后立即发送 done 并落库，追问建议在后台任务中生成：
+- 同一 SSE 流在 done 之后以迟到的 follow_ups 事件下发
+- 客户端断开后任务继续执行，结果写回消息记录，可通过
+  /api/conversations/{id}/messages/{mid}/follow_ups 获取
+- 以回答内容哈希为键做 LRU 缓存，相同回答不重复调用 LLM
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+
+from langchain_core.messages import HumanMessage
+from langchain_openai import ChatOpenAI
+
+from config import settings
+from serialization import loads
+import database as db
+
+logger = logging.getLogger("agent")
+
+
+# ── 生成 ──────────────────────────────────────────────
+
+def _parse_follow_ups(raw: str) -> list[str]:
+    """将 LLM 生成的后续建议（问题或话题）解析为列表。"""
+    if not raw:
+        return []
+
+    text = raw.strip()
+    if not text:
+        return []
+
+    # 优先 JSON 格式
+    try:
+        data = loads(text)
+        if isinstance(data, dict):
+            items = data.get("suggestions") or data.get("questions") or data.get("topics")
+        else:
+            items = data
+        if isinstance(items, list):
+            parsed = [str(i).strip() for i in items if str(i).strip()]
+            return parsed[:3]
+    except Exception:
+        pass
+
+    # 兜底：按行解析
+    result: list[str] = []
+    for line in text.splitlines():
+        cleaned = line.strip()
+        cleaned = cleaned.lstrip("-•")
+        cleaned = cleaned.strip()
+        cleaned = cleaned.removeprefix("1.").removeprefix("2.").removeprefix("3.").strip()
+        if cleaned:
+            result.append(cleaned)
+        if len(result) >= 3:
+            break
+    return result[:3]
+
+
+def _build_follow_up_prompt(user_msg: str, assistant_reply: str) -> str:
+    return f"""你是一个对话助手，请基于本轮问答生成 3 条后续建议。
+要求：
+1) 必须和用户当前主题强相关，帮助用户继续探索。
+2) 根据语境自动选择输出形态：
+   - 如果用户明显还在探索/比较/决策，输出“追问句”（建议以问号结尾）。
+   - 如果本轮回答已较完整，输出“关联话题短语”（不加句号、不加解释，不写完整陈述句）。
+3) 三条保持同一风格（全是追问句或全是话题短语），避免重复。
+4) 追问句建议 8-24 个中文字符；话题短语建议 4-12 个中文字符。
+5) 不要出现解释文字。
+6) 仅返回 JSON 数组字符串，例如：[\"建议1\", \"建议2\", \"建议3\"]
+
+用户问题：{user_msg}
+助手回答：{assistant_reply}
+"""
+
+
+async def _generate_follow_ups(llm: ChatOpenAI, user_msg: str, assistant_reply: str) -> list[str]:
+    """生成后续追问建议。"""
+    if not assistant_reply.strip():
+        return []
+
+    prompt = _build_follow_up_prompt(user_msg, assistant_reply)
+    try:
+        resp = await llm.ainvoke([HumanMessage(content=prompt)])
+        return _parse_follow_ups(resp.content or "")
+    except Exception:
+        return []
+
+
+# ── 缓存 ──────────────────────────────────────────────
+
+_cache: OrderedDict[str, list[str]] = OrderedDict()
+
+
+def _reply_key(assistant_reply: str) -> str:
+    return hashlib.sha256(assistant_reply.strip().encode("utf-8")).hexdigest()
+
+
+def _cache_get(key: str) -> list[str] | None:
+    follow_ups = _cache.get(key)
+    if follow_ups is not None:
+        _cache.move_to_end(key)
+    return follow_ups
+
+
+def _cache_put(key: str, follow_ups: list[str]) -> None:
+    _cache[key] = follow_ups
+    _cache.move_to_end(key)
+    while len(_cache) > settings.FOLLOW_UP_CACHE_SIZE:
+        _cache.popitem(last=False)
+
+
+# ── 后台任务 ──────────────────────────────────────────
+
+# message_id -> 生成任务；持有引用避免任务被 GC，完成后自动移除
+_pending: dict[str, asyncio.Task] = {}
+
+
+async def _run(
+    message_id: str,
+    conversation_id: str,
+    llm: ChatOpenAI,
+    user_msg: str,
+    assistant_reply: str,
+) -> list[str]:
+    key = _reply_key(assistant_reply)
+    follow_ups = _cache_get(key)
+    if follow_ups is None:
+        follow_ups = await _generate_follow_ups(llm, user_msg, assistant_reply)
+        if follow_ups:
+            _cache_put(key, follow_ups)
+
+    if follow_ups:
+        try:
+            await db.update_message_follow_ups(message_id, follow_ups, conversation_id)
+        except Exception as e:
+            logger.error(f"[FollowUps] 写回消息 {message_id} 失败: {e}")
+    return follow_ups
+
+
+def schedule(
+    message_id: str,
+    conversation_id: str,
+    llm: ChatOpenAI,
+    user_msg: str,
+    assistant_reply: str,
+) -> asyncio.Task:
+    """启动后台生成任务，立即返回，不阻塞当前流。"""
+    task = asyncio.create_task(_run(message_id, conversation_id, llm, user_msg, assistant_reply))
+    _pending[message_id] = task
+    task.add_done_callback(lambda _: _pending.pop(message_id, None))
+    return task
+
+
+async def wait(task: asyncio.Task, timeout: float) -> list[str]:
+    """等待任务结果；超时或失败返回空列表，任务本身不会被取消。"""
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), timeout=timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"[FollowUps] 等待超时 ({timeout}s)，转为后台完成")
+        return []
+    except Exception as e:
+        logger.error(f"[FollowUps] 生成失败: {e}")
+        return []
+
+
+def get_pending(message_id: str) -> asyncio.Task | None:
+    return _pending.get(message_id)
@@ -0,0 +1,83 @@
+"""会话历史全文检索的文本处理 — 为 SQLite FTS5 准备 n-gram 文本与查询
+
+FTS5 自带的 trigram 分词无法匹配两个字的中文词（如「结算」「宣推」），unicode61 又会把
+整段中文当成一个词。因此写入前在 Python 中把文本切成 token，再交给 unicode61 按空格切分：
+
+- 中日韩连续文本切成重叠的字 bigram，随后再追加该段的每个单字；英文 / 数字按词
+  （unicode61 负责小写）。单字放在整段 bigram 之后，不打断 bigram 之间的相邻关系
+- 查询中的每个词转换成由其 bigram 组成的短语（相邻即子串匹配），多个词之间为 AND；
+  单个汉字直接匹配单字 token（位于词尾的字也能查到，前缀查询做不到这一点）
+- FTS5 中存的是切分后的文本，片段（snippet）从原文截取并返回高亮区间
+"""
+
+from __future__ import annotations
+
+import re
+
+_RUN_RE = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯]+|[A-Za-z0-9]+")
+_CJK_RE = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯]")
+
+
+def _tokens(text: str) -> list[str]:
+    tokens: list[str] = []
+    for run in _RUN_RE.findall(text):
+        if not _CJK_RE.match(run) or len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+            tokens.extend(run)
+    return tokens
+
+
+def index_text(text: str | None) -> str:
+    """写入 FTS5 的文本"""
+    return " ".join(_tokens(text)) if text else ""
+
+
+def query_terms(query: str) -> list[str]:
+    """查询拆成词（空白分隔，再按文字 / 数字连续段切开）"""
+    return [run for part in query.split() for run in _RUN_RE.findall(part)]
+
+
+def match_expression(query: str) -> str | None:
+    """把用户输入转换成 FTS5 MATCH 表达式；没有可检索的词时返回 None"""
+    clauses = []
+    for term in query_terms(query):
+        if _CJK_RE.match(term) and len(term) > 1:
+            # 只用 bigram 组成短语，不带追加在段尾的单字
+            term_tokens = [term[i:i + 2] for i in range(len(term) - 1)]
+        else:
+            term_tokens = _tokens(term)
+        clauses.append('"' + " ".join(term_tokens) + '"')
+    return " AND ".join(clauses) if clauses else None
+
+
+def snippet(text: str, query: str, width: int = 60) -> tuple[str, list[tuple[int, int]]]:
+    """从原文截取包含首个命中词的片段，返回 (片段, 片段内高亮区间列表)"""
+    terms = [t.lower() for t in query_terms(query)]
+    lowered = text.lower()
+    positions = [p for p in (lowered.find(t) for t in terms) if p >= 0]
+    first = min(positions) if positions else 0
+    start = max(0, first - width // 3)
+    end = min(len(text), start + width)
+    start = max(0, min(start, end - width))
+    piece = text[start:end]
+
+    highlights: list[tuple[int, int]] = []
+    lowered_piece = piece.lower()
+    for term in terms:
+        pos = lowered_piece.find(term)
+        while pos >= 0:
+            highlights.append((pos, pos + len(term)))
+            pos = lowered_piece.find(term, pos + len(term))
+    highlights.sort()
+    merged: list[tuple[int, int]] = []
+    for s, e in highlights:
+        if merged and s <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], e))
+        else:
+            merged.append((s, e))
+
+    prefix = "…" if start > 0 else ""
+    suffix = "…" if end < len(text) else ""
+    return prefix + piece + suffix, [(s + len(prefix), e + len(prefix)) for s, e in merged]
@@ -0,0 +1,182 @@
+"""会话历史缓存 — 进程内 LRU + TTL，按总字节数限容
+
+每个会话缓存最近 HISTORY_CACHE_WINDOW 条已解码的消息：
+- 首次读取时从 SQLite 加载「最新」窗口，之后由写路径增量追加 / 更新
+- 条目超过 TTL 失效；总字节数超限时按 LRU 淘汰
+- 每个条目记录其对应的会话消息数；多 worker 部署时各进程独立缓存，命中后由调用方与
+  conversation.message_count 比对（见 database.get_recent_messages），其它进程写入的消息
+  会使条目失效并重新加载
+
+返回的消息 dict 与缓存共享，调用方不应修改。
+"""
+
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from serialization import dumps
+
+
+def estimate_size(message: dict) -> int:
+    """消息的近似内存占用（按 JSON 编码后的字节数估算）"""
+    return len(dumps(message, default=str))
+
+
+@dataclass
+class _Entry:
+    messages: list[dict]
+    sizes: list[int]
+    complete: bool          # True 表示已包含该会话的全部消息
+    expires_at: float
+    message_count: int      # 加载时数据库中的消息数 + 之后本进程追加的消息数
+    size: int = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.size = sum(self.sizes)
+
+
+class HistoryCache:
+    def __init__(self, window: int, max_bytes: int, ttl: float):
+        self.window = max(1, window)
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._total_bytes = 0
+        # 每次写入 / 失效递增，用于丢弃加载期间被并发修改的结果
+        self._generations: dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    # ── 读取 ──
+
+    def generation(self, conv_id: str) -> int:
+        return self._generations.get(conv_id, 0)
+
+    def get(self, conv_id: str, limit: int) -> list[dict] | None:
+        """返回最近 limit 条消息（按时间正序）；未命中返回 None"""
+        entry = self._entries.get(conv_id)
+        if entry is None or entry.expires_at < time.monotonic():
+            if entry is not None:
+                self._drop(conv_id)
+            self.misses += 1
+            return None
+        if limit > len(entry.messages) and not entry.complete:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(conv_id)
+        self.hits += 1
+        return entry.messages[-limit:] if limit > 0 else []
+
+    def message_count(self, conv_id: str) -> int | None:
+        """条目认为的会话消息总数；未缓存时返回 None"""
+        entry = self._entries.get(conv_id)
+        return entry.message_count if entry is not None else None
+
+    def mark_stale(self, conv_id: str) -> None:
+        """命中的条目与数据库不一致（其它进程写入）：丢弃，并把这次命中计为未命中"""
+        self.invalidate(conv_id)
+        self.hits -= 1
+        self.misses += 1
+        self.stale += 1
+
+    # ── 写入 ──
+
+    def put(
+        self,
+        conv_id: str,
+        messages: list[dict],
+        complete: bool,
+        generation: int,
+        message_count: int,
+    ) -> None:
+        """写入从数据库加载的最新窗口；message_count 为加载前读到的会话消息数。
+        加载期间若有并发写入则放弃"""
+        if generation != self.generation(conv_id):
+            return
+        messages = messages[-self.window:]
+        self._drop(conv_id)
+        entry = _Entry(
+            messages=list(messages),
+            sizes=[estimate_size(m) for m in messages],
+            complete=complete and len(messages) < self.window,
+            expires_at=time.monotonic() + self._ttl,
+            message_count=message_count,
+        )
+        self._entries[conv_id] = entry
+        self._total_bytes += entry.size
+        self._evict()
+
+    def append(self, conv_id: str, message: dict) -> None:
+        """写路径增量追加一条消息"""
+        self._bump(conv_id)
+        entry = self._entries.get(conv_id)
+        if entry is None:
+            return
+        size = estimate_size(message)
+        entry.message_count += 1
+        entry.messages.append(message)
+        entry.sizes.append(size)
+        entry.size += size
+        self._total_bytes += size
+        while len(entry.messages) > self.window:
+            entry.messages.pop(0)
+            removed = entry.sizes.pop(0)
+            entry.size -= removed
+            self._total_bytes -= removed
+            entry.complete = False
+        self._entries.move_to_end(conv_id)
+        self._evict()
+
+    def start_conversation(self, conv_id: str) -> None:
+        """新建会话：缓存一个空且完整的窗口，后续消息直接增量追加"""
+        self._bump(conv_id)
+        self._drop(conv_id)
+        self._entries[conv_id] = _Entry([], [], True, time.monotonic() + self._ttl, 0)
+
+    def update_message(self, conv_id: str, msg_id: str, **fields) -> None:
+        """原地更新缓存中的某条消息（如后台写回的 follow_ups）"""
+        self._bump(conv_id)
+        entry = self._entries.get(conv_id)
+        if entry is None:
+            return
+        for i, msg in enumerate(entry.messages):
+            if msg.get("id") == msg_id:
+                updated = {**msg, **fields}
+                size = estimate_size(updated)
+                entry.messages[i] = updated
+                entry.size += size - entry.sizes[i]
+                self._total_bytes += size - entry.sizes[i]
+                entry.sizes[i] = size
+                break
+        self._evict()
+
+    def invalidate(self, conv_id: str) -> None:
+        self._bump(conv_id)
+        self._drop(conv_id)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._generations.clear()
+        self._total_bytes = 0
+
+    # ── 内部 ──
+
+    def _bump(self, conv_id: str) -> None:
+        self._generations[conv_id] = self._generations.get(conv_id, 0) + 1
+
+    def _drop(self, conv_id: str) -> None:
+        entry = self._entries.pop(conv_id, None)
+        if entry is not None:
+            self._total_bytes -= entry.size
+
+    def _evict(self) -> None:
+        while self._total_bytes > self._max_bytes and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self._total_bytes -= entry.size
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
@@ -0,0 +1,72 @@
+"""意图识别 — 知识分类关键词与技能触发词合并成一个匹配器，每条消息只扫描一遍
+
+- 分类关键词（CATEGORY_KEYWORDS）用于知识检索的分类猜测
+- 技能触发词来自 SKILL.md 的 trigger_keywords，技能热加载后按快照版本重建匹配器
+- detect_intent() 返回命中的分类 / 技能及各自命中的关键词，供知识检索与技能路由共用
+"""
+
+from __future__ import annotations
+
+import threading
+from dataclasses import dataclass
+
+from keyword_matcher import KeywordMatcher
+from skill_loader import AgentSkill, skill_registry
+
+CATEGORY_KEYWORDS: dict[str, list[str]] = {
+    "入驻": ["入驻", "注册", "加入", "开通", "条件"],
+    "上传": ["上传", "格式", "文件", "提交", "发布"],
+    "审核": ["审核", "驳回", "等", "多久"],
+    "结算": ["结算", "钱", "收入", "提现"],
+    "版权": ["版权", "侵权", "维权"],
+    "活动": ["活动", "比赛", "奖"],
+}
+
+_CATEGORY = "category"
+_SKILL = "skill"
+
+
+@dataclass(frozen=True)
+class Intent:
+    # 分类 / 技能名 -> 命中的关键词（去重，按首次出现顺序）
+    categories: dict[str, list[str]]
+    skills: dict[str, list[str]]
+
+    @property
+    def category(self) -> str | None:
+        """按 CATEGORY_KEYWORDS 的顺序取第一个有命中的分类（与命中次数、出现位置无关）"""
+        return next((c for c in CATEGORY_KEYWORDS if c in self.categories), None)
+
+
+def build_matcher(skills: tuple[AgentSkill, ...] | list[AgentSkill]) -> KeywordMatcher:
+    patterns = [(kw, (_CATEGORY, cat)) for cat, kws in CATEGORY_KEYWORDS.items() for kw in kws]
+    patterns.extend((str(kw), (_SKILL, s.name)) for s in skills for kw in s.trigger_keywords)
+    return KeywordMatcher(patterns)
+
+
+_matcher_cache: tuple[int, KeywordMatcher] | None = None
+_matcher_lock = threading.Lock()
+
+
+def _get_matcher() -> KeywordMatcher:
+    """按技能快照版本缓存匹配器"""
+    global _matcher_cache
+    snapshot = skill_registry.snapshot()
+    cached = _matcher_cache
+    if cached is None or cached[0] != snapshot.version:
+        with _matcher_lock:
+            cached = _matcher_cache
+            if cached is None or cached[0] != snapshot.version:
+                cached = _matcher_cache = (snapshot.version, build_matcher(snapshot.skills))
+    return cached[1]
+
+
+def detect_intent(text: str) -> Intent:
+    categories: dict[str, list[str]] = {}
+    skills: dict[str, list[str]] = {}
+    for match in _get_matcher().iter_matches(text):
+        kind, name = match.label
+        hits = (categories if kind == _CATEGORY else skills).setdefault(name, [])
+        if match.keyword not in hits:
+            hits.append(match.keyword)
+    return Intent(categories, skills)
@@ -0,0 +1,82 @@
+"""多模式关键词匹配 — Aho-Corasick 自动机，一次扫描找出所有关键词
+
+- 构建一次（trie + 失败指针，输出集合沿失败链预先合并），之后每次匹配只顺序扫描文本一遍，
+  耗时与关键词数量无关
+- 每个关键词可挂多个标签（如同一个词既是分类关键词又是技能触发词）
+- 默认忽略大小写；重叠命中全部返回（「版权」与「维权」同时出现时都会命中）
+"""
+
+from __future__ import annotations
+
+from collections import deque
+from dataclasses import dataclass
+from typing import Hashable, Iterable, Iterator
+
+
+@dataclass(frozen=True)
+class Match:
+    start: int
+    end: int
+    keyword: str
+    label: Hashable
+
+
+class KeywordMatcher:
+    def __init__(self, keywords: Iterable[tuple[str, Hashable]], ignore_case: bool = True):
+        self._ignore_case = ignore_case
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        # 每个状态结束的 (关键词长度, 原始关键词, 标签)
+        self._outputs: list[list[tuple[int, str, Hashable]]] = [[]]
+        self._size = 0
+
+        seen: set[tuple[str, Hashable]] = set()
+        for keyword, label in keywords:
+            if not keyword or (keyword, label) in seen:
+                continue
+            seen.add((keyword, label))
+            self._size += 1
+            state = 0
+            for ch in self._fold(keyword):
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = self._goto[state][ch] = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._outputs.append([])
+                state = nxt
+            self._outputs[state].append((len(keyword), keyword, label))
+        self._link()
+
+    def _fold(self, text: str) -> str:
+        return text.lower() if self._ignore_case else text
+
+    def _link(self) -> None:
+        """BFS 计算失败指针，并把失败状态的输出并入当前状态"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                target = self._goto[f].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._outputs[nxt].extend(self._outputs[self._fail[nxt]])
+
+    def __len__(self) -> int:
+        return self._size
+
+    def iter_matches(self, text: str) -> Iterator[Match]:
+        goto, fail, outputs = self._goto, self._fail, self._outputs
+        state = 0
+        for i, ch in enumerate(self._fold(text)):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for length, keyword, label in outputs[state]:
+                yield Match(i + 1 - length, i + 1, keyword, label)
+
+    def find_all(self, text: str) -> list[Match]:
+        return list(self.iter_matches(text))
@@ -0,0 +1,196 @@
+"""LLM 响应缓存 — 以 Prompt 指纹为键，内存 LRU + SQLite 两级
+
+- 键：System Prompt、消息序列、绑定的工具 Schema、模型与温度的稳定哈希
+  （tool_call id 不参与计算，回放时重新生成）
+- 值：单轮 LLM 输出（文本 + tool_calls），命中时按小块回放为 token 事件
+- 按路由设置 TTL（快捷操作 / 普通对话），TTL ≤ 0 表示该路由不缓存
+- 技能重新加载或工具 Schema 变化时显式失效
+- 按路由统计命中 / 未命中（GET /api/llm-cache）
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Iterator
+
+from langchain_core.messages import AIMessage, BaseMessage
+
+from config import settings
+from serialization import dumps_str, loads
+import database as db
+
+logger = logging.getLogger("llm_cache")
+
+ROUTE_QUICK_ACTION = "quick_action"
+ROUTE_CHAT = "chat"
+
+
+@dataclass(frozen=True)
+class CachedCompletion:
+    content: str
+    tool_calls: tuple[dict, ...]
+    expires_at: float
+
+    def to_message(self) -> AIMessage:
+        """还原为 AIMessage，tool_call id 重新生成"""
+        return AIMessage(
+            content=self.content,
+            tool_calls=[
+                {"name": tc["name"], "args": tc["args"], "id": f"call_{uuid.uuid4().hex[:24]}"}
+                for tc in self.tool_calls
+            ],
+        )
+
+
+_memory: OrderedDict[str, CachedCompletion] = OrderedDict()
+# 路由 -> 命中 / 未命中次数
+_hits: dict[str, int] = {}
+_misses: dict[str, int] = {}
+
+
+# ── 键 ────────────────────────────────────────────────
+
+def _canonical_message(message: BaseMessage) -> dict[str, Any]:
+    item: dict[str, Any] = {"type": message.type, "content": message.content}
+    tool_calls = getattr(message, "tool_calls", None)
+    if tool_calls:
+        item["tool_calls"] = [{"name": tc["name"], "args": tc["args"]} for tc in tool_calls]
+    return item
+
+
+def make_key(
+    messages: list[BaseMessage],
+    model: str,
+    temperature: float,
+    tool_schema_hash: str | None,
+) -> str:
+    payload = {
+        "model": model,
+        "temperature": temperature,
+        "tools": tool_schema_hash or "",
+        "messages": [_canonical_message(m) for m in messages],
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def route_ttl(route: str) -> float:
+    if route == ROUTE_QUICK_ACTION:
+        return settings.LLM_CACHE_TTL_QUICK_ACTION
+    return settings.LLM_CACHE_TTL_CHAT
+
+
+# ── 读写 ──────────────────────────────────────────────
+
+def _remember(key: str, entry: CachedCompletion) -> None:
+    _memory[key] = entry
+    _memory.move_to_end(key)
+    while len(_memory) > settings.LLM_CACHE_MEMORY_SIZE:
+        _memory.popitem(last=False)
+
+
+async def get(key: str, route: str = ROUTE_CHAT) -> CachedCompletion | None:
+    """先查内存，再查 SQLite；过期条目视为未命中。route 只用于命中统计"""
+    now = time.time()
+    entry = _memory.get(key)
+    if entry is not None:
+        if entry.expires_at > now:
+            _memory.move_to_end(key)
+            _hits[route] = _hits.get(route, 0) + 1
+            return entry
+        del _memory[key]
+
+    row = await db.llm_cache_get(key, now)
+    if row is None:
+        _misses[route] = _misses.get(route, 0) + 1
+        return None
+    value = loads(row["value"])
+    entry = CachedCompletion(value["content"], tuple(value["tool_calls"]), row["expires_at"])
+    _remember(key, entry)
+    _hits[route] = _hits.get(route, 0) + 1
+    return entry
+
+
+async def put(key: str, route: str, response: BaseMessage, tool_schema_hash: str | None) -> None:
+    ttl = route_ttl(route)
+    if ttl <= 0:
+        return
+    content = response.content if isinstance(response.content, str) else ""
+    tool_calls = [{"name": tc["name"], "args": tc["args"]} for tc in getattr(response, "tool_calls", [])]
+    if not content and not tool_calls:
+        return
+    expires_at = time.time() + ttl
+    entry = CachedCompletion(content, tuple(tool_calls), expires_at)
+    _remember(key, entry)
+    await db.llm_cache_put(
+        key,
+        route,
+        tool_schema_hash,
+        dumps_str({"content": content, "tool_calls": tool_calls}),
+        expires_at,
+    )
+
+
+def replay_chunks(content: str) -> Iterator[str]:
+    """将缓存文本切成小块，模拟流式输出"""
+    size = max(1, settings.LLM_CACHE_REPLAY_CHUNK)
+    for i in range(0, len(content), size):
+        yield content[i:i + size]
+
+
+def stats() -> dict[str, Any]:
+    """各路由的命中次数、未命中次数与命中率，以及内存层条目数"""
+    routes = {}
+    for route in (ROUTE_QUICK_ACTION, ROUTE_CHAT):
+        hit, miss = _hits.get(route, 0), _misses.get(route, 0)
+        routes[route] = {
+            "ttl": route_ttl(route),
+            "hits": hit,
+            "misses": miss,
+            "hit_ratio": round(hit / (hit + miss), 3) if hit + miss else 0.0,
+        }
+    return {"memory_size": len(_memory), "routes": routes}
+
+
+# ── 失效 ──────────────────────────────────────────────
+
+async def invalidate(keep_schema_hash: str | None = None) -> None:
+    """清空缓存；给定 keep_schema_hash 时只清除 SQLite 中 Schema 不一致或已过期的条目"""
+    _memory.clear()
+    await db.llm_cache_delete(keep_schema_hash=keep_schema_hash, now=time.time())
+    logger.info("[LLMCache] 已清理缓存" if keep_schema_hash is None else "[LLMCache] 已清理过期与 Schema 不一致的缓存")
+
+
+# 后台失效任务的强引用（事件循环只持有弱引用）
+_pending: set[asyncio.Task] = set()
+
+
+def schedule_invalidate() -> asyncio.Task | None:
+    """在当前事件循环后台清空缓存；不在事件循环中时返回 None"""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+    async def _run() -> None:
+        try:
+            await invalidate()
+        except Exception as e:
+            logger.error(f"[LLMCache] 后台清理缓存失败: {e}")
+
+    task = loop.create_task(_run())
+    _pending.add(task)
+    task.add_done_callback(_pending.discard)
+    return task
+
+
+def invalidate_memory() -> None:
+    """同步清空内存层（技能变更回调中使用；SQLite 层的旧条目因键包含 System Prompt 不会再命中）"""
+    _memory.clear()
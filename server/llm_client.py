@@ -0,0 +1,218 @@
+"""LLM 客户端注册表 — 进程级复用模型实例、HTTP 连接池与工具 Schema
+
+- 同一组 LLM 配置只创建一次 ChatOpenAI，所有请求共享
+- 所有模型共用一个调优过的 httpx.AsyncClient（连接数上限、keep-alive、可选 HTTP/2），
+  避免每轮对话重新握手 TLS
+- 工具 Schema 只转换一次，缓存绑定好工具的 Runnable 及其序列化结果
+- 流式响应携带 usage（LLM_STREAM_USAGE），统计服务商 Prompt 前缀缓存的命中 token 与首 token 延迟
+- 应用关闭时统一释放连接池
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any
+
+import httpx
+from langchain_core.runnables import Runnable
+from langchain_core.tools import BaseTool
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from langchain_openai import ChatOpenAI
+
+from config import settings
+
+logger = logging.getLogger("llm_client")
+
+
+@dataclass(frozen=True)
+class LLMProfile:
+    """决定模型实例身份的配置组合"""
+    api_key: str
+    base_url: str
+    model: str
+    temperature: float
+
+    @classmethod
+    def from_settings(cls) -> LLMProfile:
+        return cls(
+            api_key=settings.LLM_API_KEY,
+            base_url=settings.LLM_BASE_URL,
+            model=settings.LLM_MODEL,
+            temperature=settings.LLM_TEMPERATURE,
+        )
+
+
+@dataclass
+class _ToolSchema:
+    schemas: list[dict[str, Any]]
+    schema_json: str
+    schema_hash: str
+
+
+_http_client: httpx.AsyncClient | None = None
+_models: dict[LLMProfile, ChatOpenAI] = {}
+_schemas: dict[tuple[str, ...], _ToolSchema] = {}
+_bindings: dict[tuple[LLMProfile, tuple[str, ...]], Runnable] = {}
+
+
+# ── HTTP 连接池 ───────────────────────────────────────
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        http2 = settings.LLM_HTTP2
+        if http2 and not _http2_available():
+            logger.warning("[LLM] 已开启 LLM_HTTP2 但未安装 h2，回退到 HTTP/1.1")
+            http2 = False
+        _http_client = httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=settings.LLM_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.LLM_HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=settings.LLM_HTTP_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(settings.LLM_HTTP_TIMEOUT, connect=10.0),
+        )
+    return _http_client
+
+
+# ── 模型与工具绑定 ─────────────────────────────────────
+
+def get_llm(profile: LLMProfile | None = None) -> ChatOpenAI:
+    """返回该配置对应的共享 ChatOpenAI 实例"""
+    profile = profile or LLMProfile.from_settings()
+    llm = _models.get(profile)
+    if llm is None:
+        llm = ChatOpenAI(
+            api_key=profile.api_key,
+            base_url=profile.base_url,
+            model=profile.model,
+            temperature=profile.temperature,
+            streaming=True,
+            stream_usage=settings.LLM_STREAM_USAGE,
+            http_async_client=_get_http_client(),
+        )
+        _models[profile] = llm
+        logger.info(f"[LLM] 创建模型实例: {profile.model} @ {profile.base_url}")
+    return llm
+
+
+def _get_schema(tools: list[BaseTool]) -> _ToolSchema:
+    key = tuple(t.name for t in tools)
+    schema = _schemas.get(key)
+    if schema is None:
+        schemas = [convert_to_openai_tool(t) for t in tools]
+        schema_json = json.dumps(schemas, ensure_ascii=False, sort_keys=True)
+        schema = _ToolSchema(
+            schemas=schemas,
+            schema_json=schema_json,
+            schema_hash=hashlib.sha256(schema_json.encode("utf-8")).hexdigest(),
+        )
+        _schemas[key] = schema
+    return schema
+
+
+def get_llm_with_tools(tools: list[BaseTool], profile: LLMProfile | None = None) -> Runnable:
+    """返回预先绑定好工具的 Runnable（Schema 只转换一次）"""
+    profile = profile or LLMProfile.from_settings()
+    key = (profile, tuple(t.name for t in tools))
+    runnable = _bindings.get(key)
+    if runnable is None:
+        runnable = get_llm(profile).bind_tools(_get_schema(tools).schemas)
+        _bindings[key] = runnable
+    return runnable
+
+
+def get_tool_schemas(tools: list[BaseTool]) -> list[dict[str, Any]]:
+    """返回缓存的 OpenAI 格式工具 Schema"""
+    return _get_schema(tools).schemas
+
+
+def get_tool_schema_hash(tools: list[BaseTool]) -> str:
+    """工具 Schema 序列化结果的哈希，可作为缓存键的一部分"""
+    return _get_schema(tools).schema_hash
+
+
+# ── Prompt 前缀缓存统计 ────────────────────────────────
+
+@dataclass(frozen=True)
+class PromptUsage:
+    input_tokens: int
+    cached_tokens: int
+
+    @property
+    def hit_ratio(self) -> float:
+        return self.cached_tokens / self.input_tokens if self.input_tokens else 0.0
+
+
+def parse_usage(message: Any) -> PromptUsage | None:
+    """从 LLM 响应中解析输入 token 与命中前缀缓存的 token（服务商未返回 usage 时为 None）"""
+    usage = getattr(message, "usage_metadata", None)
+    if not usage:
+        return None
+    details = usage.get("input_token_details") or {}
+    return PromptUsage(
+        input_tokens=int(usage.get("input_tokens") or 0),
+        cached_tokens=int(details.get("cache_read") or 0),
+    )
+
+
+class PromptCacheStats:
+    """按是否命中前缀缓存分组累计首 token 延迟，便于对比缓存对延迟的影响"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.input_tokens = 0
+        self.cached_tokens = 0
+        self._ttft = {"hit": [0, 0.0], "miss": [0, 0.0]}
+
+    def record(self, usage: PromptUsage, ttft: float | None) -> None:
+        with self._lock:
+            self.calls += 1
+            self.input_tokens += usage.input_tokens
+            self.cached_tokens += usage.cached_tokens
+            if ttft is not None:
+                bucket = self._ttft["hit" if usage.cached_tokens else "miss"]
+                bucket[0] += 1
+                bucket[1] += ttft
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "input_tokens": self.input_tokens,
+                "cached_tokens": self.cached_tokens,
+                "hit_ratio": round(self.cached_tokens / self.input_tokens, 3) if self.input_tokens else 0.0,
+                "avg_ttft_ms": {
+                    name: round(total / count * 1000, 1) if count else None
+                    for name, (count, total) in self._ttft.items()
+                },
+            }
+
+
+prompt_cache_stats = PromptCacheStats()
+
+
+# ── 生命周期 ──────────────────────────────────────────
+
+async def aclose() -> None:
+    """释放连接池并清空注册表（应用关闭时调用）"""
+    global _http_client
+    _bindings.clear()
+    _models.clear()
+    if _http_client is not None and not _http_client.is_closed:
+        await _http_client.aclose()
+    _http_client = None
@@ -2,14 +2,26 @@
 
 from __future__ import annotations
 
-from fastapi import FastAPI, HTTPException
+import asyncio
+
+from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
 from config import settings
+import context_builder
 import database as db
-from agent import chat
+import follow_ups
+import llm_cache
+import llm_client
+from serialization import JSONBytesResponse, dumps, json_response
+from skill_loader import skill_registry
+from skill_router import skill_router
+from tools import cache as tool_cache
+from tools.knowledge import kb_index
+from tools.ragflow_client import ragflow_client
+from agent import ALL_TOOLS, QUICK_ACTIONS, chat
 
 # ── App ───────────────────────────────────────────────
 
@@ -17,6 +29,7 @@ app = FastAPI(
     title="音乐人 AI 助手",
     description="腾讯音乐人 AI 助手 MVP — 工作流 Copilot",
     version="0.1.0",
+    default_response_class=JSONBytesResponse,
 )
 
 app.add_middleware(
@@ -25,6 +38,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Prev-Cursor"],
 )
 
 
@@ -32,7 +46,42 @@ app.add_middleware(
 
 @app.on_event("startup")
 async def startup():
-    db.init_db()
+    await db.init_db()
+    skill_registry.snapshot()
+    # 加载（必要时增量重建）知识库索引
+    await asyncio.to_thread(kb_index.get)
+    # 清理工具 Schema 已变化或已过期的 LLM 缓存
+    await llm_cache.invalidate(keep_schema_hash=llm_client.get_tool_schema_hash(ALL_TOOLS))
+
+
+def _on_skills_reloaded(snapshot) -> None:
+    """技能变更后 System Prompt 随之变化，旧的 LLM 缓存不再有效"""
+    if snapshot.version > 1:
+        llm_cache.invalidate_memory()
+        llm_cache.schedule_invalidate()
+
+
+skill_registry.add_listener(_on_skills_reloaded)
+
+
+async def _drain_background_tasks(timeout: float) -> None:
+    """等待追问生成、摘要折叠与缓存清理任务写完数据库；超时未完成的取消"""
+    tasks = [*follow_ups._pending.values(), *context_builder._folding.values(), *llm_cache._pending]
+    if not tasks:
+        return
+    _, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    # 后台任务仍会调用 LLM 并写库，须在关闭连接池与写队列之前结束
+    await _drain_background_tasks(settings.SHUTDOWN_TASK_TIMEOUT)
+    await llm_client.aclose()
+    await ragflow_client.aclose()
+    await db.close_db()
 
 
 # ── 请求模型 ──────────────────────────────────────────
@@ -40,6 +89,12 @@ async def startup():
 class ChatRequest(BaseModel):
     message: str
     conversation_id: str | None = None
+    coalesce: bool = True  # 合并 token 帧；对时延敏感的客户端可关闭
+
+
+# 固定响应体预先编码
+_OK = dumps({"status": "ok"})
+_QUICK_ACTIONS = dumps(QUICK_ACTIONS)
 
 
 # ── 路由：对话 ─────────────────────────────────────────
@@ -51,7 +106,7 @@ async def chat_endpoint(req: ChatRequest):
         raise HTTPException(status_code=400, detail="消息不能为空")
 
     return StreamingResponse(
-        chat(req.message, req.conversation_id),
+        chat(req.message, req.conversation_id, coalesce=req.coalesce),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -64,72 +119,173 @@ async def chat_endpoint(req: ChatRequest):
 # ── 路由：会话管理 ─────────────────────────────────────
 
 @app.get("/api/conversations")
-async def list_conversations():
-    """获取会话列表"""
-    return db.list_conversations()
+async def list_conversations(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: str | None = None,
+):
+    """获取会话列表（按最近更新倒序）；下一页游标通过 X-Next-Cursor 响应头返回"""
+    try:
+        items, next_cursor = await db.list_conversations(limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return json_response(items, headers=headers)
 
 
 @app.get("/api/conversations/{conv_id}")
 async def get_conversation(conv_id: str):
     """获取会话详情"""
-    conv = db.get_conversation(conv_id)
+    conv = await db.get_conversation(conv_id)
     if not conv:
         raise HTTPException(status_code=404, detail="会话不存在")
-    return conv
+    return json_response(conv)
 
 
 @app.get("/api/conversations/{conv_id}/messages")
-async def get_messages(conv_id: str):
-    """获取会话消息列表"""
-    conv = db.get_conversation(conv_id)
+async def get_messages(
+    conv_id: str,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: str | None = None,
+    direction: str = Query("forward", pattern="^(forward|backward)$"),
+    include_payloads: bool = True,
+):
+    """获取会话消息列表（时间正序）。
+
+    direction=forward 从 cursor 之后（默认从头）读取，backward 读取 cursor 之前（默认最新）的消息；
+    翻页游标通过 X-Next-Cursor（更新的消息）/ X-Prev-Cursor（更早的消息）响应头返回。
+    include_payloads=false 时不返回 tool_calls / cards / evidence。
+    """
+    conv = await db.get_conversation(conv_id)
     if not conv:
         raise HTTPException(status_code=404, detail="会话不存在")
-    return db.get_messages(conv_id)
+    try:
+        page = await db.get_messages(
+            conv_id, limit, cursor, backward=direction == "backward", include_payloads=include_payloads,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = {}
+    if page.next_cursor:
+        headers["X-Next-Cursor"] = page.next_cursor
+    if page.prev_cursor:
+        headers["X-Prev-Cursor"] = page.prev_cursor
+    return json_response(page.messages, headers=headers)
+
+
+@app.get("/api/conversations/{conv_id}/messages/{msg_id}/follow_ups")
+async def get_follow_ups(conv_id: str, msg_id: str, wait: float = 0):
+    """获取消息的后续追问建议（后台生成，可选等待 wait 秒）"""
+    msg = await db.get_message(msg_id, conv_id)
+    if not msg or msg["conversation_id"] != conv_id:
+        raise HTTPException(status_code=404, detail="消息不存在")
+    if msg.get("follow_ups"):
+        return json_response({"message_id": msg_id, "status": "ready", "questions": msg["follow_ups"]})
+
+    task = follow_ups.get_pending(msg_id)
+    if task is None:
+        return json_response({"message_id": msg_id, "status": "ready", "questions": []})
+    if wait > 0:
+        questions = await follow_ups.wait(task, min(wait, settings.FOLLOW_UP_TIMEOUT))
+        if task.done():
+            return json_response({"message_id": msg_id, "status": "ready", "questions": questions})
+    return json_response({"message_id": msg_id, "status": "pending", "questions": []})
+
+
+@app.get("/api/search")
+async def search(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: str | None = None,
+    conversation_id: str | None = None,
+):
+    """全文检索历史消息（正文与卡片标题），按相关度排序；下一页游标见 X-Next-Cursor"""
+    try:
+        results, next_cursor = await db.search_messages(q, limit, cursor, conversation_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return json_response(results, headers=headers)
 
 
 @app.delete("/api/conversations/{conv_id}")
 async def delete_conversation(conv_id: str):
     """删除会话"""
-    conv = db.get_conversation(conv_id)
+    conv = await db.get_conversation(conv_id)
     if not conv:
         raise HTTPException(status_code=404, detail="会话不存在")
-    db.delete_conversation(conv_id)
-    return {"status": "ok"}
+    await db.delete_conversation(conv_id)
+    return json_response(_OK)
 
 
 # ── 路由：系统 ─────────────────────────────────────────
 
 @app.get("/api/health")
 async def health():
-    return {"status": "ok", "version": "0.1.0"}
+    return json_response({"status": "ok", "version": "0.1.0"})
 
 
 @app.get("/api/quick-actions")
 async def quick_actions():
     """获取首页快捷操作"""
-    return [
-        {"id": "trends", "icon": "🔥", "label": "热点趋势", "prompt": "最近有什么热点可以用来创作？"},
-        {"id": "promote", "icon": "🚀", "label": "推歌建议", "prompt": "帮我分析一下我该推哪首歌"},
-        {"id": "portrait", "icon": "👥", "label": "听众画像", "prompt": "帮我看看我的听众画像"},
-        {"id": "data", "icon": "📊", "label": "数据分析", "prompt": "最近播放量有什么变化？"},
-        {"id": "creation_flow", "icon": "✨", "label": "全流程创作", "prompt": "帮我从热点到创作一条龙完成"},
-        {"id": "promo_flow", "icon": "📋", "label": "全链路宣推", "prompt": "帮我做一套完整宣推方案"},
-    ]
+    return json_response(_QUICK_ACTIONS)
+
+
+@app.get("/api/llm-cache")
+async def get_llm_cache_stats():
+    """LLM 响应缓存各路由（快捷操作 / 普通对话）的命中统计"""
+    return json_response(llm_cache.stats())
+
+
+@app.delete("/api/llm-cache")
+async def clear_llm_cache():
+    """手动清空 LLM 响应缓存"""
+    await llm_cache.invalidate()
+    return json_response(_OK)
+
+
+@app.get("/api/llm/prompt-cache")
+async def get_prompt_cache_stats():
+    """服务商 Prompt 前缀缓存命中率与首 token 延迟"""
+    return json_response(llm_client.prompt_cache_stats.stats())
+
+
+@app.get("/api/tool-cache")
+async def get_tool_cache_stats():
+    """各工具结果缓存的命中统计"""
+    return json_response(tool_cache.stats())
+
+
+@app.delete("/api/tool-cache")
+async def clear_tool_cache(tool: str | None = None):
+    """清空工具结果缓存（可指定工具名）"""
+    tool_cache.clear(tool)
+    return json_response(_OK)
+
+
+@app.get("/api/ragflow/metrics")
+async def get_ragflow_metrics():
+    """RAGFlow 请求结果计数、延迟分位数与熔断器状态"""
+    return json_response(ragflow_client.metrics())
 
 
 @app.get("/api/skills")
 async def list_skills():
     """获取可用的 Skills 列表"""
-    from skill_loader import load_all_skills
-    skills = load_all_skills()
-    return [
+    skills = skill_registry.snapshot().skills
+    return json_response([
         {
             "name": s.name,
             "description": s.description,
             "trigger_keywords": s.trigger_keywords,
         }
         for s in skills
-    ]
+    ])
+
+
+@app.get("/api/skills/routing")
+async def get_skill_routing_stats():
+    """技能路由累计节省的 Prompt token"""
+    return json_response(skill_router.stats())
 
 
 # ── 启动 ──────────────────────────────────────────────
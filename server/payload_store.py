@@ -0,0 +1,96 @@
+"""消息大字段存储 — tool_calls / cards / evidence 压缩后存入 payload 表，按内容哈希去重
+
+- 编码：紧凑 JSON（UTF-8，见 serialization），超过 PAYLOAD_COMPRESS_MIN_BYTES 时 zlib 压缩，
+  codec 列记录编码方式
+- 去重：以 JSON 的 blake2b 哈希为主键，同一份工具结果（如重复查询的同一份报告）只存一份；
+  message 表的 *_ref 列保存哈希，引用计数由触发器维护
+- 按需解码：读取时只取出并解压请求的字段；payload 按哈希寻址、内容不可变，解码结果进入
+  进程内 LRU（按原始字节数限容），同一份 payload 在进程内只解码一次
+
+解码结果与缓存共享，调用方不应修改。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+
+from config import settings
+from serialization import dumps, loads
+
+PAYLOAD_FIELDS = ("tool_calls", "cards", "evidence")
+
+CODEC_JSON = "json"
+CODEC_ZLIB = "zlib"
+
+
+@dataclass(frozen=True)
+class EncodedPayload:
+    hash: str
+    codec: str
+    data: bytes
+    raw_size: int
+
+
+def encode(value: Any) -> EncodedPayload:
+    raw = dumps(value)
+    digest = hashlib.blake2b(raw, digest_size=16).hexdigest()
+    if len(raw) >= settings.PAYLOAD_COMPRESS_MIN_BYTES:
+        compressed = zlib.compress(raw, settings.PAYLOAD_COMPRESS_LEVEL)
+        if len(compressed) < len(raw):
+            return EncodedPayload(digest, CODEC_ZLIB, compressed, len(raw))
+    return EncodedPayload(digest, CODEC_JSON, raw, len(raw))
+
+
+def decode(codec: str, data: bytes) -> Any:
+    if codec == CODEC_ZLIB:
+        data = zlib.decompress(data)
+    elif codec != CODEC_JSON:
+        raise ValueError(f"未知的 payload 编码: {codec}")
+    return loads(data)
+
+
+class DecodedCache:
+    """哈希 -> 解码结果的 LRU，按原始 JSON 字节数限容"""
+
+    def __init__(self, max_bytes: int):
+        self._max_bytes = max_bytes
+        self._entries: OrderedDict[str, tuple[Any, int]] = OrderedDict()
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, digest: str) -> tuple[bool, Any]:
+        entry = self._entries.get(digest)
+        if entry is None:
+            self.misses += 1
+            return False, None
+        self._entries.move_to_end(digest)
+        self.hits += 1
+        return True, entry[0]
+
+    def put(self, digest: str, value: Any, size: int) -> None:
+        if size > self._max_bytes:
+            return
+        old = self._entries.pop(digest, None)
+        if old is not None:
+            self._total_bytes -= old[1]
+        self._entries[digest] = (value, size)
+        self._total_bytes += size
+        while self._total_bytes > self._max_bytes and self._entries:
+            _, (_, removed) = self._entries.popitem(last=False)
+            self._total_bytes -= removed
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._total_bytes = 0
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+
+decoded_cache = DecodedCache(settings.PAYLOAD_CACHE_MAX_BYTES)
@@ -0,0 +1,51 @@
+"""本地 RAGFlow 桩服务 — 模拟延迟、长尾与故障，用于验证重试 / 熔断 / 对冲
+
+用法：
+    python ragflow_stub.py --port 9380 --latency 200 --slow-rate 0.1 --slow-latency 8000 --error-rate 0.05
+
+然后以 RAGFLOW_BASE_URL=http://localhost:9380 RAGFLOW_API_KEY=stub 启动后端或运行 test_ragflow.py，
+通过 GET /api/ragflow/metrics 观察延迟分位数、重试次数、熔断与对冲命中情况。
+"""
+
+import argparse
+import asyncio
+import random
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+parser = argparse.ArgumentParser(description="RAGFlow retrieval stub")
+parser.add_argument("--host", default="127.0.0.1")
+parser.add_argument("--port", type=int, default=9380)
+parser.add_argument("--latency", type=float, default=100, help="基础延迟（毫秒）")
+parser.add_argument("--jitter", type=float, default=50, help="延迟抖动上限（毫秒）")
+parser.add_argument("--slow-rate", type=float, default=0.0, help="长尾请求比例")
+parser.add_argument("--slow-latency", type=float, default=8000, help="长尾请求延迟（毫秒）")
+parser.add_argument("--error-rate", type=float, default=0.0, help="返回 503 的比例")
+parser.add_argument("--down", action="store_true", help="所有请求返回 503")
+args = parser.parse_args()
+
+app = FastAPI()
+
+
+@app.post("/api/v1/retrieval")
+async def retrieval(request: Request):
+    body = await request.json()
+    if args.down or random.random() < args.error_rate:
+        return JSONResponse({"code": 503, "message": "stub unavailable"}, status_code=503)
+
+    latency = args.slow_latency if random.random() < args.slow_rate else args.latency
+    await asyncio.sleep((latency + random.uniform(0, args.jitter)) / 1000)
+
+    question = body.get("question", "")
+    top_k = int(body.get("top_k", 5))
+    chunks = [
+        {"content": f"[stub] 与「{question}」相关的文档片段 #{i + 1}", "document_name": f"stub-doc-{i + 1}.md"}
+        for i in range(min(top_k, 3))
+    ]
+    return {"code": 0, "data": {"chunks": chunks, "total": len(chunks)}}
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,77 @@
+"""JSON 序列化 — REST 响应、SSE 帧与数据库 JSON 列共用
+
+- 优先使用 orjson（C 实现，直接输出 UTF-8 字节），未安装时回退到标准库 json；两者输出一致：
+  紧凑分隔符、不转义非 ASCII 字符
+- pydantic 模型、datetime、set 等非 JSON 原生类型由 _default 转换
+- JSONBytesResponse：路由直接返回时跳过 FastAPI 的 jsonable_encoder，数据只编码一次
+"""
+
+from __future__ import annotations
+
+import json
+from datetime import date, datetime
+from typing import Any, Callable, Mapping
+
+from fastapi import Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson 为可选依赖
+    orjson = None
+
+
+def _default(obj: Any) -> Any:
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump(mode="json")
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    raise TypeError(f"无法序列化的类型: {type(obj).__name__}")
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj: Any, default: Callable[[Any], Any] | None = None) -> bytes:
+        """JSON 编码为 UTF-8 字节"""
+        return orjson.dumps(obj, default=default or _default, option=_ORJSON_OPTIONS)
+
+    def loads(data: str | bytes | bytearray | memoryview) -> Any:
+        return orjson.loads(data)
+
+else:
+    def dumps(obj: Any, default: Callable[[Any], Any] | None = None) -> bytes:
+        """JSON 编码为 UTF-8 字节"""
+        return json.dumps(
+            obj, ensure_ascii=False, separators=(",", ":"), default=default or _default,
+        ).encode("utf-8")
+
+    def loads(data: str | bytes | bytearray | memoryview) -> Any:
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return json.loads(data)
+
+
+def dumps_str(obj: Any) -> str:
+    """JSON 编码为字符串（SQLite TEXT 列、LLM 消息内容等）"""
+    return dumps(obj).decode("utf-8")
+
+
+class JSONBytesResponse(Response):
+    """用 dumps 编码的 JSON 响应；content 为 bytes 时视为已编码，原样写出"""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return dumps(content)
+
+
+def json_response(
+    content: Any,
+    status_code: int = 200,
+    headers: Mapping[str, str] | None = None,
+) -> JSONBytesResponse:
+    return JSONBytesResponse(content, status_code=status_code, headers=headers)
@@ -2,12 +2,19 @@
 
 from __future__ import annotations
 
+import logging
 import os
+import threading
+import time
 from pathlib import Path
 from dataclasses import dataclass
 
 import yaml
 
+from config import settings
+
+logger = logging.getLogger("skill_loader")
+
 # 假设项目根目录
 PROJECT_ROOT = Path(__file__).parent.parent
 SKILLS_DIR = PROJECT_ROOT / ".agents" / "skills"
@@ -23,15 +30,15 @@ class AgentSkill:
     folder_path: str
 
 
-def load_all_skills() -> list[AgentSkill]:
+def load_all_skills(skills_dir: Path = SKILLS_DIR) -> list[AgentSkill]:
     """扫描目录，解析所有 SKILL.md"""
     skills = []
 
-    if not SKILLS_DIR.exists() or not SKILLS_DIR.is_dir():
+    if not skills_dir.exists() or not skills_dir.is_dir():
         return skills
 
-    # 遍历 .agents/skills 下的所有子文件夹
-    for entry in os.scandir(SKILLS_DIR):
+    # 遍历 .agents/skills 下的所有子文件夹（按目录名排序，保证 Prompt 中的技能顺序稳定）
+    for entry in sorted(os.scandir(skills_dir), key=lambda e: e.name):
         if entry.is_dir():
             skill_md_path = Path(entry.path) / "SKILL.md"
             if skill_md_path.exists() and skill_md_path.is_file():
@@ -85,3 +92,108 @@ def _parse_skill_md(content: str, folder_path: str) -> AgentSkill | None:
         trigger_keywords=trigger_keywords,
         folder_path=folder_path,
     )
+
+
+# ── 技能注册表（缓存 + 热加载） ─────────────────────────
+
+def render_skills_prompt(skills: tuple[AgentSkill, ...] | list[AgentSkill]) -> str:
+    """将技能列表渲染为 System Prompt 中的 <agent_skills> 段落"""
+    skills_text = ""
+    for s in skills:
+        skills_text += f"### 技能名称：{s.name}\n"
+        skills_text += f"**描述**: {s.description}\n"
+        skills_text += f"**触发词**: {', '.join(s.trigger_keywords)}\n"
+        skills_text += f"**执行步骤与指令**:\n{s.instructions}\n\n"
+
+    if not skills_text.strip():
+        skills_text = "目前没有注册的高级技能。"
+    return skills_text.strip()
+
+
+@dataclass(frozen=True)
+class SkillSnapshot:
+    """某一时刻的技能集合及预渲染的 Prompt 段落，不可变"""
+    version: int
+    skills: tuple[AgentSkill, ...]
+    skills_prompt: str
+
+
+class SkillRegistry:
+    """内存中的技能注册表。
+
+    启动时构建一次；之后按 SKILLS_RELOAD_INTERVAL 节流检查目录与 SKILL.md 的
+    mtime，只有发生变化时才重新解析 YAML。热路径上只返回缓存的快照。
+    """
+
+    def __init__(self, skills_dir: Path = SKILLS_DIR, reload_interval: float | None = None):
+        self._skills_dir = skills_dir
+        self._reload_interval = (
+            settings.SKILLS_RELOAD_INTERVAL if reload_interval is None else reload_interval
+        )
+        self._lock = threading.Lock()
+        self._snapshot: SkillSnapshot | None = None
+        self._signature: tuple | None = None
+        self._checked_at = 0.0
+        self._listeners: list = []
+
+    def _compute_signature(self) -> tuple:
+        """目录及各 SKILL.md 的 (mtime, size)，用于判断是否需要重新加载"""
+        try:
+            dir_stat = self._skills_dir.stat()
+        except OSError:
+            return ()
+        entries = []
+        for entry in os.scandir(self._skills_dir):
+            if not entry.is_dir():
+                continue
+            try:
+                st = os.stat(os.path.join(entry.path, "SKILL.md"))
+                entries.append((entry.name, st.st_mtime_ns, st.st_size))
+            except OSError:
+                entries.append((entry.name, 0, 0))
+        return (dir_stat.st_mtime_ns, tuple(sorted(entries)))
+
+    def _load(self, signature: tuple) -> SkillSnapshot:
+        skills = tuple(load_all_skills(self._skills_dir))
+        version = self._snapshot.version + 1 if self._snapshot else 1
+        snapshot = SkillSnapshot(version, skills, render_skills_prompt(skills))
+        self._snapshot = snapshot
+        self._signature = signature
+        logger.info(f"[Skills] 已加载 {len(skills)} 个技能 (version={version})")
+        for listener in self._listeners:
+            try:
+                listener(snapshot)
+            except Exception as e:
+                logger.error(f"[Skills] 技能变更回调失败: {e}")
+        return snapshot
+
+    def snapshot(self) -> SkillSnapshot:
+        """返回当前技能快照，必要时（节流后）检查文件变化并重新加载"""
+        snapshot = self._snapshot
+        now = time.monotonic()
+        if snapshot is not None and (
+            self._reload_interval < 0 or now - self._checked_at < self._reload_interval
+        ):
+            return snapshot
+
+        with self._lock:
+            if self._snapshot is not None and now - self._checked_at < self._reload_interval:
+                return self._snapshot
+            self._checked_at = now
+            signature = self._compute_signature()
+            if self._snapshot is None or signature != self._signature:
+                return self._load(signature)
+            return self._snapshot
+
+    def reload(self) -> SkillSnapshot:
+        """强制重新加载"""
+        with self._lock:
+            self._checked_at = time.monotonic()
+            return self._load(self._compute_signature())
+
+    def add_listener(self, callback) -> None:
+        """注册技能变更回调，参数为新的 SkillSnapshot"""
+        self._listeners.append(callback)
+
+
+skill_registry = SkillRegistry()
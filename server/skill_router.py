@@ -0,0 +1,203 @@
+"""技能路由 — 只为与当前对话相关的技能注入完整执行步骤
+
+- 相关性：本轮消息与最近几条用户消息命中技能触发词（intent.detect_intent 一次扫描），
+  或本轮消息与技能描述共享足够多的字 bigram
+- 命中的技能注入完整指令，其余技能只保留一行索引（名称、描述、触发词）
+- 渲染结果按 (技能快照版本, 命中技能集合) 缓存
+- 前缀缓存布局（PROMPT_LAYOUT=prefix_cache）下拆成两部分：全部技能的索引（按技能版本固定，
+  放在 System Prompt 中）与命中技能的完整指令（放在消息末尾）
+- 统计每次请求相对注入全部技能所节省的 Prompt token（GET /api/skills/routing）
+"""
+
+from __future__ import annotations
+
+import logging
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from config import settings
+from context_builder import PREFIX_CACHE, estimate_tokens
+from intent import Intent, detect_intent
+from skill_loader import AgentSkill, SkillSnapshot, skill_registry
+
+logger = logging.getLogger("skill_router")
+
+_CJK_RUN_RE = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯]+|[a-z0-9]+")
+
+_RENDER_CACHE_SIZE = 64
+
+
+def _bigrams(text: str) -> set[str]:
+    grams: set[str] = set()
+    for run in _CJK_RUN_RE.findall(text.lower()):
+        if len(run) == 1 or run.isascii():
+            grams.add(run)
+        else:
+            grams.update(run[i:i + 2] for i in range(len(run) - 1))
+    return grams
+
+
+def _render_index_line(skill: AgentSkill) -> str:
+    return f"- **{skill.name}**：{skill.description}（触发词：{', '.join(map(str, skill.trigger_keywords))}）"
+
+
+def _render_full(skill: AgentSkill) -> str:
+    return (
+        f"### 技能名称：{skill.name}\n"
+        f"**描述**: {skill.description}\n"
+        f"**触发词**: {', '.join(map(str, skill.trigger_keywords))}\n"
+        f"**执行步骤与指令**:\n{skill.instructions}"
+    )
+
+
+def render_skill_index(skills: tuple[AgentSkill, ...]) -> str:
+    """全部技能各一行索引，内容只随技能快照变化"""
+    if not skills:
+        return "目前没有注册的高级技能。"
+    return (
+        "与当前对话相关的技能，其完整执行步骤会在对话末尾的「本轮相关技能」中给出。\n"
+        + "\n".join(_render_index_line(s) for s in skills)
+    )
+
+
+def render_active_prompt(skills: tuple[AgentSkill, ...], matched: frozenset[str]) -> str:
+    """命中技能的完整指令；没有命中时为空字符串"""
+    active = [_render_full(s) for s in skills if s.name in matched]
+    if not active:
+        return ""
+    return "## 本轮相关技能\n用户当前的请求与以下技能相关，请严格遵循其执行步骤：\n\n" + "\n\n".join(active)
+
+
+def render_routed_prompt(skills: tuple[AgentSkill, ...], matched: frozenset[str]) -> str:
+    """命中技能的完整指令 + 其余技能各一行索引"""
+    if not skills:
+        return "目前没有注册的高级技能。"
+    parts = [_render_full(s) for s in skills if s.name in matched]
+    others = [s for s in skills if s.name not in matched]
+    if others:
+        parts.append(
+            "### 其他技能（仅索引）\n"
+            "以下技能与当前对话关联不大，未展开执行步骤；如用户明确要求，按其描述逐步调用相关工具。\n"
+            + "\n".join(_render_index_line(s) for s in others)
+        )
+    return "\n\n".join(parts)
+
+
+@dataclass(frozen=True)
+class SkillRoute:
+    skills_prompt: str      # 内联布局：命中技能完整指令 + 其余技能索引
+    index_prompt: str       # 前缀缓存布局：全部技能索引
+    active_prompt: str      # 前缀缓存布局：命中技能完整指令
+    matched: tuple[str, ...]
+    full_tokens: int        # 注入全部技能指令时的 token 数
+    routed_tokens: int
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.full_tokens - self.routed_tokens
+
+
+class SkillRouter:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._version = 0
+        self._desc_grams: dict[str, set[str]] = {}
+        self._full_tokens = 0
+        self._index = ("", 0)
+        self._rendered: OrderedDict[frozenset[str], tuple[str, str, int]] = OrderedDict()
+        self.requests = 0
+        self.full_tokens_total = 0
+        self.routed_tokens_total = 0
+
+    def _prepare(self, snapshot: SkillSnapshot) -> None:
+        if self._version == snapshot.version:
+            return
+        self._desc_grams = {s.name: _bigrams(s.description) for s in snapshot.skills}
+        self._full_tokens = estimate_tokens(snapshot.skills_prompt)
+        index = render_skill_index(snapshot.skills)
+        self._index = (index, estimate_tokens(index))
+        self._rendered.clear()
+        self._version = snapshot.version
+
+    def _match(self, snapshot: SkillSnapshot, intent: Intent, user_msg: str, recent: list[str]) -> frozenset[str]:
+        matched = set(intent.skills)
+        for text in recent:
+            matched.update(detect_intent(text).skills)
+        min_overlap = settings.SKILL_ROUTING_DESC_MIN_OVERLAP
+        if min_overlap > 0:
+            grams = _bigrams(user_msg)
+            for skill in snapshot.skills:
+                if len(grams & self._desc_grams[skill.name]) >= min_overlap:
+                    matched.add(skill.name)
+        return frozenset(matched)
+
+    def route(
+        self,
+        user_msg: str,
+        history: list[dict] | None = None,
+        intent: Intent | None = None,
+    ) -> SkillRoute:
+        """history 为本轮之前的消息（时间正序），取最近几条用户消息参与匹配；
+        intent 为本轮消息已算好的 detect_intent 结果"""
+        snapshot = skill_registry.snapshot()
+        if not settings.SKILL_ROUTING_ENABLED:
+            names = frozenset(s.name for s in snapshot.skills)
+            tokens = estimate_tokens(snapshot.skills_prompt)
+            return SkillRoute(
+                snapshot.skills_prompt,
+                render_skill_index(snapshot.skills),
+                render_active_prompt(snapshot.skills, names),
+                tuple(s.name for s in snapshot.skills),
+                tokens,
+                tokens,
+            )
+
+        depth = settings.SKILL_ROUTING_HISTORY
+        recent = [m.get("content") or "" for m in (history or []) if m.get("role") == "user"]
+        recent = recent[-depth:] if depth > 0 else []
+
+        with self._lock:
+            self._prepare(snapshot)
+            matched = self._match(snapshot, intent or detect_intent(user_msg), user_msg, recent)
+            rendered = self._rendered.get(matched)
+            if rendered is None:
+                inline = render_routed_prompt(snapshot.skills, matched)
+                active = render_active_prompt(snapshot.skills, matched)
+                if settings.PROMPT_LAYOUT == PREFIX_CACHE:
+                    tokens = self._index[1] + estimate_tokens(active)
+                else:
+                    tokens = estimate_tokens(inline)
+                rendered = self._rendered[matched] = (inline, active, tokens)
+                while len(self._rendered) > _RENDER_CACHE_SIZE:
+                    self._rendered.popitem(last=False)
+            else:
+                self._rendered.move_to_end(matched)
+            route = SkillRoute(
+                rendered[0],
+                self._index[0],
+                rendered[1],
+                tuple(s.name for s in snapshot.skills if s.name in matched),
+                self._full_tokens,
+                rendered[2],
+            )
+            self.requests += 1
+            self.full_tokens_total += route.full_tokens
+            self.routed_tokens_total += route.routed_tokens
+        return route
+
+    def stats(self) -> dict:
+        with self._lock:
+            saved = self.full_tokens_total - self.routed_tokens_total
+            return {
+                "enabled": settings.SKILL_ROUTING_ENABLED,
+                "requests": self.requests,
+                "full_tokens": self.full_tokens_total,
+                "routed_tokens": self.routed_tokens_total,
+                "saved_tokens": saved,
+                "saved_ratio": round(saved / self.full_tokens_total, 3) if self.full_tokens_total else 0.0,
+            }
+
+
+skill_router = SkillRouter()
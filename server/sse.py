@@ -0,0 +1,115 @@
+"""SSE 帧编码 — 合并 token 事件，减少小帧写入与 JSON 编码次数
+
+- token 事件先缓冲，按时间窗口（SSE_COALESCE_MS）或字节数（SSE_COALESCE_BYTES）合并成一帧
+- card / error / done 等其它事件到达时，先刷出已缓冲的 token，再立即发送
+- 可按请求关闭合并（对时延敏感的客户端）
+- 编码见 serialization；token / card / error / follow_ups 等单字段事件的外壳预先编码成字节，
+  每帧只编码变化的字段值
+"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import AsyncGenerator, AsyncIterator
+
+from config import settings
+from serialization import dumps
+
+_FRAME_END = b"}\n\n"
+
+# 事件类型 -> (预编码的帧前缀, 唯一的字段名)
+_ENVELOPES: dict[str, tuple[bytes, str]] = {
+    kind: (b'data: {"type":' + dumps(kind) + b"," + dumps(field) + b":", field)
+    for kind, field in (
+        ("token", "content"),
+        ("card", "card"),
+        ("error", "content"),
+        ("follow_ups", "questions"),
+    )
+}
+_TOKEN_PREFIX = _ENVELOPES["token"][0]
+
+
+def encode_token(content: str) -> bytes:
+    return _TOKEN_PREFIX + dumps(content) + _FRAME_END
+
+
+def encode_event(event: dict) -> bytes:
+    envelope = _ENVELOPES.get(event.get("type"))
+    if envelope is not None and len(event) == 2 and envelope[1] in event:
+        prefix, field = envelope
+        return prefix + dumps(event[field]) + _FRAME_END
+    return b"data: " + dumps(event) + b"\n\n"
+
+
+async def encode_stream(
+    events: AsyncIterator[dict],
+    coalesce: bool = True,
+    window_ms: float | None = None,
+    max_bytes: int | None = None,
+) -> AsyncGenerator[bytes, None]:
+    """将事件流编码为 SSE 帧，可选合并相邻 token 事件。"""
+    if not coalesce:
+        async for event in events:
+            yield encode_event(event)
+        return
+
+    window = (settings.SSE_COALESCE_MS if window_ms is None else window_ms) / 1000
+    max_bytes = settings.SSE_COALESCE_BYTES if max_bytes is None else max_bytes
+    loop = asyncio.get_running_loop()
+
+    buffer: list[str] = []
+    buffered_bytes = 0
+    deadline = 0.0
+
+    def flush() -> bytes:
+        nonlocal buffer, buffered_bytes
+        frame = encode_token("".join(buffer))
+        buffer = []
+        buffered_bytes = 0
+        return frame
+
+    # 持续持有同一个 __anext__ 任务，超时只用于触发刷出，不取消上游
+    iterator = events.__aiter__()
+    pending: asyncio.Task | None = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            timeout = max(0.0, deadline - loop.time()) if buffer else None
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                yield flush()
+                continue
+
+            task, pending = pending, None
+            try:
+                event = task.result()
+            except StopAsyncIteration:
+                break
+
+            if event.get("type") == "token":
+                content = event.get("content") or ""
+                if not content:
+                    continue
+                if not buffer:
+                    deadline = loop.time() + window
+                buffer.append(content)
+                buffered_bytes += len(content.encode("utf-8"))
+                if buffered_bytes >= max_bytes or window <= 0:
+                    yield flush()
+                continue
+
+            if buffer:
+                yield flush()
+            yield encode_event(event)
+
+        if buffer:
+            yield flush()
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
+            await asyncio.wait({pending})
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
@@ -0,0 +1,40 @@
+"""测试公共夹具 — 在 server/ 目录下运行：python -m pytest tests
+
+异步代码不依赖 pytest 插件，用 asyncio.run 驱动；数据库连接池绑定事件循环，
+每个场景在同一次 asyncio.run 内完成建库、执行与关闭。
+"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Awaitable, Callable
+
+import pytest
+
+import database as db
+import payload_store
+from config import settings
+from history_cache import HistoryCache
+
+
+@pytest.fixture
+def run_db(tmp_path, monkeypatch):
+    """在临时数据库上运行一个异步场景：run_db(scenario) -> scenario 的返回值"""
+    monkeypatch.setattr(db, "DB_PATH", tmp_path / "test.db")
+    monkeypatch.setattr(db, "history_cache", HistoryCache(
+        settings.HISTORY_CACHE_WINDOW, settings.HISTORY_CACHE_MAX_BYTES, settings.HISTORY_CACHE_TTL,
+    ))
+    payload_store.decoded_cache.clear()
+
+    def run(scenario: Callable[[], Awaitable]):
+        async def main():
+            await db.init_db()
+            try:
+                return await scenario()
+            finally:
+                await db.close_db()
+
+        return asyncio.run(main())
+
+    yield run
+    payload_store.decoded_cache.clear()
@@ -0,0 +1,133 @@
+"""多轮流式工具循环：tool_call 增量拼接、事件顺序与 AGENT_MAX_TOOL_ROUNDS 上限"""
+
+from __future__ import annotations
+
+import pytest
+from langchain_core.messages import AIMessageChunk, ToolMessage
+from langchain_core.tools import tool
+
+import agent
+import context_builder
+import follow_ups
+import llm_client
+from config import settings
+
+
+class _ScriptedModel:
+    """按轮次回放预设的 AIMessageChunk 序列；script(round_no) -> chunks"""
+
+    def __init__(self, script):
+        self._script = script
+        self.calls: list[list] = []
+
+    async def astream(self, messages):
+        self.calls.append(list(messages))
+        for chunk in self._script(len(self.calls)):
+            yield chunk
+
+
+def _tool_call_chunks(call_id: str, query: str) -> list[AIMessageChunk]:
+    """一个工具调用的参数拆成两段下发"""
+    half = len(query) // 2
+    return [
+        AIMessageChunk(content="", tool_call_chunks=[
+            {"name": "lookup_song", "args": '{"query": "' + query[:half], "id": call_id, "index": 0},
+        ]),
+        AIMessageChunk(content="", tool_call_chunks=[
+            {"name": None, "args": query[half:] + '"}', "id": None, "index": 0},
+        ]),
+    ]
+
+
+_lookups: list[str] = []
+
+
+@tool
+async def lookup_song(query: str) -> dict:
+    """测试用工具"""
+    _lookups.append(query)
+    return {"query": query}
+
+
+@pytest.fixture
+def models(monkeypatch):
+    """替换 LLM 与工具：models(with_tools, plain) 后运行对话并返回事件列表"""
+    _lookups.clear()
+    monkeypatch.setattr(settings, "LLM_CACHE_TTL_CHAT", 0)
+    monkeypatch.setattr(settings, "LLM_CACHE_TTL_QUICK_ACTION", 0)
+    monkeypatch.setitem(agent.TOOL_MAP, "lookup_song", lookup_song)
+    monkeypatch.setattr(
+        agent, "_extract_cards",
+        lambda name, result: [{"card_type": "test", "title": result["query"]}] if name == "lookup_song" else [],
+    )
+    monkeypatch.setattr(follow_ups, "schedule", lambda *args, **kwargs: None)
+    monkeypatch.setattr(context_builder, "schedule_fold", lambda *args, **kwargs: None)
+    monkeypatch.setattr(llm_client, "get_tool_schema_hash", lambda tools: "schema")
+
+    def install(with_tools: _ScriptedModel, plain: _ScriptedModel) -> None:
+        monkeypatch.setattr(llm_client, "get_llm", lambda: plain)
+        monkeypatch.setattr(llm_client, "get_llm_with_tools", lambda tools: with_tools)
+
+    return install
+
+
+async def _events(message: str) -> list[dict]:
+    return [event async for event in agent._chat_events(message, None)]
+
+
+def test_tool_round_then_answer_event_order(run_db, models):
+    def script(round_no: int) -> list[AIMessageChunk]:
+        if round_no == 1:
+            return [AIMessageChunk(content="我查一下"), *_tool_call_chunks("call_1", "月光信箱")]
+        return [AIMessageChunk(content="找到了"), AIMessageChunk(content="这首歌")]
+
+    with_tools, plain = _ScriptedModel(script), _ScriptedModel(lambda n: [])
+    models(with_tools, plain)
+    events = run_db(lambda: _events("帮我找首歌"))
+
+    assert [e["type"] for e in events] == ["token", "card", "token", "token", "done"]
+    assert events[1]["card"]["title"] == "月光信箱"
+    assert _lookups == ["月光信箱"]
+    # 第二轮的输入包含拼接完整的 tool_call 与对应的 ToolMessage
+    second = with_tools.calls[1]
+    assert second[-2].tool_calls[0]["args"] == {"query": "月光信箱"}
+    assert isinstance(second[-1], ToolMessage) and second[-1].tool_call_id == "call_1"
+    assert plain.calls == []
+
+
+def test_round_cap_forces_final_round_without_tools(run_db, models, monkeypatch):
+    monkeypatch.setattr(settings, "AGENT_MAX_TOOL_ROUNDS", 2)
+    with_tools = _ScriptedModel(lambda n: _tool_call_chunks(f"call_{n}", f"第{n}轮"))
+    plain = _ScriptedModel(lambda n: [AIMessageChunk(content="最终回答")])
+    models(with_tools, plain)
+    events = run_db(lambda: _events("一直调用工具"))
+
+    assert len(with_tools.calls) == 2
+    assert len(plain.calls) == 1
+    assert _lookups == ["第1轮", "第2轮"]
+    assert [e["type"] for e in events] == ["card", "card", "token", "done"]
+    assert events[2]["content"] == "最终回答"
+    tool_messages = [m for m in plain.calls[0] if isinstance(m, ToolMessage)]
+    assert [m.tool_call_id for m in tool_messages] == ["call_1", "call_2"]
+
+
+def test_zero_rounds_answers_without_tools(run_db, models, monkeypatch):
+    monkeypatch.setattr(settings, "AGENT_MAX_TOOL_ROUNDS", 0)
+    with_tools = _ScriptedModel(lambda n: _tool_call_chunks("call", "不应调用"))
+    plain = _ScriptedModel(lambda n: [AIMessageChunk(content="直接回答")])
+    models(with_tools, plain)
+    events = run_db(lambda: _events("你好"))
+
+    assert with_tools.calls == [] and _lookups == []
+    assert [e["type"] for e in events] == ["token", "done"]
+
+
+def test_model_error_yields_error_then_done(run_db, models):
+    def script(round_no: int):
+        raise RuntimeError("上游断开")
+
+    models(_ScriptedModel(script), _ScriptedModel(lambda n: []))
+    events = run_db(lambda: _events("你好"))
+
+    assert [e["type"] for e in events] == ["error", "done"]
+    assert "上游断开" in events[0]["content"]
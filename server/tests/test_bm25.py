@@ -0,0 +1,99 @@
+"""BM25 倒排索引：分词、CSR 打分与朴素实现一致、分类过滤、段合并与持久化"""
+
+from __future__ import annotations
+
+import math
+from collections import Counter
+
+import pytest
+
+from tools.bm25 import BM25Index, Document, Segment, tokenize
+
+_DOCS = [
+    Document("乐曲结算一般在月底到账", "结算", title="版税什么时候到账"),
+    Document("上传乐曲需要提供完整的版权证明", "版权"),
+    Document("版权登记流程与所需材料", "版权", title="如何登记版权"),
+    Document("song upload limit is 200 MB", "上传"),
+    Document("结算周期为每月一次，遇节假日顺延", "结算"),
+]
+
+
+def _naive_scores(docs: list[Document], query: str, k1: float = 1.2, b: float = 0.75) -> dict[int, float]:
+    """逐篇文档直接按 BM25 公式计算，作为对照"""
+    tfs = []
+    for doc in docs:
+        tf = Counter(tokenize(doc.text))
+        for term, count in Counter(tokenize(doc.title)).items():
+            tf[term] += count * 2
+        tfs.append(tf)
+    n = len(docs)
+    lengths = [sum(tf.values()) for tf in tfs]
+    avg_len = sum(lengths) / n
+    scores: dict[int, float] = {}
+    for term, qtf in Counter(tokenize(query)).items():
+        df = sum(1 for tf in tfs if term in tf)
+        if not df:
+            continue
+        idf = math.log1p((n - df + 0.5) / (df + 0.5))
+        for i, tf in enumerate(tfs):
+            if term in tf:
+                norm = k1 * (1 - b + b * lengths[i] / avg_len)
+                scores[i] = scores.get(i, 0.0) + qtf * idf * (k1 + 1) * tf[term] / (tf[term] + norm)
+    return scores
+
+
+def test_tokenize_cjk_ngrams_and_words():
+    assert tokenize("版税") == ["版税"]
+    assert tokenize("结算周") == ["结算", "算周", "结算周"]
+    assert tokenize("曲") == ["曲"]
+    assert tokenize("Upload 200MB") == ["upload", "200mb"]
+
+
+@pytest.mark.parametrize("query", ["版权登记", "什么时候到账", "结算", "upload limit"])
+def test_scores_match_naive_bm25(query):
+    index = BM25Index.build(_DOCS)
+    hits, total = index.search(query, k=len(_DOCS))
+    expected = _naive_scores(_DOCS, query)
+    assert total == len(expected)
+    assert {h.doc_id: pytest.approx(h.score, rel=1e-5) for h in hits} == expected
+    assert [h.score for h in hits] == sorted((h.score for h in hits), reverse=True)
+
+
+def test_top_k_returns_best_hits_in_order():
+    index = BM25Index.build(_DOCS)
+    everything, total = index.search("版权结算", k=10)
+    top, top_total = index.search("版权结算", k=2)
+    assert top_total == total
+    assert top == everything[:2]
+
+
+def test_category_filter_intersects_postings():
+    index = BM25Index.build(_DOCS)
+    hits, total = index.search("版权结算", categories=["版权"])
+    assert total == 2
+    assert {h.doc_id for h in hits} == {1, 2}
+    assert index.search("版权", categories=["不存在的分类"]) == ([], 0)
+
+
+def test_unmatched_or_empty_query():
+    index = BM25Index.build(_DOCS)
+    assert index.search("吉他") == ([], 0)
+    assert index.search("，。！") == ([], 0)
+    assert index.search("版权", k=0) == ([], 0)
+
+
+def test_merged_segments_match_single_build(tmp_path):
+    whole = BM25Index.build(_DOCS)
+    first = Segment.from_documents(_DOCS[:2])
+    first.save(tmp_path / "first.npz")
+    merged = BM25Index.from_segments([Segment.load(tmp_path / "first.npz"), Segment.from_documents(_DOCS[2:])])
+    assert merged.search("结算到账", k=5) == whole.search("结算到账", k=5)
+    assert merged.categories() == whole.categories()
+
+
+def test_saved_index_loads_with_mmap(tmp_path):
+    index = BM25Index.build(_DOCS)
+    index.save(tmp_path / "index")
+    loaded = BM25Index.load(tmp_path / "index")
+    assert loaded.doc_count == index.doc_count
+    assert loaded.search("版权登记", categories=["版权"]) == index.search("版权登记", categories=["版权"])
@@ -0,0 +1,96 @@
+"""上下文组装与滚动摘要：离开窗口的消息必须进入摘要"""
+
+from __future__ import annotations
+
+from types import SimpleNamespace
+
+import pytest
+
+import context_builder
+import database as db
+from config import settings
+
+
+class _FakeLLM:
+    def __init__(self) -> None:
+        self.prompts: list[str] = []
+
+    async def ainvoke(self, messages):
+        self.prompts.append(messages[0].content)
+        return SimpleNamespace(content=f"摘要{len(self.prompts)}")
+
+
+async def _seed(count: int) -> tuple[str, list[dict]]:
+    conv_id = await db.create_conversation()
+    for i in range(count):
+        await db.save_message(conv_id, "user" if i % 2 == 0 else "assistant", f"消息{i}")
+    await db.flush()
+    return conv_id, (await db.get_messages(conv_id, limit=count)).messages
+
+
+@pytest.fixture(autouse=True)
+def _min_batch(monkeypatch):
+    monkeypatch.setattr(settings, "CONTEXT_SUMMARY_MIN_MESSAGES", 4)
+
+
+def test_short_eviction_folds_ahead_into_window(run_db):
+    llm = _FakeLLM()
+
+    async def scenario():
+        conv_id, msgs = await _seed(6)
+        # 窗口从 消息2 开始：只有 2 条离开窗口，少于一批
+        await context_builder._fold(conv_id, llm, msgs[2]["created_at"], msgs[5]["created_at"])
+        return msgs, await db.get_summary(conv_id)
+
+    msgs, summary = run_db(scenario)
+    assert summary["summary"] == "摘要1"
+    assert summary["covered_until"] == msgs[3]["created_at"]
+    prompt = llm.prompts[0]
+    assert all(f"消息{i}" in prompt for i in range(4))
+    assert "消息4" not in prompt
+
+
+def test_large_eviction_folds_everything_before_window(run_db):
+    llm = _FakeLLM()
+
+    async def scenario():
+        conv_id, msgs = await _seed(8)
+        await context_builder._fold(conv_id, llm, msgs[6]["created_at"], msgs[7]["created_at"])
+        return msgs, await db.get_summary(conv_id)
+
+    msgs, summary = run_db(scenario)
+    assert summary["covered_until"] == msgs[5]["created_at"]
+    assert "消息6" not in llm.prompts[0]
+
+
+def test_single_evicted_message_is_not_dropped(run_db):
+    llm = _FakeLLM()
+
+    async def scenario():
+        conv_id, msgs = await _seed(2)
+        await context_builder._fold(conv_id, llm, msgs[1]["created_at"], msgs[1]["created_at"])
+        return msgs, await db.get_summary(conv_id)
+
+    msgs, summary = run_db(scenario)
+    assert summary["covered_until"] == msgs[0]["created_at"]
+
+
+def test_no_fold_when_evicted_messages_already_covered():
+    plan = context_builder.ContextPlan(messages=[], total_tokens=0, evicted=[{"created_at": "2026-01-01T00:00:01"}])
+    context_builder.schedule_fold(
+        "c", _FakeLLM(), plan, {"covered_until": "2026-01-01T00:00:02"},
+        window_start="2026-01-01T00:00:03", maybe_truncated=False,
+    )
+    assert "c" not in context_builder._folding
+
+
+def test_build_context_evicts_oldest_over_budget(monkeypatch):
+    monkeypatch.setattr(settings, "CONTEXT_MAX_TOKENS", 200)
+    history = [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": "很长的内容" * 20, "created_at": str(i)}
+        for i in range(6)
+    ]
+    plan = context_builder.build_context("系统", history, "本轮问题")
+    assert plan.kept and plan.evicted
+    assert plan.evicted + plan.kept == history
+    assert plan.messages[-1].content == "本轮问题"
@@ -0,0 +1,57 @@
+"""稠密检索：换一种说法的召回、批量查询与 k 的边界"""
+
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from tools.dense import DenseIndex, HashingEmbedder
+
+_TEXTS = [
+    "版税结算后多久到账",
+    "如何上传新的乐曲",
+    "版权登记需要哪些材料",
+]
+_CONCEPTS = {"收益": ["钱", "版税", "收益", "到账"]}
+
+
+@pytest.fixture
+def index() -> DenseIndex:
+    embedder = HashingEmbedder(256, _CONCEPTS)
+    return DenseIndex.from_raw(embedder, [embedder.embed_many(_TEXTS)])
+
+
+def test_paraphrase_hits_concept_document(index):
+    hits = index.search("钱什么时候到", k=1)
+    assert [h.doc_id for h in hits] == [0]
+
+
+def test_batch_matches_single_queries(index):
+    queries = ["怎么上传乐曲", "版权登记材料"]
+    batch = index.search_batch(queries, k=2)
+    for hits, query in zip(batch, queries):
+        single = index.search(query, k=2)
+        assert [h.doc_id for h in hits] == [h.doc_id for h in single]
+        assert [h.score for h in hits] == pytest.approx([h.score for h in single], rel=1e-5)
+
+
+@pytest.mark.parametrize("k", [0, -1])
+def test_non_positive_k_returns_empty(index, k):
+    assert index.search("版税", k=k) == []
+    assert index.search_batch(["版税", "上传"], k=k) == [[], []]
+
+
+def test_k_is_clamped_to_corpus_size(index):
+    hits = index.search("版税 上传 版权", k=100)
+    assert 0 < len(hits) <= len(_TEXTS)
+
+
+def test_mask_excludes_documents(index):
+    mask = np.array([False, True, True])
+    assert all(h.doc_id != 0 for h in index.search("版税到账", k=3, mask=mask))
+
+
+def test_empty_corpus():
+    embedder = HashingEmbedder(64)
+    empty = DenseIndex.from_raw(embedder, [])
+    assert empty.search_batch(["版税"], k=5) == [[]]
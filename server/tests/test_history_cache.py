@@ -0,0 +1,70 @@
+"""最近历史缓存：本进程写入增量追加，其它进程写入按 message_count 失效"""
+
+from __future__ import annotations
+
+import sqlite3
+
+import database as db
+
+
+def _foreign_insert(path, conv_id: str, msg_id: str, content: str) -> None:
+    """模拟另一个 worker 直接写库（不经过本进程的缓存）"""
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute(
+            "INSERT INTO message (id, conversation_id, role, content, created_at) VALUES (?, ?, 'user', ?, ?)",
+            (msg_id, conv_id, content, "2999-01-01T00:00:00"),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def test_local_appends_hit_cache(run_db):
+    async def scenario():
+        conv_id = await db.create_conversation()
+        await db.save_message(conv_id, "user", "一")
+        await db.save_message(conv_id, "assistant", "二", cards=[{"title": "卡片", "data": {}}])
+        first = await db.get_recent_messages(conv_id, 10)
+        await db.flush()
+        second = await db.get_recent_messages(conv_id, 10)
+        return first, second
+
+    first, second = run_db(scenario)
+    assert [m["content"] for m in first] == ["一", "二"]
+    assert [m["content"] for m in second] == ["一", "二"]
+    assert second[1]["cards"][0]["title"] == "卡片"
+    assert db.history_cache.misses == 0
+    assert db.history_cache.stale == 0
+
+
+def test_foreign_write_invalidates_entry(run_db):
+    async def scenario():
+        conv_id = await db.create_conversation()
+        await db.save_message(conv_id, "user", "一")
+        await db.flush()
+        await db.get_recent_messages(conv_id, 10)
+        _foreign_insert(db.DB_PATH, conv_id, "other-worker", "另一个进程")
+        return await db.get_recent_messages(conv_id, 10)
+
+    messages = run_db(scenario)
+    assert [m["content"] for m in messages] == ["一", "另一个进程"]
+    assert db.history_cache.stale == 1
+
+
+def test_cold_load_records_message_count(run_db):
+    async def scenario():
+        conv_id = await db.create_conversation()
+        for i in range(3):
+            await db.save_message(conv_id, "user", str(i))
+        await db.flush()
+        db.history_cache.clear()
+        await db.get_recent_messages(conv_id, 2)
+        count = db.history_cache.message_count(conv_id)
+        again = await db.get_recent_messages(conv_id, 2)
+        return count, again
+
+    count, again = run_db(scenario)
+    assert count == 3
+    assert [m["content"] for m in again] == ["1", "2"]
+    assert db.history_cache.hits == 1
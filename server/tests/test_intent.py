@@ -0,0 +1,49 @@
+"""意图识别：一次扫描命中分类关键词，分类猜测按 CATEGORY_KEYWORDS 顺序取第一个命中"""
+
+from __future__ import annotations
+
+from intent import CATEGORY_KEYWORDS, detect_intent
+from tools.knowledge import _guess_category
+
+
+def _first_match(text: str) -> str:
+    """重构前 _guess_category 的实现，作为对照"""
+    for cat, kws in CATEGORY_KEYWORDS.items():
+        if any(kw in text for kw in kws):
+            return cat
+    return "入驻"
+
+
+def test_overlapping_keywords_all_hit():
+    intent = detect_intent("作品被侵权了怎么维权，版权在谁手里")
+    assert intent.categories == {"版权": ["侵权", "维权", "版权"]}
+
+
+def test_category_follows_dict_order_not_hit_count():
+    text = "上传文件后结算的钱和收入怎么算"
+    intent = detect_intent(text)
+    assert len(intent.categories["结算"]) > len(intent.categories["上传"])
+    assert intent.category == "上传"
+    assert _guess_category(text) == "上传"
+
+
+def test_category_ignores_position_in_text():
+    # 「版权」先出现，但「审核」在 CATEGORY_KEYWORDS 中排在前面
+    assert _guess_category("版权材料审核要多久") == "审核"
+
+
+def test_no_hit_defaults_to_onboarding():
+    assert detect_intent("你好").category is None
+    assert _guess_category("你好") == "入驻"
+
+
+def test_matches_previous_first_match_behaviour():
+    texts = [
+        "怎么入驻平台",
+        "比赛奖金什么时候提现",
+        "发布的作品被驳回了",
+        "注册后多久能上传",
+        "侵权投诉和活动报名",
+        "随便问问",
+    ]
+    assert [_guess_category(t) for t in texts] == [_first_match(t) for t in texts]
@@ -0,0 +1,40 @@
+"""知识库索引的构建锁：POSIX 用 fcntl，没有 fcntl 的平台（Windows）用 msvcrt"""
+
+from __future__ import annotations
+
+from types import SimpleNamespace
+
+from tools import knowledge_index
+
+
+def test_file_lock_with_fcntl(tmp_path):
+    manager = knowledge_index.KnowledgeIndexManager.__new__(knowledge_index.KnowledgeIndexManager)
+    manager._index_dir = tmp_path
+    with manager._file_lock():
+        assert (tmp_path / ".lock").exists()
+
+
+def test_file_lock_falls_back_to_msvcrt(tmp_path, monkeypatch):
+    calls: list[tuple[int, int]] = []
+    attempts = {"n": 0}
+
+    def locking(fd: int, mode: int, nbytes: int) -> None:
+        if mode == fake.LK_LOCK:
+            attempts["n"] += 1
+            if attempts["n"] == 1:
+                raise OSError("Resource deadlock avoided")
+        calls.append((mode, nbytes))
+
+    fake = SimpleNamespace(LK_LOCK=1, LK_UNLCK=0, locking=locking)
+    monkeypatch.setattr(knowledge_index, "fcntl", None)
+    monkeypatch.setattr(knowledge_index, "msvcrt", fake)
+
+    with open(tmp_path / ".lock", "a+") as f:
+        f.write("x")
+        knowledge_index._lock_file(f)
+        assert f.tell() == 0
+        knowledge_index._unlock_file(f)
+
+    # 第一次 LK_LOCK 超时后继续等待，最终加锁成功
+    assert attempts["n"] == 2
+    assert calls == [(fake.LK_LOCK, 1), (fake.LK_UNLCK, 1)]
@@ -0,0 +1,164 @@
+"""LLM 响应缓存：键的稳定性、按路由 TTL、两级读取与失效"""
+
+from __future__ import annotations
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+import database as db
+import llm_cache
+from config import settings
+
+
+@pytest.fixture(autouse=True)
+def _clean_memory(monkeypatch):
+    llm_cache._memory.clear()
+    monkeypatch.setattr(settings, "LLM_CACHE_TTL_CHAT", 60)
+    monkeypatch.setattr(settings, "LLM_CACHE_TTL_QUICK_ACTION", 600)
+    yield
+    llm_cache._memory.clear()
+
+
+def _clock(monkeypatch, now: float) -> None:
+    monkeypatch.setattr(llm_cache, "time", SimpleNamespace(time=lambda: now))
+
+
+def _messages(tool_call_id: str = "call_a") -> list:
+    return [
+        SystemMessage(content="系统"),
+        HumanMessage(content="推荐一首歌"),
+        AIMessage(content="", tool_calls=[{"name": "recommend", "args": {"budget": 1000}, "id": tool_call_id}]),
+    ]
+
+
+def test_key_ignores_tool_call_ids():
+    a = llm_cache.make_key(_messages("call_a"), "m", 0.7, "schema")
+    b = llm_cache.make_key(_messages("call_b"), "m", 0.7, "schema")
+    assert a == b
+
+
+@pytest.mark.parametrize("change", ["model", "temperature", "tools", "content"])
+def test_key_changes_with_prompt_inputs(change):
+    base = dict(messages=_messages(), model="m", temperature=0.7, tool_schema_hash="schema")
+    changed = dict(base)
+    if change == "model":
+        changed["model"] = "m2"
+    elif change == "temperature":
+        changed["temperature"] = 0.2
+    elif change == "tools":
+        changed["tool_schema_hash"] = "schema2"
+    else:
+        changed["messages"] = _messages()[:2] + [HumanMessage(content="别的问题")]
+    assert llm_cache.make_key(**base) != llm_cache.make_key(**changed)
+
+
+def test_route_ttl():
+    assert llm_cache.route_ttl(llm_cache.ROUTE_QUICK_ACTION) == 600
+    assert llm_cache.route_ttl(llm_cache.ROUTE_CHAT) == 60
+
+
+def test_put_then_get_from_sqlite_after_memory_loss(run_db, monkeypatch):
+    _clock(monkeypatch, 1000.0)
+    response = AIMessage(content="", tool_calls=[{"name": "recommend", "args": {"budget": 1000}, "id": "x"}])
+
+    async def scenario():
+        await llm_cache.put("k", llm_cache.ROUTE_CHAT, response, "schema")
+        await db.flush()
+        llm_cache._memory.clear()
+        return await llm_cache.get("k")
+
+    entry = run_db(scenario)
+    assert entry is not None
+    assert entry.expires_at == 1060.0
+    message = entry.to_message()
+    assert message.tool_calls[0]["name"] == "recommend"
+    assert message.tool_calls[0]["args"] == {"budget": 1000}
+    assert message.tool_calls[0]["id"] != "x"
+
+
+def test_expired_entries_miss(run_db, monkeypatch):
+    _clock(monkeypatch, 1000.0)
+
+    async def scenario():
+        await llm_cache.put("k", llm_cache.ROUTE_CHAT, AIMessage(content="答案"), None)
+        await db.flush()
+        _clock(monkeypatch, 1061.0)
+        in_memory = await llm_cache.get("k")
+        llm_cache._memory.clear()
+        in_sqlite = await llm_cache.get("k")
+        return in_memory, in_sqlite
+
+    assert run_db(scenario) == (None, None)
+
+
+def test_zero_ttl_route_is_not_cached(run_db, monkeypatch):
+    monkeypatch.setattr(settings, "LLM_CACHE_TTL_CHAT", 0)
+
+    async def scenario():
+        await llm_cache.put("k", llm_cache.ROUTE_CHAT, AIMessage(content="答案"), None)
+        return await llm_cache.get("k")
+
+    assert run_db(scenario) is None
+
+
+def test_invalidate_keeps_entries_with_current_schema(run_db, monkeypatch):
+    _clock(monkeypatch, 1000.0)
+
+    async def scenario():
+        await llm_cache.put("old", llm_cache.ROUTE_CHAT, AIMessage(content="旧"), "schema-old")
+        await llm_cache.put("new", llm_cache.ROUTE_CHAT, AIMessage(content="新"), "schema-new")
+        await llm_cache.invalidate(keep_schema_hash="schema-new")
+        return await llm_cache.get("old"), await llm_cache.get("new")
+
+    old, new = run_db(scenario)
+    assert old is None
+    assert new is not None and new.content == "新"
+
+
+def test_stats_count_hits_per_route(run_db, monkeypatch):
+    _clock(monkeypatch, 1000.0)
+    monkeypatch.setattr(llm_cache, "_hits", {})
+    monkeypatch.setattr(llm_cache, "_misses", {})
+
+    async def scenario():
+        await llm_cache.get("quick", llm_cache.ROUTE_QUICK_ACTION)
+        await llm_cache.put("quick", llm_cache.ROUTE_QUICK_ACTION, AIMessage(content="答案"), None)
+        for _ in range(3):
+            await llm_cache.get("quick", llm_cache.ROUTE_QUICK_ACTION)
+        await llm_cache.get("chat")
+
+    run_db(scenario)
+    stats = llm_cache.stats()
+    assert stats["memory_size"] == 1
+    assert stats["routes"][llm_cache.ROUTE_QUICK_ACTION] == {"ttl": 600, "hits": 3, "misses": 1, "hit_ratio": 0.75}
+    assert stats["routes"][llm_cache.ROUTE_CHAT]["misses"] == 1
+    assert stats["routes"][llm_cache.ROUTE_CHAT]["hit_ratio"] == 0.0
+
+
+def test_scheduled_invalidate_is_tracked_until_done(run_db):
+    async def scenario():
+        await llm_cache.put("k", llm_cache.ROUTE_CHAT, AIMessage(content="答案"), None)
+        task = llm_cache.schedule_invalidate()
+        tracked = task in llm_cache._pending
+        await task
+        llm_cache._memory.clear()
+        return tracked, task in llm_cache._pending, await llm_cache.get("k")
+
+    assert run_db(scenario) == (True, False, None)
+    assert llm_cache.schedule_invalidate() is None
+
+
+def test_scheduled_invalidate_logs_failures(monkeypatch, caplog):
+    async def failing(keep_schema_hash=None):
+        raise RuntimeError("数据库已关闭")
+
+    monkeypatch.setattr(llm_cache, "invalidate", failing)
+
+    async def scenario():
+        await llm_cache.schedule_invalidate()
+
+    asyncio.run(scenario())
+    assert "数据库已关闭" in caplog.text
@@ -0,0 +1,110 @@
+"""键集分页：消息双向翻页的游标、轻量读取与会话列表"""
+
+from __future__ import annotations
+
+import pytest
+
+import database as db
+
+
+async def _seed(count: int) -> tuple[str, list[str]]:
+    conv_id = await db.create_conversation()
+    ids = [
+        await db.save_message(conv_id, "user", f"消息{i}", cards=[{"title": f"卡片{i}", "data": {}}])
+        for i in range(count)
+    ]
+    await db.flush()
+    return conv_id, ids
+
+
+def test_forward_paging_walks_every_message_once(run_db):
+    async def scenario():
+        conv_id, ids = await _seed(7)
+        pages, cursor = [], None
+        while True:
+            page = await db.get_messages(conv_id, limit=3, cursor=cursor)
+            pages.append(page)
+            cursor = page.next_cursor
+            if cursor is None:
+                return ids, pages
+
+    ids, pages = run_db(scenario)
+    assert [len(p.messages) for p in pages] == [3, 3, 1]
+    assert [m["id"] for p in pages for m in p.messages] == ids
+    # 第一页之前没有消息，其后各页都能回到前一页
+    assert pages[0].prev_cursor is None
+    assert all(p.prev_cursor for p in pages[1:])
+
+
+def test_backward_paging_from_latest(run_db):
+    async def scenario():
+        conv_id, ids = await _seed(5)
+        latest = await db.get_messages(conv_id, limit=2, backward=True)
+        older = await db.get_messages(conv_id, limit=2, cursor=latest.prev_cursor, backward=True)
+        oldest = await db.get_messages(conv_id, limit=2, cursor=older.prev_cursor, backward=True)
+        back_again = await db.get_messages(conv_id, limit=2, cursor=oldest.next_cursor)
+        return ids, latest, older, oldest, back_again
+
+    ids, latest, older, oldest, back_again = run_db(scenario)
+    assert [m["id"] for m in latest.messages] == ids[3:]
+    assert latest.next_cursor is None
+    assert [m["id"] for m in older.messages] == ids[1:3]
+    assert [m["id"] for m in oldest.messages] == ids[:1]
+    assert oldest.prev_cursor is None
+    assert [m["id"] for m in back_again.messages] == ids[1:3]
+
+
+def test_exact_page_has_no_next_cursor(run_db):
+    async def scenario():
+        conv_id, _ = await _seed(3)
+        return await db.get_messages(conv_id, limit=3)
+
+    page = run_db(scenario)
+    assert len(page.messages) == 3
+    assert page.next_cursor is None and page.prev_cursor is None
+
+
+def test_payloads_can_be_skipped(run_db):
+    async def scenario():
+        conv_id, _ = await _seed(2)
+        full = await db.get_messages(conv_id)
+        light = await db.get_messages(conv_id, include_payloads=False)
+        return full, light
+
+    full, light = run_db(scenario)
+    assert full.messages[0]["cards"][0]["title"] == "卡片0"
+    assert "cards" not in light.messages[0]
+    assert [m["content"] for m in light.messages] == ["消息0", "消息1"]
+
+
+def test_invalid_cursor_raises(run_db):
+    async def scenario():
+        conv_id, _ = await _seed(1)
+        with pytest.raises(ValueError):
+            await db.get_messages(conv_id, cursor="不是游标")
+        with pytest.raises(ValueError):
+            await db.get_messages(conv_id, cursor=db.encode_cursor("只有一个值"))
+
+    run_db(scenario)
+
+
+def test_list_conversations_pages_by_recent_update(run_db):
+    async def scenario():
+        conv_ids = [await db.create_conversation(f"会话{i}") for i in range(5)]
+        # 给最早创建的会话追加消息，使它成为最近更新的
+        await db.save_message(conv_ids[0], "user", "新消息")
+        await db.flush()
+        seen, cursor = [], None
+        while True:
+            items, cursor = await db.list_conversations(limit=2, cursor=cursor)
+            seen.append(items)
+            if cursor is None:
+                return conv_ids, seen
+
+    conv_ids, pages = run_db(scenario)
+    assert [len(p) for p in pages] == [2, 2, 1]
+    flat = [c for p in pages for c in p]
+    assert sorted(c["id"] for c in flat) == sorted(conv_ids)
+    assert flat[0]["id"] == conv_ids[0] and flat[0]["message_count"] == 1
+    keys = [(c["updated_at"], c["id"]) for c in flat]
+    assert keys == sorted(keys, reverse=True)
@@ -0,0 +1,140 @@
+"""大字段存储：编码与去重、引用计数触发器、删除时回收、旧数据迁移与按需读取"""
+
+from __future__ import annotations
+
+import sqlite3
+
+import database as db
+import payload_store
+from config import settings
+from serialization import dumps
+
+
+def _query(path, sql: str, params: tuple = ()) -> list[tuple]:
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute(sql, params).fetchall()
+        conn.commit()
+        return rows
+    finally:
+        conn.close()
+
+
+def test_encode_round_trip_and_compression(monkeypatch):
+    monkeypatch.setattr(settings, "PAYLOAD_COMPRESS_MIN_BYTES", 64)
+    small = payload_store.encode({"a": 1})
+    large_value = [{"title": "报告", "rows": list(range(200))}]
+    large = payload_store.encode(large_value)
+    assert small.codec == payload_store.CODEC_JSON
+    assert large.codec == payload_store.CODEC_ZLIB and len(large.data) < large.raw_size
+    assert payload_store.decode(large.codec, large.data) == large_value
+    assert payload_store.encode(large_value).hash == large.hash
+
+
+def test_decoded_cache_is_bounded_by_bytes():
+    cache = payload_store.DecodedCache(max_bytes=10)
+    cache.put("a", "A", 6)
+    cache.put("b", "B", 6)
+    assert cache.get("a") == (False, None)
+    assert cache.get("b") == (True, "B")
+    cache.put("huge", "X", 11)
+    assert cache.get("huge") == (False, None)
+    assert cache.total_bytes == 6
+
+
+def test_identical_payloads_are_stored_once(run_db):
+    cards = [{"title": "提现指南", "data": {"steps": [1, 2, 3]}}]
+
+    async def scenario():
+        conv_id = await db.create_conversation()
+        for _ in range(3):
+            await db.save_message(conv_id, "assistant", "看卡片", cards=cards)
+        await db.flush()
+        return conv_id, (await db.get_messages(conv_id)).messages
+
+    conv_id, messages = run_db(scenario)
+    assert [m["cards"] for m in messages] == [cards] * 3
+    assert _query(db.DB_PATH, "SELECT refs FROM payload") == [(3,)]
+
+
+def test_deleting_last_reference_collects_payload(run_db):
+    shared = [{"title": "共享", "data": {}}]
+
+    async def scenario():
+        a = await db.create_conversation()
+        b = await db.create_conversation()
+        await db.save_message(a, "assistant", "一", cards=shared)
+        await db.save_message(a, "assistant", "二", cards=[{"title": "只属于 a", "data": {}}])
+        await db.save_message(b, "assistant", "三", cards=shared)
+        await db.flush()
+        await db.delete_conversation(a)
+        after_a = _query(db.DB_PATH, "SELECT refs FROM payload")
+        await db.delete_conversation(b)
+        after_b = _query(db.DB_PATH, "SELECT COUNT(*) FROM payload")
+        return after_a, after_b
+
+    after_a, after_b = run_db(scenario)
+    assert after_a == [(1,)]
+    assert after_b == [(0,)]
+
+
+def test_lazy_field_selection(run_db):
+    async def scenario():
+        conv_id = await db.create_conversation()
+        await db.save_message(
+            conv_id, "assistant", "答案",
+            tool_calls=[{"name": "recommend", "args": {}}],
+            cards=[{"title": "卡片", "data": {}}],
+        )
+        await db.flush()
+        db.history_cache.clear()
+        recent = await db.get_recent_messages(conv_id, 5)
+        light = (await db.get_messages(conv_id, include_payloads=False)).messages
+        full = (await db.get_messages(conv_id)).messages
+        return recent[0], light[0], full[0]
+
+    recent, light, full = run_db(scenario)
+    assert recent["cards"][0]["title"] == "卡片" and "tool_calls" not in recent
+    assert not set(payload_store.PAYLOAD_FIELDS) & set(light)
+    assert full["tool_calls"][0]["name"] == "recommend"
+    assert full["evidence"] is None
+
+
+def _insert_legacy(path, conv_id: str, msg_id: str, cards: list) -> None:
+    """旧版本格式：cards 内联存在 message 表，没有 *_ref"""
+    _query(
+        path,
+        "INSERT INTO message (id, conversation_id, role, content, cards, created_at) VALUES (?, ?, 'assistant', '', ?, ?)",
+        (msg_id, conv_id, dumps(cards).decode(), f"2026-01-01T00:00:0{len(msg_id)}"),
+    )
+
+
+def test_legacy_payloads_migrate_once(run_db):
+    legacy_cards = [{"title": "旧卡片", "data": {}}]
+
+    async def scenario():
+        conv_id = await db.create_conversation()
+        await db.flush()
+        await db.close_db()
+        _insert_legacy(db.DB_PATH, conv_id, "m1", legacy_cards)
+        _query(db.DB_PATH, "PRAGMA user_version = 0")
+
+        await db.init_db()
+        migrated = _query(db.DB_PATH, "SELECT cards, cards_ref IS NOT NULL FROM message WHERE id = 'm1'")
+        refs = _query(db.DB_PATH, "SELECT refs FROM payload")
+        version = _query(db.DB_PATH, "PRAGMA user_version")
+        messages = (await db.get_messages(conv_id)).messages
+        await db.close_db()
+
+        # 迁移完成后不再扫描消息表：之后出现的内联行保持原样
+        _insert_legacy(db.DB_PATH, conv_id, "m22", legacy_cards)
+        await db.init_db()
+        skipped = _query(db.DB_PATH, "SELECT cards_ref FROM message WHERE id = 'm22'")
+        return migrated, refs, version, messages, skipped
+
+    migrated, refs, version, messages, skipped = run_db(scenario)
+    assert migrated == [(None, 1)]
+    assert refs == [(1,)]
+    assert version == [(db._USER_VERSION,)]
+    assert messages[0]["cards"] == legacy_cards
+    assert skipped == [(None,)]
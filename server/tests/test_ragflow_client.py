@@ -0,0 +1,182 @@
+"""RAGFlow 客户端：重试、熔断（打开 / 半开）、对冲本地检索与延迟统计（httpx.MockTransport）"""
+
+from __future__ import annotations
+
+import asyncio
+
+import httpx
+import pytest
+
+from config import settings
+from tools import cache as tool_cache
+from tools import knowledge
+from tools.ragflow_client import CLOSED, HALF_OPEN, OPEN, CircuitOpenError, RagflowClient, RagflowError
+
+_OK = {"code": 0, "data": {"chunks": [{"content": "结算在每月月底", "document_name": "结算说明"}]}}
+
+
+@pytest.fixture(autouse=True)
+def _fast_settings(monkeypatch):
+    monkeypatch.setattr(settings, "RAGFLOW_MAX_RETRIES", 2)
+    monkeypatch.setattr(settings, "RAGFLOW_RETRY_BACKOFF", 0.001)
+    monkeypatch.setattr(settings, "RAGFLOW_DEADLINE", 2.0)
+    monkeypatch.setattr(settings, "RAGFLOW_BREAKER_THRESHOLD", 2)
+    monkeypatch.setattr(settings, "RAGFLOW_BREAKER_RESET", 30)
+
+
+def _client(responses) -> tuple[RagflowClient, list[httpx.Request]]:
+    """responses 中每项为状态码、异常或 (延迟秒数, JSON)；按请求顺序依次使用，用完后重复最后一项"""
+    requests: list[httpx.Request] = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        item = responses[min(len(requests), len(responses)) - 1]
+        if isinstance(item, Exception):
+            raise item
+        if isinstance(item, int):
+            return httpx.Response(item, json={"code": 1})
+        delay, body = item
+        await asyncio.sleep(delay)
+        return httpx.Response(200, json=body)
+
+    client = RagflowClient()
+    client._http = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://ragflow.test")
+    return client, requests
+
+
+def _run(client: RagflowClient, coro_fn):
+    async def main():
+        try:
+            return await coro_fn()
+        finally:
+            await client.aclose()
+
+    return asyncio.run(main())
+
+
+def test_retries_5xx_then_succeeds():
+    client, requests = _client([503, 502, (0, _OK)])
+    chunks = _run(client, lambda: client.retrieve("结算", 5))
+    assert chunks[0]["document_name"] == "结算说明"
+    assert len(requests) == 3
+    counts = client.metrics()["counts"]
+    assert counts["retry"] == 2 and counts["ok"] == 1
+    assert client.breaker.state == CLOSED
+
+
+def test_retries_transport_timeout():
+    client, requests = _client([httpx.ReadTimeout("慢"), (0, _OK)])
+    assert _run(client, lambda: client.retrieve("结算", 5))
+    assert len(requests) == 2
+
+
+def test_non_retryable_status_fails_immediately():
+    client, requests = _client([400])
+    with pytest.raises(RagflowError):
+        _run(client, lambda: client.retrieve("结算", 5))
+    assert len(requests) == 1
+    assert client.metrics()["counts"] == {"error": 1}
+
+
+def test_deadline_raises_timeout(monkeypatch):
+    monkeypatch.setattr(settings, "RAGFLOW_DEADLINE", 0.05)
+    client, _ = _client([(1.0, _OK)])
+    with pytest.raises(TimeoutError):
+        _run(client, lambda: client.retrieve("结算", 5))
+    assert client.metrics()["counts"] == {"timeout": 1}
+
+
+def test_breaker_opens_then_half_open_probe_closes_it():
+    client, requests = _client([500, 500, 500, 500, 500, 500, (0, _OK)])
+
+    async def scenario():
+        for _ in range(2):
+            with pytest.raises(RagflowError):
+                await client.retrieve("结算", 5)
+        assert client.breaker.state == OPEN
+        with pytest.raises(CircuitOpenError):
+            await client.retrieve("结算", 5)
+        sent_while_open = len(requests)
+
+        # 冷却期结束：放行一个探测请求，成功后关闭
+        client.breaker.opened_at -= settings.RAGFLOW_BREAKER_RESET
+        assert client.breaker.allow() and client.breaker.state == HALF_OPEN
+        assert not client.breaker.allow()
+        client.breaker.release()
+        chunks = await client.retrieve("结算", 5)
+        return sent_while_open, chunks
+
+    sent_while_open, chunks = _run(client, scenario)
+    assert sent_while_open == 6
+    assert chunks
+    metrics = client.metrics()
+    assert metrics["breaker"] == {"state": CLOSED, "failures": 0, "trips": 1}
+    assert metrics["counts"]["circuit_open"] == 1
+
+
+def test_failed_half_open_probe_reopens():
+    client, _ = _client([500])
+    client.breaker.record_failure()
+    client.breaker.record_failure()
+    client.breaker.opened_at -= settings.RAGFLOW_BREAKER_RESET
+    with pytest.raises(RagflowError):
+        _run(client, lambda: client.retrieve("结算", 5))
+    assert client.breaker.state == OPEN
+    assert client.breaker.trips == 2
+
+
+def test_latency_percentiles():
+    client, _ = _client([(0, _OK)])
+
+    async def scenario():
+        for _ in range(5):
+            await client.retrieve("结算", 5)
+
+    _run(client, scenario)
+    snapshot = client.metrics()
+    assert snapshot["samples"] == 5
+    assert snapshot["latency_ms"]["p50"] is not None
+    assert snapshot["latency_ms"]["p50"] <= snapshot["latency_ms"]["max"]
+
+
+@pytest.fixture
+def hedged(monkeypatch):
+    """ragflow_search 使用 MockTransport 客户端，并清空它的工具缓存"""
+    monkeypatch.setattr(settings, "RAGFLOW_API_KEY", "test-key")
+    tool_cache.clear("ragflow_search")
+
+    def install(responses) -> RagflowClient:
+        client, _ = _client(responses)
+        monkeypatch.setattr(knowledge, "ragflow_client", client)
+        return client
+
+    yield install
+    tool_cache.clear("ragflow_search")
+
+
+def test_hedged_local_search_wins_on_slow_upstream(hedged, monkeypatch):
+    monkeypatch.setattr(settings, "RAGFLOW_HEDGE_DELAY", 0.01)
+    monkeypatch.setattr(settings, "RAGFLOW_DEADLINE", 0.2)
+    client = hedged([(5.0, _OK)])
+    result = _run(client, lambda: knowledge.ragflow_search.ainvoke({"query": "结算周期"}))
+    assert result["fallback"] == "timeout"
+    assert "results" in result
+    counts = client.metrics()["counts"]
+    assert counts["hedge_win"] == 1 and counts["timeout"] == 1
+
+
+def test_fast_upstream_beats_hedge(hedged, monkeypatch):
+    monkeypatch.setattr(settings, "RAGFLOW_HEDGE_DELAY", 1.0)
+    client = hedged([(0, _OK)])
+    result = _run(client, lambda: knowledge.ragflow_search.ainvoke({"query": "结算周期"}))
+    assert "fallback" not in result
+    assert result["results"][0]["source"] == "结算说明"
+    assert "hedge_win" not in client.metrics()["counts"]
+
+
+def test_open_breaker_falls_back_without_request(hedged):
+    client = hedged([(0, _OK)])
+    client.breaker.record_failure()
+    client.breaker.record_failure()
+    result = _run(client, lambda: knowledge.ragflow_search.ainvoke({"query": "结算周期"}))
+    assert result["fallback"] == "circuit_open"
@@ -0,0 +1,164 @@
+"""会话历史全文检索：n-gram 查询表达式、片段高亮与 search_messages"""
+
+from __future__ import annotations
+
+import sqlite3
+
+import database as db
+import fts
+
+
+def test_match_expression():
+    assert fts.match_expression("结算") == '"结算"'
+    assert fts.match_expression("版税结算") == '"版税 税结 结算"'
+    assert fts.match_expression("钱") == '"钱"'
+    assert fts.match_expression("MP3 格式") == '"MP3" AND "格式"'
+    assert fts.match_expression("，。！") is None
+
+
+def test_index_text_splits_cjk_into_bigrams_then_unigrams():
+    assert fts.index_text("上传MP3文件") == "上传 上 传 MP3 文件 文 件"
+    assert fts.index_text("版税结算") == "版税 税结 结算 版 税 结 算"
+    assert fts.index_text("曲") == "曲"
+    assert fts.index_text(None) == ""
+
+
+def test_snippet_highlights_terms_in_original_text():
+    text = "前面很长的铺垫" * 10 + "版税结算在每月月底"
+    piece, highlights = fts.snippet(text, "结算", width=20)
+    assert piece.startswith("…")
+    assert [piece[s:e] for s, e in highlights] == ["结算"]
+
+
+def test_snippet_merges_overlapping_highlights():
+    piece, highlights = fts.snippet("Upload upload", "UPLOAD load")
+    assert piece == "Upload upload"
+    assert highlights == [(0, 6), (7, 13)]
+
+
+async def _seed() -> dict[str, str]:
+    a = await db.create_conversation("结算问题")
+    b = await db.create_conversation("上传问题")
+    ids = {
+        "settle": await db.save_message(a, "user", "版税结算什么时候到账"),
+        "money": await db.save_message(a, "assistant", "钱会在每月月底打到你的账户"),
+        "card": await db.save_message(a, "assistant", "请看下面的说明", cards=[{"title": "提现指南", "data": {}}]),
+        "upload": await db.save_message(b, "user", "上传的文件需要什么格式，结算方式一样吗"),
+    }
+    await db.flush()
+    ids["a"], ids["b"] = a, b
+    return ids
+
+
+def test_two_character_query_matches_substring(run_db):
+    async def scenario():
+        ids = await _seed()
+        return ids, (await db.search_messages("结算"))[0]
+
+    ids, results = run_db(scenario)
+    assert {r["message_id"] for r in results} == {ids["settle"], ids["upload"]}
+    assert all("结算" in r["snippet"] for r in results)
+
+
+def test_single_character_query_uses_prefix(run_db):
+    async def scenario():
+        ids = await _seed()
+        return ids, (await db.search_messages("钱"))[0]
+
+    ids, results = run_db(scenario)
+    assert [r["message_id"] for r in results] == [ids["money"]]
+    snippet, (start, end) = results[0]["snippet"], results[0]["highlights"][0]
+    assert snippet[start:end] == "钱"
+
+
+def test_single_character_at_end_of_run_matches(run_db):
+    async def scenario():
+        conv_id = await db.create_conversation()
+        msg_id = await db.save_message(conv_id, "user", "帮我做个总结")
+        await db.flush()
+        found = {q: [r["message_id"] for r in (await db.search_messages(q))[0]] for q in ("结", "总", "总结", "个总")}
+        return msg_id, found
+
+    msg_id, found = run_db(scenario)
+    assert found == {"结": [msg_id], "总": [msg_id], "总结": [msg_id], "个总": [msg_id]}
+
+
+def test_bigram_phrases_do_not_match_across_unigrams(run_db):
+    async def scenario():
+        conv_id = await db.create_conversation()
+        await db.save_message(conv_id, "user", "总结")
+        await db.flush()
+        # 「结总」不是原文子串，不能因为段尾追加的单字「总 结」而命中
+        return await db.search_messages("结总")
+
+    assert run_db(scenario) == ([], None)
+
+
+def test_card_title_only_match_snippets_title(run_db):
+    async def scenario():
+        ids = await _seed()
+        return ids, (await db.search_messages("提现"))[0]
+
+    ids, results = run_db(scenario)
+    assert [r["message_id"] for r in results] == [ids["card"]]
+    assert results[0]["snippet"] == "提现指南"
+    assert results[0]["conversation_title"] == "结算问题"
+
+
+def test_terms_are_anded_and_filter_by_conversation(run_db):
+    async def scenario():
+        ids = await _seed()
+        anded = (await db.search_messages("结算 格式"))[0]
+        filtered = (await db.search_messages("结算", conversation_id=ids["a"]))[0]
+        return ids, anded, filtered
+
+    ids, anded, filtered = run_db(scenario)
+    assert [r["message_id"] for r in anded] == [ids["upload"]]
+    assert [r["message_id"] for r in filtered] == [ids["settle"]]
+
+
+def test_paging_and_deleted_conversations(run_db):
+    async def scenario():
+        conv_id = await db.create_conversation()
+        for i in range(5):
+            await db.save_message(conv_id, "user", f"结算第{i}次")
+        await db.flush()
+        first, cursor = await db.search_messages("结算", limit=3)
+        second, last_cursor = await db.search_messages("结算", limit=3, cursor=cursor)
+        await db.delete_conversation(conv_id)
+        await db.flush()
+        after_delete, _ = await db.search_messages("结算")
+        return first, second, last_cursor, after_delete
+
+    first, second, last_cursor, after_delete = run_db(scenario)
+    assert len(first) == 3 and len(second) == 2
+    assert last_cursor is None
+    assert len({r["message_id"] for r in first + second}) == 5
+    assert after_delete == []
+
+
+def test_query_without_terms_returns_nothing(run_db):
+    async def scenario():
+        await _seed()
+        return await db.search_messages("！？")
+
+    assert run_db(scenario) == ([], None)
+
+
+def test_legacy_bigram_only_index_is_rebuilt(run_db):
+    async def scenario():
+        conv_id = await db.create_conversation()
+        msg_id = await db.save_message(conv_id, "user", "帮我做个总结")
+        await db.flush()
+        await db.close_db()
+        # 模拟旧版本：只有 bigram 的索引
+        conn = sqlite3.connect(db.DB_PATH)
+        conn.execute("UPDATE message_fts SET body = ?", ("帮我 我做 做个 个总 总结",))
+        conn.execute("PRAGMA user_version = 1")
+        conn.commit()
+        conn.close()
+        await db.init_db()
+        return msg_id, (await db.search_messages("结"))[0]
+
+    msg_id, results = run_db(scenario)
+    assert [r["message_id"] for r in results] == [msg_id]
@@ -0,0 +1,42 @@
+"""应用关闭：先结束后台任务，再关闭数据库"""
+
+from __future__ import annotations
+
+import asyncio
+
+import context_builder
+import follow_ups
+import llm_cache
+import main
+
+
+def test_drain_waits_for_quick_tasks_and_cancels_slow_ones(monkeypatch):
+    monkeypatch.setattr(follow_ups, "_pending", {})
+    monkeypatch.setattr(context_builder, "_folding", {})
+    monkeypatch.setattr(llm_cache, "_pending", set())
+    finished: list[str] = []
+
+    async def work(name: str, delay: float) -> None:
+        await asyncio.sleep(delay)
+        finished.append(name)
+
+    async def scenario():
+        quick = asyncio.create_task(work("摘要", 0.01))
+        slow = asyncio.create_task(work("追问", 10))
+        context_builder._folding["c"] = quick
+        follow_ups._pending["m"] = slow
+        llm_cache._pending.add(asyncio.create_task(work("清理缓存", 0)))
+        await asyncio.wait_for(main._drain_background_tasks(timeout=0.1), timeout=5)
+        return quick, slow
+
+    quick, slow = asyncio.run(scenario())
+    assert sorted(finished) == sorted(["摘要", "清理缓存"])
+    assert quick.done() and not quick.cancelled()
+    assert slow.cancelled()
+
+
+def test_drain_without_tasks_returns_immediately(monkeypatch):
+    monkeypatch.setattr(follow_ups, "_pending", {})
+    monkeypatch.setattr(context_builder, "_folding", {})
+    monkeypatch.setattr(llm_cache, "_pending", set())
+    asyncio.run(asyncio.wait_for(main._drain_background_tasks(timeout=60), timeout=1))
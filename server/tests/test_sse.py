@@ -0,0 +1,101 @@
+"""SSE 帧编码：token 合并窗口、按字节刷出、非 token 事件前刷出与提前关闭"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+
+import sse
+
+
+def _decode(frames: list[bytes]) -> list[dict]:
+    return [json.loads(f.decode("utf-8")[len("data: "):]) for f in frames]
+
+
+async def _source(events: list, closed: list | None = None):
+    """按顺序产出事件；数字表示先等待该秒数"""
+    try:
+        for item in events:
+            if isinstance(item, (int, float)):
+                await asyncio.sleep(item)
+            else:
+                yield item
+    finally:
+        if closed is not None:
+            closed.append(True)
+
+
+def _encode(events: list, **kwargs) -> list[dict]:
+    async def main():
+        return [frame async for frame in sse.encode_stream(_source(events), **kwargs)]
+
+    return _decode(asyncio.run(main()))
+
+
+def _token(text: str) -> dict:
+    return {"type": "token", "content": text}
+
+
+def test_event_envelopes_match_plain_json():
+    for event in (_token("你好\n\"引号\""), {"type": "card", "card": {"title": "卡片"}}, {"type": "done", "conversation_id": "c"}):
+        frame = sse.encode_event(event)
+        assert frame.startswith(b"data: ") and frame.endswith(b"\n\n")
+        assert _decode([frame]) == [event]
+
+
+def test_tokens_within_window_merge_into_one_frame():
+    frames = _encode([_token("一"), _token("二"), _token(""), _token("三")], window_ms=1000)
+    assert frames == [_token("一二三")]
+
+
+def test_window_expiry_flushes_while_upstream_is_idle():
+    frames = _encode([_token("一"), _token("二"), 0.2, _token("三")], window_ms=20)
+    assert frames == [_token("一二"), _token("三")]
+
+
+def test_byte_limit_flushes_early():
+    frames = _encode([_token("ab"), _token("cd"), _token("e")], window_ms=1000, max_bytes=4)
+    assert frames == [_token("abcd"), _token("e")]
+
+
+def test_non_token_event_flushes_buffer_first():
+    card = {"type": "card", "card": {"title": "卡片"}}
+    done = {"type": "done", "conversation_id": "c", "message_id": "m"}
+    frames = _encode([_token("一"), _token("二"), card, _token("三"), done], window_ms=1000)
+    assert frames == [_token("一二"), card, _token("三"), done]
+
+
+def test_coalesce_disabled_sends_every_token():
+    events = [_token("一"), _token("二")]
+    assert _encode(events, coalesce=False) == events
+
+
+def test_aclose_after_window_flush_closes_upstream():
+    closed: list = []
+
+    async def main():
+        stream = sse.encode_stream(_source([_token("一"), 10, _token("不会发送")], closed), window_ms=20)
+        first = await asyncio.wait_for(stream.__anext__(), timeout=1)
+        # 上游仍在等待下一个事件时关闭输出流（客户端断开）
+        await asyncio.wait_for(stream.aclose(), timeout=1)
+        return first
+
+    assert _decode([asyncio.run(main())]) == [_token("一")]
+    assert closed == [True]
+
+
+def test_cancel_while_tokens_are_buffered_closes_upstream():
+    closed: list = []
+
+    async def main():
+        stream = sse.encode_stream(_source([_token("一"), 10], closed), window_ms=5000)
+        # 「一」已进入缓冲、窗口未到期时取消读取方
+        reader = asyncio.ensure_future(stream.__anext__())
+        await asyncio.sleep(0.05)
+        reader.cancel()
+        await asyncio.gather(reader, return_exceptions=True)
+        await asyncio.wait_for(stream.aclose(), timeout=1)
+        return reader.cancelled()
+
+    assert asyncio.run(main())
+    assert closed == [True]
@@ -0,0 +1,182 @@
+"""工具结果缓存：参数归一化、TTL、stale-while-revalidate、LRU 与错误结果"""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from config import settings
+from tools import cache as tool_cache
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+class _InlinePool:
+    """同步执行后台刷新，便于断言"""
+
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = _Clock()
+    monkeypatch.setattr(tool_cache, "time", SimpleNamespace(monotonic=c.monotonic))
+    monkeypatch.setattr(tool_cache, "_refresh_pool", _InlinePool())
+    monkeypatch.setattr(settings, "TOOL_CACHE_ENABLED", True)
+    return c
+
+
+def _counting_tool(ttl: float, stale_ttl: float = 0, maxsize: int = 16, result=None):
+    calls = []
+
+    @tool_cache.cached(ttl=ttl, stale_ttl=stale_ttl, maxsize=maxsize)
+    def lookup_tool(query: str, budget: float = 1000.0) -> dict:
+        calls.append((query, budget))
+        return result(len(calls)) if result else {"query": query, "n": len(calls)}
+
+    return lookup_tool, calls
+
+
+def test_equivalent_arguments_share_an_entry(clock):
+    tool, calls = _counting_tool(ttl=60)
+    first = tool("  月光   信箱 ", 1000.0)
+    second = tool("月光 信箱", budget=1000)
+    third = tool("月光 信箱")
+    assert len(calls) == 1
+    assert first == second == third
+    assert tool.cache.hits == 2
+
+
+def test_entries_expire_after_ttl_without_stale_window(clock):
+    tool, calls = _counting_tool(ttl=60)
+    tool("a")
+    clock.now += 61
+    assert tool("a")["n"] == 2
+    assert len(calls) == 2
+
+
+def test_stale_value_is_served_while_refreshing(clock):
+    tool, calls = _counting_tool(ttl=60, stale_ttl=120)
+    assert tool("a")["n"] == 1
+    clock.now += 90
+    # 过期但在 stale 窗口内：先返回旧值，后台（此处同步执行）刷新
+    assert tool("a")["n"] == 1
+    assert len(calls) == 2
+    assert tool("a")["n"] == 2
+    assert tool.cache.stale_hits == 1
+    assert tool.cache.refreshes == 1
+
+
+def test_entries_past_stale_window_reload_synchronously(clock):
+    tool, calls = _counting_tool(ttl=60, stale_ttl=30)
+    tool("a")
+    clock.now += 100
+    assert tool("a")["n"] == 2
+    assert tool.cache.stale_hits == 0
+
+
+def test_error_results_are_not_cached(clock):
+    tool, calls = _counting_tool(ttl=60, result=lambda n: {"error": "上游失败", "n": n})
+    tool("a")
+    tool("a")
+    assert len(calls) == 2
+
+
+def test_lru_evicts_oldest_entry(clock):
+    tool, calls = _counting_tool(ttl=60, maxsize=2)
+    tool("a")
+    tool("b")
+    tool("a")
+    tool("c")
+    tool("a")
+    tool("b")
+    assert [q for q, _ in calls] == ["a", "b", "c", "b"]
+
+
+def test_callers_get_independent_copies(clock):
+    tool, _ = _counting_tool(ttl=60)
+    tool("a")["query"] = "被调用方修改"
+    assert tool("a")["query"] == "a"
+
+
+def test_async_tool_stale_refresh(clock):
+    calls = []
+
+    @tool_cache.cached(ttl=60, stale_ttl=120)
+    async def async_lookup_tool(query: str) -> dict:
+        calls.append(query)
+        return {"n": len(calls)}
+
+    async def scenario():
+        first = await async_lookup_tool("a")
+        clock.now += 90
+        stale = await async_lookup_tool("a")
+        await asyncio.gather(*tool_cache._refresh_tasks)
+        fresh = await async_lookup_tool("a")
+        return first, stale, fresh
+
+    assert asyncio.run(scenario()) == ({"n": 1}, {"n": 1}, {"n": 2})
+
+
+def test_disabled_cache_always_executes(clock, monkeypatch):
+    monkeypatch.setattr(settings, "TOOL_CACHE_ENABLED", False)
+    tool, calls = _counting_tool(ttl=60)
+    tool("a")
+    tool("a")
+    assert len(calls) == 2
+
+
+def test_concurrent_async_misses_coalesce(clock):
+    calls = []
+
+    @tool_cache.cached(ttl=60)
+    async def async_lookup_tool(query: str) -> dict:
+        calls.append(query)
+        await asyncio.sleep(0.01)
+        return {"query": query}
+
+    async def scenario():
+        return await asyncio.gather(*(async_lookup_tool("a") for _ in range(5)))
+
+    results = asyncio.run(scenario())
+    assert results == [{"query": "a"}] * 5
+    assert len(calls) == 1
+    stats = async_lookup_tool.cache.stats()
+    assert stats["misses"] == 1
+    assert stats["coalesced"] == 4
+    assert stats["executions"] == 1
+
+
+def test_concurrent_sync_misses_coalesce(clock):
+    gate = threading.Event()
+    calls = []
+
+    @tool_cache.cached(ttl=60)
+    def slow_lookup_tool(query: str) -> dict:
+        calls.append(query)
+        gate.wait(5)
+        return {"query": query}
+
+    threads = [threading.Thread(target=slow_lookup_tool, args=("a",)) for _ in range(4)]
+    for t in threads:
+        t.start()
+    while slow_lookup_tool.cache.stats()["coalesced"] < 3 and any(t.is_alive() for t in threads):
+        time.sleep(0.01)
+    gate.set()
+    for t in threads:
+        t.join(5)
+
+    assert len(calls) == 1
+    assert slow_lookup_tool.cache.misses == 1
+    assert slow_lookup_tool.cache.coalesced == 3
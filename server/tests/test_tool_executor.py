@@ -0,0 +1,121 @@
+"""并发工具执行器：并发上限、单工具超时、未知工具与原始顺序还原"""
+
+from __future__ import annotations
+
+import asyncio
+
+from langchain_core.tools import tool
+
+from tool_executor import execute_tool_calls
+
+_running = {"now": 0, "peak": 0}
+
+
+@tool
+async def slow_echo(text: str, delay: float = 0.0) -> dict:
+    """按给定延迟返回输入"""
+    _running["now"] += 1
+    _running["peak"] = max(_running["peak"], _running["now"])
+    try:
+        await asyncio.sleep(delay)
+    finally:
+        _running["now"] -= 1
+    return {"text": text}
+
+
+@tool
+async def broken(text: str) -> dict:
+    """总是失败"""
+    raise RuntimeError("下游出错")
+
+
+@tool
+def json_string(text: str) -> str:
+    """返回 JSON 字符串"""
+    return '{"text": "%s"}' % text
+
+
+_TOOLS = {t.name: t for t in (slow_echo, broken, json_string)}
+
+
+def _call(name: str, **args) -> dict:
+    return {"name": name, "args": args, "id": f"call_{name}"}
+
+
+def _collect(tool_calls: list[dict], max_concurrency: int = 4, timeout: float = 5.0) -> list:
+    async def main():
+        return [
+            outcome
+            async for outcome in execute_tool_calls(
+                tool_calls, _TOOLS, max_concurrency=max_concurrency, timeout=timeout,
+            )
+        ]
+
+    _running.update(now=0, peak=0)
+    return asyncio.run(main())
+
+
+def test_yields_in_completion_order_with_original_index():
+    calls = [
+        _call("slow_echo", text="慢", delay=0.1),
+        _call("slow_echo", text="快", delay=0.0),
+        _call("slow_echo", text="中", delay=0.05),
+    ]
+    outcomes = _collect(calls)
+    assert [o.result["text"] for o in outcomes] == ["快", "中", "慢"]
+    assert [o.index for o in outcomes] == [1, 2, 0]
+    assert all(o.ok and o.tool_call is calls[o.index] for o in outcomes)
+    assert [o.result["text"] for o in sorted(outcomes, key=lambda o: o.index)] == ["慢", "快", "中"]
+
+
+def test_concurrency_is_limited():
+    calls = [_call("slow_echo", text=str(i), delay=0.02) for i in range(6)]
+    outcomes = _collect(calls, max_concurrency=2)
+    assert len(outcomes) == 6
+    assert _running["peak"] == 2
+
+
+def test_non_positive_concurrency_still_runs_one_at_a_time():
+    outcomes = _collect([_call("slow_echo", text=str(i), delay=0.01) for i in range(3)], max_concurrency=0)
+    assert len(outcomes) == 3 and _running["peak"] == 1
+
+
+def test_timeout_only_affects_the_slow_tool():
+    outcomes = _collect(
+        [_call("slow_echo", text="超时", delay=5), _call("slow_echo", text="正常", delay=0)],
+        timeout=0.05,
+    )
+    by_index = {o.index: o for o in outcomes}
+    assert by_index[1].ok and by_index[1].result == {"text": "正常"}
+    assert not by_index[0].ok
+    assert "超时" in by_index[0].result["error"]
+
+
+def test_unknown_tool_and_failures_become_error_results():
+    outcomes = _collect([_call("missing", text="x"), _call("broken", text="x")])
+    by_name = {o.name: o for o in outcomes}
+    assert not by_name["missing"].ok
+    assert by_name["missing"].result == {"error": "未找到工具: missing"}
+    assert by_name["broken"].result == {"error": "下游出错"}
+
+
+def test_string_results_are_parsed_as_json():
+    [outcome] = _collect([_call("json_string", text="你好")])
+    assert outcome.result == {"text": "你好"}
+
+
+def test_closing_generator_cancels_pending_tools():
+    async def main():
+        gen = execute_tool_calls(
+            [_call("slow_echo", text="快", delay=0), _call("slow_echo", text="慢", delay=5)],
+            _TOOLS, max_concurrency=2, timeout=10,
+        )
+        first = await gen.__anext__()
+        await gen.aclose()
+        await asyncio.sleep(0)
+        return first
+
+    _running.update(now=0, peak=0)
+    first = asyncio.run(asyncio.wait_for(main(), timeout=2))
+    assert first.result == {"text": "快"}
+    assert _running["now"] == 0
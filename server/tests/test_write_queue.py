@@ -0,0 +1,123 @@
+"""写后队列（group commit）：批量提交、失败逐条重试、读己之写、关闭时落盘"""
+
+from __future__ import annotations
+
+import asyncio
+import sqlite3
+
+import pytest
+
+import database as db
+from config import settings
+
+
+def _insert(conv_id: str) -> tuple[str, tuple]:
+    return (
+        "INSERT INTO conversation (id, title, created_at, updated_at) VALUES (?, ?, ?, ?)",
+        (conv_id, "t", "2026-01-01T00:00:00", "2026-01-01T00:00:00"),
+    )
+
+
+def _conversation_ids(path) -> set[str]:
+    conn = sqlite3.connect(path)
+    try:
+        return {r[0] for r in conn.execute("SELECT id FROM conversation")}
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def queue_run(tmp_path, monkeypatch):
+    """直接在连接池上构造写队列：queue_run(scenario, flush_interval) 中 scenario(queue)"""
+    path = tmp_path / "queue.db"
+    monkeypatch.setattr(db, "DB_PATH", path)
+
+    def run(scenario, flush_interval: float = 0.05, max_batch: int = 256):
+        async def main():
+            await db.init_db()
+            await db.close_db()
+            pool = db._ConnectionPool(path, 1)
+            await pool.open()
+            queue = db._WriteBehindQueue(pool, max_batch, flush_interval)
+            try:
+                return await scenario(queue)
+            finally:
+                await queue.close()
+                await pool.close()
+
+        return asyncio.run(main())
+
+    run.path = path
+    return run
+
+
+def test_concurrent_ops_commit_in_one_batch(queue_run, monkeypatch):
+    batches: list[int] = []
+    original = db._WriteBehindQueue._apply
+
+    async def counting_apply(conn, ops):
+        batches.append(len(ops))
+        await original(conn, ops)
+
+    monkeypatch.setattr(db._WriteBehindQueue, "_apply", staticmethod(counting_apply))
+
+    async def scenario(queue):
+        futures = [queue.submit(f"c{i}", [_insert(f"c{i}")]) for i in range(10)]
+        await asyncio.gather(*futures)
+
+    queue_run(scenario)
+    assert batches == [10]
+    assert _conversation_ids(queue_run.path) == {f"c{i}" for i in range(10)}
+
+
+def test_batch_failure_retries_each_op(queue_run):
+    async def scenario(queue):
+        ok1 = queue.submit("a", [_insert("a")])
+        dup = queue.submit("a", [_insert("a")])
+        ok2 = queue.submit("b", [_insert("b")])
+        return await asyncio.gather(ok1, dup, ok2, return_exceptions=True)
+
+    results = queue_run(scenario)
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], sqlite3.IntegrityError)
+    assert _conversation_ids(queue_run.path) == {"a", "b"}
+
+
+def test_flush_barrier_commits_without_waiting_for_interval(queue_run):
+    async def scenario(queue):
+        queue.submit("a", [_insert("a")])
+        assert queue.has_pending("a")
+        await asyncio.wait_for(queue.flush(), timeout=5)
+        assert not queue.has_pending("a")
+        return _conversation_ids(queue_run.path)
+
+    # 间隔远大于超时：只有屏障能让它及时提交
+    assert queue_run(scenario, flush_interval=60) == {"a"}
+
+
+def test_close_flushes_pending_writes(queue_run):
+    async def scenario(queue):
+        for conv_id in ("a", "b", "c"):
+            queue.submit(conv_id, [_insert(conv_id)])
+        await asyncio.wait_for(queue.close(), timeout=5)
+        with pytest.raises(RuntimeError):
+            queue.submit("d", [_insert("d")])
+
+    queue_run(scenario, flush_interval=60)
+    assert _conversation_ids(queue_run.path) == {"a", "b", "c"}
+
+
+def test_reads_see_own_unflushed_writes(run_db, monkeypatch):
+    monkeypatch.setattr(settings, "DB_WRITE_FLUSH_MS", 60_000)
+
+    async def scenario():
+        conv_id = await db.create_conversation("标题")
+        msg_id = await db.save_message(conv_id, "user", "你好")
+        db.history_cache.clear()
+        conv = await asyncio.wait_for(db.get_conversation(conv_id), timeout=5)
+        page = await asyncio.wait_for(db.get_messages(conv_id), timeout=5)
+        return conv, [m["id"] for m in page.messages], msg_id
+
+    conv, ids, msg_id = run_db(scenario)
+    assert conv["title"] == "标题" and conv["message_count"] == 1
+    assert ids == [msg_id]
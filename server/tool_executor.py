@@ -0,0 +1,96 @@
+"""并发工具执行器 — 同一轮的多个 tool_calls 并行执行
+
+- 通过信号量限制并发数，避免一次性打满下游服务
+- 每个工具独立超时，慢工具不会拖住其它工具
+- 按完成顺序产出结果，便于卡片尽早推送给前端；
+  调用方用 ToolOutcome.index 还原原始顺序来构建 ToolMessage
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncGenerator
+
+from langchain_core.tools import BaseTool
+
+from serialization import loads
+
+logger = logging.getLogger("agent")
+
+
+@dataclass
+class ToolOutcome:
+    """单个工具调用的执行结果"""
+    index: int              # 在 tool_calls 中的原始位置
+    tool_call: dict
+    result: dict[str, Any]
+    ok: bool                # 工具是否存在且成功返回
+    elapsed: float          # 耗时（秒）
+
+    @property
+    def name(self) -> str:
+        return self.tool_call["name"]
+
+
+async def _run_one(
+    index: int,
+    tool_call: dict,
+    tool_map: dict[str, BaseTool],
+    semaphore: asyncio.Semaphore,
+    timeout: float,
+) -> ToolOutcome:
+    tool_name = tool_call["name"]
+    tool_args = tool_call.get("args") or {}
+    tool_fn = tool_map.get(tool_name)
+
+    if tool_fn is None:
+        logger.warning(f"[Agent] 未找到工具: {tool_name}")
+        return ToolOutcome(index, tool_call, {"error": f"未找到工具: {tool_name}"}, False, 0.0)
+
+    async with semaphore:
+        logger.info(f"[Agent] 调用工具: {tool_name}, 参数: {tool_args}")
+        start = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(tool_fn.ainvoke(tool_args), timeout=timeout)
+            if isinstance(result, str):
+                result = loads(result)
+            ok = True
+            logger.info(f"[Agent] 工具 {tool_name} 返回成功 ({time.perf_counter() - start:.2f}s)")
+        except asyncio.TimeoutError:
+            logger.error(f"[Agent] 工具 {tool_name} 执行超时 ({timeout}s)")
+            result = {"error": f"工具 {tool_name} 执行超时（{timeout:g} 秒）"}
+            ok = False
+        except Exception as e:
+            logger.error(f"[Agent] 工具 {tool_name} 执行失败: {e}")
+            result = {"error": str(e)}
+            ok = False
+
+    return ToolOutcome(index, tool_call, result, ok, time.perf_counter() - start)
+
+
+async def execute_tool_calls(
+    tool_calls: list[dict],
+    tool_map: dict[str, BaseTool],
+    *,
+    max_concurrency: int,
+    timeout: float,
+) -> AsyncGenerator[ToolOutcome, None]:
+    """并发执行 tool_calls，按完成顺序逐个产出 ToolOutcome。
+
+    生成器提前关闭（如客户端断开）时，取消所有未完成的工具任务。
+    """
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+    tasks = [
+        asyncio.create_task(_run_one(i, tc, tool_map, semaphore, timeout))
+        for i, tc in enumerate(tool_calls)
+    ]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
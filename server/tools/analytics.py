@@ -8,8 +8,12 @@ from __future__ import annotations
 import random
 from langchain_core.tools import tool
 
+from config import settings
+from tools.cache import cached
+
 
 @tool
+@cached(ttl=settings.TOOL_CACHE_TTL_ANALYTICS)
 def get_audience_portrait(song_name: str = "全部作品") -> dict:
     """获取听众画像分析，包括年龄、性别、地域、听歌偏好等维度。
 
@@ -50,6 +54,7 @@ def get_audience_portrait(song_name: str = "全部作品") -> dict:
 
 
 @tool
+@cached(ttl=settings.TOOL_CACHE_TTL_ANALYTICS)
 def analyze_cross_platform(song_name: str = "月光信箱") -> dict:
     """分析歌曲在不同平台的表现差异，并给出归因和策略建议。
 
@@ -0,0 +1,298 @@
+"""本地检索引擎 — 字符 n-gram 倒排索引 + BM25
+
+- 分词：中日韩连续文本切成 bigram / trigram（单字文本保留单字），英文与数字按词
+- 词项以 64 位哈希表示：词表是一段有序的 uint64 数组 + 区间偏移，查询用二分查找，
+  不需要在内存中构建 dict，便于持久化后直接 mmap
+- 建索引时预先算好每个 (词项, 文档) 的 BM25 得分贡献（impact），所有 posting 按 CSR
+  布局存成两段连续数组（doc_id / impact），查询用 NumPy 向量化累加
+- Segment 只记录一批文档的词频，与全局统计无关，可按内容哈希缓存；多个 Segment
+  合并时再统一计算 idf / 长度归一化
+- 分类过滤：每个分类预先生成一份文档掩码（即该分类的 posting list），与累加结果求交
+- 结果用 argpartition 取 top-k，不对全部候选排序
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import re
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Sequence
+
+import numpy as np
+
+_TERM_RE = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯]+|[a-z0-9]+")
+_CJK_RE = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯]")
+
+_ARRAYS = ("term_hashes", "term_offsets", "doc_ids", "impacts", "doc_categories")
+
+
+def tokenize(text: str) -> list[str]:
+    """字符 n-gram 分词（bigram + trigram）"""
+    terms: list[str] = []
+    for run in _TERM_RE.findall(text.lower()):
+        if not _CJK_RE.match(run):
+            terms.append(run)
+            continue
+        n = len(run)
+        if n == 1:
+            terms.append(run)
+            continue
+        terms.extend(run[i:i + 2] for i in range(n - 1))
+        terms.extend(run[i:i + 3] for i in range(n - 2))
+    return terms
+
+
+def term_hash(term: str) -> int:
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+@dataclass(frozen=True)
+class Document:
+    text: str
+    category: str
+    # 额外加权的文本（如 FAQ 问题），词频按 title_boost 倍计
+    title: str = ""
+
+
+@dataclass(frozen=True)
+class SearchHit:
+    doc_id: int
+    score: float
+
+
+# ── Segment：一批文档的词频 ────────────────────────────
+
+@dataclass
+class Segment:
+    term_hashes: np.ndarray     # uint64，每个 (词项, 文档) 一项
+    doc_ids: np.ndarray         # uint32，段内文档下标
+    freqs: np.ndarray           # float32，加权后的词频
+    lengths: np.ndarray         # float32，每篇文档的词项总数
+    categories: list[str]       # 每篇文档的分类
+
+    @classmethod
+    def from_documents(cls, documents: Iterable[Document], title_boost: int = 2) -> Segment:
+        hashes: dict[str, int] = {}
+        term_hashes: list[int] = []
+        doc_ids: list[int] = []
+        freqs: list[int] = []
+        lengths: list[int] = []
+        categories: list[str] = []
+        for doc_id, doc in enumerate(documents):
+            tf = Counter(tokenize(doc.text))
+            if doc.title:
+                for term, count in Counter(tokenize(doc.title)).items():
+                    tf[term] += count * title_boost
+            for term, freq in tf.items():
+                h = hashes.get(term)
+                if h is None:
+                    h = hashes[term] = term_hash(term)
+                term_hashes.append(h)
+                doc_ids.append(doc_id)
+                freqs.append(freq)
+            lengths.append(sum(tf.values()))
+            categories.append(doc.category)
+        return cls(
+            np.asarray(term_hashes, dtype=np.uint64),
+            np.asarray(doc_ids, dtype=np.uint32),
+            np.asarray(freqs, dtype=np.float32),
+            np.asarray(lengths, dtype=np.float32),
+            categories,
+        )
+
+    @property
+    def doc_count(self) -> int:
+        return len(self.lengths)
+
+    def save(self, path: Path) -> None:
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                term_hashes=self.term_hashes,
+                doc_ids=self.doc_ids,
+                freqs=self.freqs,
+                lengths=self.lengths,
+                categories=np.asarray(self.categories, dtype=str),
+            )
+
+    @classmethod
+    def load(cls, path: Path) -> Segment:
+        with np.load(path) as data:
+            return cls(
+                data["term_hashes"],
+                data["doc_ids"],
+                data["freqs"],
+                data["lengths"],
+                data["categories"].tolist(),
+            )
+
+
+# ── 索引 ──────────────────────────────────────────────
+
+class BM25Index:
+    """只读 BM25 倒排索引，由 build() / from_segments() 构建或从磁盘 load()"""
+
+    def __init__(
+        self,
+        term_hashes: np.ndarray,
+        term_offsets: np.ndarray,
+        doc_ids: np.ndarray,
+        impacts: np.ndarray,
+        doc_categories: np.ndarray,
+        category_names: list[str],
+    ):
+        self._term_hashes = term_hashes         # uint64，有序且唯一
+        self._term_offsets = term_offsets       # uint64，长度为词项数 + 1
+        self._doc_ids = doc_ids                 # uint32，各 posting 内按 doc_id 递增
+        self._impacts = impacts                 # float32
+        self._doc_categories = doc_categories   # uint16，文档所属分类下标
+        self._category_names = category_names
+        self._category_index = {name: i for i, name in enumerate(category_names)}
+        self._category_masks: dict[int, np.ndarray] = {}
+        self.doc_count = len(doc_categories)
+
+    @classmethod
+    def build(
+        cls,
+        documents: Iterable[Document],
+        k1: float = 1.2,
+        b: float = 0.75,
+        title_boost: int = 2,
+    ) -> BM25Index:
+        return cls.from_segments([Segment.from_documents(documents, title_boost)], k1, b)
+
+    @classmethod
+    def from_segments(cls, segments: Sequence[Segment], k1: float = 1.2, b: float = 0.75) -> BM25Index:
+        """合并多个 Segment（文档编号按顺序顺延），统一计算 BM25 impact"""
+        category_index: dict[str, int] = {}
+        term_hashes, doc_ids, freqs, lengths, doc_categories = [], [], [], [], []
+        base = 0
+        for seg in segments:
+            term_hashes.append(seg.term_hashes)
+            doc_ids.append(seg.doc_ids.astype(np.uint32) + np.uint32(base))
+            freqs.append(seg.freqs)
+            lengths.append(seg.lengths)
+            doc_categories.extend(category_index.setdefault(c, len(category_index)) for c in seg.categories)
+            base += seg.doc_count
+
+        th = np.concatenate(term_hashes) if term_hashes else np.empty(0, dtype=np.uint64)
+        ids = np.concatenate(doc_ids) if doc_ids else np.empty(0, dtype=np.uint32)
+        tf = np.concatenate(freqs) if freqs else np.empty(0, dtype=np.float32)
+        lens = np.concatenate(lengths) if lengths else np.empty(0, dtype=np.float32)
+
+        order = np.lexsort((ids, th))
+        th, ids, tf = th[order], ids[order], tf[order]
+        unique, starts, counts = np.unique(th, return_index=True, return_counts=True)
+
+        n = len(lens)
+        avg_len = float(lens.mean()) if n else 1.0
+        norms = k1 * (1 - b + b * lens / avg_len)
+        df = np.repeat(counts, counts).astype(np.float64)
+        idf = np.log1p((n - df + 0.5) / (df + 0.5))
+        impacts = (idf * (k1 + 1) * tf / (tf + norms[ids])).astype(np.float32)
+
+        return cls(
+            unique.astype(np.uint64),
+            np.append(starts, len(th)).astype(np.uint64),
+            ids,
+            impacts,
+            np.asarray(doc_categories, dtype=np.uint16),
+            list(category_index),
+        )
+
+    # ── 持久化 ──
+
+    def save(self, directory: Path) -> None:
+        directory.mkdir(parents=True, exist_ok=True)
+        for name in _ARRAYS:
+            np.save(directory / f"{name}.npy", getattr(self, f"_{name}"))
+        (directory / "categories.json").write_text(
+            json.dumps(self._category_names, ensure_ascii=False), encoding="utf-8"
+        )
+
+    @classmethod
+    def load(cls, directory: Path, mmap: bool = True) -> BM25Index:
+        """加载持久化的索引；mmap=True 时数组只映射不拷贝，多进程共享页缓存"""
+        mode = "r" if mmap else None
+        arrays = [np.load(directory / f"{name}.npy", mmap_mode=mode) for name in _ARRAYS]
+        categories = json.loads((directory / "categories.json").read_text(encoding="utf-8"))
+        return cls(*arrays, categories)
+
+    # ── 查询 ──
+
+    def categories(self) -> list[str]:
+        return list(self._category_names)
+
+    def _category_mask(self, index: int) -> np.ndarray:
+        mask = self._category_masks.get(index)
+        if mask is None:
+            mask = self._category_masks[index] = self._doc_categories == index
+        return mask
+
+    def category_mask(self, categories: Iterable[str] | None) -> np.ndarray | None:
+        """分类对应的文档布尔掩码；None 表示不过滤，未知分类得到全 False 掩码"""
+        if categories is None:
+            return None
+        wanted = [self._category_index[c] for c in categories if c in self._category_index]
+        if not wanted:
+            return np.zeros(self.doc_count, dtype=bool)
+        mask = self._category_mask(wanted[0])
+        for i in wanted[1:]:
+            mask = mask | self._category_mask(i)
+        return mask
+
+    def search(
+        self,
+        query: str,
+        k: int = 10,
+        categories: Iterable[str] | None = None,
+    ) -> tuple[list[SearchHit], int]:
+        """返回 (top-k 命中, 匹配到的文档总数)；categories 为 None 表示不过滤"""
+        allowed = self.category_mask(categories)
+        if allowed is not None and not allowed.any():
+            return [], 0
+
+        query_tf = Counter(tokenize(query))
+        if not query_tf or not len(self._term_hashes):
+            return [], 0
+        hashes = np.fromiter((term_hash(t) for t in query_tf), dtype=np.uint64, count=len(query_tf))
+        weights = np.fromiter(query_tf.values(), dtype=np.float32, count=len(query_tf))
+        positions = np.searchsorted(self._term_hashes, hashes)
+        positions[positions >= len(self._term_hashes)] = 0
+        found = self._term_hashes[positions] == hashes
+        if not found.any():
+            return [], 0
+        positions = positions[found]
+        spans = zip(
+            self._term_offsets[positions].tolist(),
+            self._term_offsets[positions + 1].tolist(),
+            weights[found].tolist(),
+        )
+
+        # 所有命中 posting 拼接后一次 bincount 累加
+        doc_parts, impact_parts = [], []
+        for start, end, qtf in spans:
+            doc_parts.append(self._doc_ids[start:end])
+            impacts = self._impacts[start:end]
+            impact_parts.append(impacts if qtf == 1 else impacts * qtf)
+        scores = np.bincount(
+            np.concatenate(doc_parts),
+            weights=np.concatenate(impact_parts),
+            minlength=self.doc_count,
+        )
+
+        if allowed is not None:
+            # 与分类文档集合求交
+            scores *= allowed
+        # 只在非零候选上做 argpartition（大量相等的 0 会让选择算法退化）
+        candidates = np.flatnonzero(scores)
+        total = len(candidates)
+        k = min(k, total)
+        if k <= 0:
+            return [], 0
+        top = candidates[np.argpartition(scores[candidates], total - k)[total - k:]]
+        top = top[np.argsort(scores[top])[::-1]]
+        return [SearchHit(int(d), float(scores[d])) for d in top], total
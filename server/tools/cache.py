@@ -0,0 +1,294 @@
+"""工具结果缓存 — 为 @tool 函数提供按参数缓存的装饰器
+
+- 参数归一化：按函数签名补齐默认值，字符串去首尾空白、折叠连续空白，
+  整数值的浮点数与整数视为同一参数；可为单个工具追加自定义归一化
+- 每个工具独立的 TTL 与条目上限（LRU 淘汰）
+- stale-while-revalidate：过期后的 stale_ttl 窗口内先返回旧值，后台刷新
+- 未命中与后台刷新经 single-flight 合并：相同工具 + 相同归一化参数的并发调用
+  只执行一次底层请求（缓存关闭时同样合并）
+- 同时支持同步工具与异步工具（如 ragflow_search）
+- 记录命中 / 未命中 / 旧值命中 / 刷新 / 合并次数：未命中只计真正执行工具的那次调用，
+  加入进行中执行的调用计为合并（coalesced）
+
+用法（装饰器放在 @tool 之下，保证工具名与参数 Schema 不变）::
+
+    @tool
+    @cached(ttl=settings.TOOL_CACHE_TTL_TRENDS)
+    def get_trending_topics(...): ...
+"""
+
+from __future__ import annotations
+
+import asyncio
+import copy
+import functools
+import inspect
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from config import settings
+from tools.singleflight import SingleFlight, ThreadSingleFlight
+
+logger = logging.getLogger("tool_cache")
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+FRESH = "fresh"
+STALE = "stale"
+
+
+# ── 参数归一化 ────────────────────────────────────────
+
+def normalize_value(value: Any) -> Any:
+    """参数值归一化，使等价调用得到相同的缓存键"""
+    if isinstance(value, str):
+        return _WHITESPACE_RE.sub(" ", value).strip()
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, dict):
+        return {str(k): normalize_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize_value(v) for v in value]
+    return value
+
+
+def normalize_query(params: dict[str, Any], field: str = "query") -> dict[str, Any]:
+    """检索类工具：问题文本去掉末尾标点，英文统一小写"""
+    query = params.get(field)
+    if isinstance(query, str):
+        params[field] = query.rstrip("?？!！。.~～ ").lower()
+    return params
+
+
+def _is_cacheable(value: Any) -> bool:
+    """默认不缓存错误结果"""
+    return not (isinstance(value, dict) and value.get("error"))
+
+
+# ── 缓存存储 ──────────────────────────────────────────
+
+@dataclass
+class _Entry:
+    value: Any
+    fresh_until: float
+    stale_until: float
+
+
+class ToolCache:
+    """单个工具的 LRU 缓存（线程安全：同步工具在线程池中执行）"""
+
+    def __init__(self, name: str, ttl: float, stale_ttl: float, maxsize: int):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = max(0.0, stale_ttl)
+        self.maxsize = max(1, maxsize)
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._refreshing: set[str] = set()
+        self._lock = threading.Lock()
+        self.flight = SingleFlight()
+        self.thread_flight = ThreadSingleFlight()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.refreshes = 0
+
+    def lookup(self, key: str) -> tuple[Any, str | None]:
+        """返回 (值, 状态)；状态为 FRESH / STALE，未命中为 None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.stale_until <= now:
+                if entry is not None:
+                    del self._entries[key]
+                return None, None
+            self._entries.move_to_end(key)
+            if entry.fresh_until > now:
+                self.hits += 1
+                return copy.deepcopy(entry.value), FRESH
+            self.stale_hits += 1
+            return copy.deepcopy(entry.value), STALE
+
+    def store(self, key: str, value: Any) -> None:
+        now = time.monotonic()
+        entry = _Entry(copy.deepcopy(value), now + self.ttl, now + self.ttl + self.stale_ttl)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def record_miss(self) -> None:
+        """未命中且由本次调用执行工具"""
+        with self._lock:
+            self.misses += 1
+
+    def record_coalesced(self) -> None:
+        """未命中但加入了相同参数进行中的执行"""
+        with self._lock:
+            self.coalesced += 1
+
+    def begin_refresh(self, key: str) -> bool:
+        """同一个键同时只允许一个后台刷新"""
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            self.refreshes += 1
+            return True
+
+    def end_refresh(self, key: str) -> None:
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            size = len(self._entries)
+        return {
+            "ttl": self.ttl,
+            "stale_ttl": self.stale_ttl,
+            "size": size,
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "refreshes": self.refreshes,
+            "executions": self.flight.executions + self.thread_flight.executions,
+            "shared": self.flight.shared + self.thread_flight.shared,
+        }
+
+
+_registry: dict[str, ToolCache] = {}
+_refresh_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="tool-cache-refresh")
+_refresh_tasks: set[asyncio.Task] = set()
+
+
+def get_cache(name: str) -> ToolCache | None:
+    return _registry.get(name)
+
+
+def stats() -> dict[str, dict[str, Any]]:
+    """所有已缓存工具的计数器"""
+    return {name: cache.stats() for name, cache in _registry.items()}
+
+
+def clear(name: str | None = None) -> None:
+    """清空指定工具（或全部工具）的缓存"""
+    if name is None:
+        for cache in _registry.values():
+            cache.clear()
+    elif name in _registry:
+        _registry[name].clear()
+
+
+# ── 装饰器 ────────────────────────────────────────────
+
+def cached(
+    ttl: float,
+    *,
+    stale_ttl: float | None = None,
+    maxsize: int | None = None,
+    normalize: Callable[[dict[str, Any]], dict[str, Any]] | None = None,
+    cacheable: Callable[[Any], bool] = _is_cacheable,
+) -> Callable:
+    """按归一化后的参数缓存工具结果。ttl <= 0 或 TOOL_CACHE_ENABLED 关闭时只做请求合并。"""
+    stale_ttl = settings.TOOL_CACHE_STALE_TTL if stale_ttl is None else stale_ttl
+    maxsize = settings.TOOL_CACHE_MAX_ENTRIES if maxsize is None else maxsize
+
+    def decorator(func: Callable) -> Callable:
+        signature = inspect.signature(func)
+        cache = ToolCache(func.__name__, ttl, stale_ttl, maxsize)
+        _registry[func.__name__] = cache
+        enabled = settings.TOOL_CACHE_ENABLED and ttl > 0
+
+        def make_key(args: tuple, kwargs: dict) -> str:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            params = {k: normalize_value(v) for k, v in bound.arguments.items()}
+            if normalize is not None:
+                params = normalize(params)
+            return json.dumps(params, ensure_ascii=False, sort_keys=True, default=str)
+
+        if inspect.iscoroutinefunction(func):
+            async def load_async(key: str, args: tuple, kwargs: dict, miss: bool = False) -> Any:
+                if miss:
+                    cache.record_miss()
+                value = await func(*args, **kwargs)
+                if enabled and cacheable(value):
+                    cache.store(key, value)
+                return value
+
+            async def refresh_async(key: str, args: tuple, kwargs: dict) -> None:
+                try:
+                    await cache.flight.do(key, lambda: load_async(key, args, kwargs))
+                except Exception as e:
+                    logger.warning(f"[ToolCache] {cache.name} 后台刷新失败: {e}")
+                finally:
+                    cache.end_refresh(key)
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                key = make_key(args, kwargs)
+                if enabled:
+                    value, state = cache.lookup(key)
+                    if state == STALE and cache.begin_refresh(key):
+                        task = asyncio.create_task(refresh_async(key, args, kwargs))
+                        _refresh_tasks.add(task)
+                        task.add_done_callback(_refresh_tasks.discard)
+                    if state is not None:
+                        return value
+                value = await cache.flight.do(
+                    key, lambda: load_async(key, args, kwargs, miss=True), on_join=cache.record_coalesced,
+                )
+                # 合并调用的各方拿到独立副本
+                return copy.deepcopy(value)
+
+            async_wrapper.cache = cache
+            return async_wrapper
+
+        def load_sync(key: str, args: tuple, kwargs: dict, miss: bool = False) -> Any:
+            if miss:
+                cache.record_miss()
+            value = func(*args, **kwargs)
+            if enabled and cacheable(value):
+                cache.store(key, value)
+            return value
+
+        def refresh_sync(key: str, args: tuple, kwargs: dict) -> None:
+            try:
+                cache.thread_flight.do(key, lambda: load_sync(key, args, kwargs))
+            except Exception as e:
+                logger.warning(f"[ToolCache] {cache.name} 后台刷新失败: {e}")
+            finally:
+                cache.end_refresh(key)
+
+        @functools.wraps(func)
+        def sync_wrapper(*args, **kwargs):
+            key = make_key(args, kwargs)
+            if enabled:
+                value, state = cache.lookup(key)
+                if state == STALE and cache.begin_refresh(key):
+                    _refresh_pool.submit(refresh_sync, key, args, kwargs)
+                if state is not None:
+                    return value
+            value = cache.thread_flight.do(
+                key, lambda: load_sync(key, args, kwargs, miss=True), on_join=cache.record_coalesced,
+            )
+            return copy.deepcopy(value)
+
+        sync_wrapper.cache = cache
+        return sync_wrapper
+
+    return decorator
@@ -0,0 +1,165 @@
+"""本地稠密检索 — 特征哈希向量 + NumPy 批量相似度，不依赖网络与模型文件
+
+- 特征：中日韩单字、字 bigram、英文 / 数字词，以及「概念」特征
+  （同义词表把「钱 / 收益 / 提现 / 到账」等映射到同一概念，用于召回换一种说法的问题）
+- 有符号特征哈希到固定维度（KNOWLEDGE_DENSE_DIM），出现次数做次线性缩放后按特征类型加权
+- 每个文档的原始向量与语料无关，可按来源缓存；合并时按维度统计 df 计算 idf，
+  加权后逐行 L2 归一化，存成一块连续的 float32 矩阵
+- 查询：矩阵乘法得到余弦相似度，argpartition 取 top-k；search_batch 一次乘法处理多条查询
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Iterable, Sequence
+
+import numpy as np
+
+from keyword_matcher import KeywordMatcher
+from tools.bm25 import SearchHit
+
+_TOKEN_RE = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯]+|[a-z0-9]+")
+_CJK_RE = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯]")
+
+_UNIGRAM_WEIGHT = 0.5
+_CONCEPT_WEIGHT = 3.0
+
+
+def _feature_hash(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class HashingEmbedder:
+    """把文本映射为固定维度的稀疏特征向量（未加权、未归一化）"""
+
+    def __init__(self, dim: int, concepts: dict[str, Sequence[str]] | None = None):
+        self.dim = dim
+        # 同义词 -> 概念名，一次扫描找出全部命中
+        concept_terms = sorted((term.lower(), name) for name, terms in (concepts or {}).items() for term in terms)
+        self._concepts = KeywordMatcher(concept_terms)
+        self._slots: dict[str, tuple[int, float]] = {}
+        payload = json.dumps([dim, _UNIGRAM_WEIGHT, _CONCEPT_WEIGHT, concept_terms], ensure_ascii=False)
+        self.signature = hashlib.sha256(payload.encode("utf-8")).hexdigest()[:12]
+
+    def _features(self, text: str) -> dict[str, float]:
+        """特征 -> 权重；出现次数做次线性缩放后再乘以特征类型的权重"""
+        text = text.lower()
+        counts: Counter = Counter()
+        for run in _TOKEN_RE.findall(text):
+            if not _CJK_RE.match(run):
+                counts[run] += 1
+                continue
+            counts.update(run)
+            counts.update(run[i:i + 2] for i in range(len(run) - 1))
+        for match in self._concepts.iter_matches(text):
+            counts[f"#{match.label}"] += 1
+        features: dict[str, float] = {}
+        for feature, count in counts.items():
+            if feature[0] == "#":
+                weight = _CONCEPT_WEIGHT
+            elif len(feature) == 1 and _CJK_RE.match(feature):
+                weight = _UNIGRAM_WEIGHT
+            else:
+                weight = 1.0
+            features[feature] = weight * (1.0 + math.log(count))
+        return features
+
+    def _slot(self, feature: str) -> tuple[int, float]:
+        slot = self._slots.get(feature)
+        if slot is None:
+            h = _feature_hash(feature)
+            slot = self._slots[feature] = (h % self.dim, 1.0 if (h >> 63) & 1 else -1.0)
+        return slot
+
+    def embed_into(self, text: str, out: np.ndarray) -> None:
+        for feature, weight in self._features(text).items():
+            index, sign = self._slot(feature)
+            out[index] += sign * weight
+
+    def embed_many(self, texts: Iterable[str]) -> np.ndarray:
+        texts = list(texts)
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in zip(matrix, texts):
+            self.embed_into(text, row)
+        return matrix
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class DenseIndex:
+    """只读稠密索引：行归一化的 float32 文档矩阵 + 每维 idf"""
+
+    def __init__(self, embedder: HashingEmbedder, matrix: np.ndarray, idf: np.ndarray):
+        self.embedder = embedder
+        self._matrix = matrix       # (文档数, dim) float32，C 连续
+        self._idf = idf             # (dim,) float32
+        self.doc_count = matrix.shape[0]
+
+    @classmethod
+    def from_raw(cls, embedder: HashingEmbedder, raw_parts: Sequence[np.ndarray]) -> DenseIndex:
+        """合并各来源的原始向量，按维度 df 计算 idf 后加权并归一化"""
+        raw = (
+            np.concatenate(raw_parts).astype(np.float32, copy=False)
+            if raw_parts else np.zeros((0, embedder.dim), dtype=np.float32)
+        )
+        n = raw.shape[0]
+        df = np.count_nonzero(raw, axis=0).astype(np.float32)
+        idf = np.log1p((n + 1) / (df + 1)).astype(np.float32)
+        matrix = np.ascontiguousarray(_normalize_rows(raw * idf), dtype=np.float32)
+        return cls(embedder, matrix, idf)
+
+    def save(self, directory: Path) -> None:
+        np.save(directory / "embeddings.npy", self._matrix)
+        np.save(directory / "embedding_idf.npy", self._idf)
+
+    @classmethod
+    def load(cls, embedder: HashingEmbedder, directory: Path, mmap: bool = True) -> DenseIndex:
+        mode = "r" if mmap else None
+        return cls(
+            embedder,
+            np.load(directory / "embeddings.npy", mmap_mode=mode),
+            np.load(directory / "embedding_idf.npy"),
+        )
+
+    def _embed_queries(self, queries: Sequence[str]) -> np.ndarray:
+        return _normalize_rows(self.embedder.embed_many(queries) * self._idf)
+
+    def search(
+        self,
+        query: str,
+        k: int = 10,
+        mask: np.ndarray | None = None,
+    ) -> list[SearchHit]:
+        return self.search_batch([query], k, mask)[0]
+
+    def search_batch(
+        self,
+        queries: Sequence[str],
+        k: int = 10,
+        mask: np.ndarray | None = None,
+    ) -> list[list[SearchHit]]:
+        """一次矩阵乘法为多条查询打分；mask 为可选的文档布尔掩码（如分类过滤）"""
+        if not queries:
+            return []
+        # k 不超过文档数；k <= 0（或空语料）时 argpartition 的 kth 越界，直接返回空结果
+        k = min(k, self.doc_count)
+        if k <= 0:
+            return [[] for _ in queries]
+        scores = self._embed_queries(queries) @ self._matrix.T     # (查询数, 文档数)
+        if mask is not None:
+            scores[:, ~mask] = -np.inf
+        top = np.argpartition(scores, self.doc_count - k, axis=1)[:, self.doc_count - k:]
+        results = []
+        for row, ids in zip(scores, top):
+            ids = ids[np.argsort(row[ids])[::-1]]
+            results.append([SearchHit(int(d), float(row[d])) for d in ids if row[d] > 0])
+        return results
@@ -9,6 +9,9 @@ import random
 from datetime import datetime, timedelta
 from langchain_core.tools import tool
 
+from config import settings
+from tools.cache import cached
+
 # ── Mock 数据 ─────────────────────────────────────────
 
 _PLATFORMS = ["抖音", "快手", "B站", "微博", "小红书"]
@@ -87,6 +90,7 @@ _SONG_NAME_IDEAS = [
 # ── Tools ─────────────────────────────────────────────
 
 @tool
+@cached(ttl=settings.TOOL_CACHE_TTL_TRENDS)
 def get_trending_topics(platform: str = "all", category: str = "all", limit: int = 5) -> dict:
     """获取当前热门话题和趋势。
 
@@ -1,16 +1,25 @@
 """问答指南 & 客服服务 — RAG 知识检索、上传预检
 
-MVP 使用 FAISS 内存向量库 + Markdown 知识文档。
+本地检索使用字符 n-gram 倒排索引 + BM25（tools/bm25.py）与特征哈希稠密向量
+（tools/dense.py，默认两者混合打分），内置 FAQ 与 KNOWLEDGE_BASE_DIR 下的文档
+持久化为 mmap 索引（tools/knowledge_index.py）。
 """
 
 from __future__ import annotations
 
+import asyncio
+import logging
 import os
 from pathlib import Path
-import httpx
 
 from langchain_core.tools import tool
 from config import settings
+from intent import detect_intent
+from tools.cache import cached, normalize_query
+from tools.knowledge_index import KnowledgeEntry, KnowledgeIndexManager
+from tools.ragflow_client import CircuitOpenError, RagflowError, ragflow_client
+
+logger = logging.getLogger("knowledge")
 
 # ── 知识库数据 (内联 Mock，替代 FAISS 向量检索) ──────────
 
@@ -143,6 +152,30 @@ _KNOWLEDGE_BASE: dict[str, list[dict]] = {
 }
 
 
+# 内置 FAQ 与 KNOWLEDGE_BASE_DIR 下的文档一起建索引，持久化后以 mmap 加载
+# 稠密检索的概念词表：同一概念的不同说法映射到同一特征，召回换个说法的问题
+_CONCEPTS: dict[str, list[str]] = {
+    "结算": ["结算", "钱", "收入", "收益", "提现", "到账", "分成", "打款", "账单"],
+    "审核": ["审核", "驳回", "过审", "被拒", "不通过", "多久"],
+    "版权": ["版权", "侵权", "抄袭", "盗用", "维权", "搬运", "翻唱"],
+    "入驻": ["入驻", "认证", "注册", "申请", "开通"],
+    "上传": ["上传", "发布", "发歌", "音频", "封面", "格式"],
+    "活动": ["活动", "扶持", "推广", "计划", "报名"],
+}
+
+kb_index = KnowledgeIndexManager(
+    builtin=[
+        KnowledgeEntry(category=cat, question=item["q"], answer=item["a"], source=item["source"])
+        for cat, items in _KNOWLEDGE_BASE.items()
+        for item in items
+    ],
+    concepts=_CONCEPTS,
+)
+
+# 得分不低于最高分该比例的结果标为 high
+_HIGH_RELEVANCE_RATIO = 0.6
+
+
 @tool
 def search_knowledge(query: str, category: str = "all") -> dict:
     """在知识库中搜索音乐人相关规则和指南。涵盖入驻、上传、审核、结算、版权、活动等常见问题。
@@ -151,32 +184,23 @@ def search_knowledge(query: str, category: str = "all") -> dict:
         query: 用户的问题
         category: 分类筛选，可选 '入驻' / '上传' / '审核' / '结算' / '版权' / '活动' / 'all'
     """
-    results = []
-
-    if category != "all" and category in _KNOWLEDGE_BASE:
-        search_items = [(category, items) for items in [_KNOWLEDGE_BASE[category]]]
-    else:
-        search_items = list(_KNOWLEDGE_BASE.items())
-
-    query_lower = query.lower()
+    index = kb_index.get()
+    categories = [category] if category != "all" and category in index.categories() else None
+    hits, total_found = index.search(query, k=3, categories=categories)
 
-    for cat, items in search_items:
-        for item in items:
-            # 简单关键词匹配 (MVP 阶段，后续替换为向量检索)
-            q_text = item["q"].lower()
-            a_text = item["a"].lower()
-            if any(kw in q_text or kw in a_text for kw in _extract_keywords(query_lower)):
-                results.append({
-                    "category": cat,
-                    "question": item["q"],
-                    "answer": item["a"],
-                    "source": item["source"],
-                    "relevance": "high",
-                })
-
-    # 如果没有精确匹配，返回最相关的分类
+    results = []
+    for entry, score in hits:
+        results.append({
+            "category": entry.category,
+            "question": entry.question,
+            "answer": entry.answer,
+            "source": entry.source,
+            "relevance": "high" if score >= hits[0][1] * _HIGH_RELEVANCE_RATIO else "medium",
+        })
+
+    # 如果没有匹配，返回指定分类或最相关分类的条目
     if not results:
-        best_cat = _guess_category(query_lower)
+        best_cat = categories[0] if categories else _guess_category(query.lower())
         if best_cat and best_cat in _KNOWLEDGE_BASE:
             for item in _KNOWLEDGE_BASE[best_cat][:2]:
                 results.append({
@@ -186,11 +210,12 @@ def search_knowledge(query: str, category: str = "all") -> dict:
                     "source": item["source"],
                     "relevance": "medium",
                 })
+            total_found = len(results)
 
     return {
         "query": query,
-        "results": results[:3],
-        "total_found": len(results),
+        "results": results,
+        "total_found": total_found,
         "note": "以上信息来自平台规则文档，如需人工客服请点击「联系客服」",
     }
 
@@ -264,41 +289,29 @@ def check_upload_compliance(
     }
 
 
-def _extract_keywords(text: str) -> list[str]:
-    """简单关键词提取"""
-    keywords = []
-    kw_map = {
-        "入驻": ["入驻", "注册", "申请", "开通", "成为", "加入"],
-        "上传": ["上传", "格式", "音频", "封面", "歌词", "提交"],
-        "审核": ["审核", "驳回", "通过", "多久", "时间"],
-        "结算": ["结算", "收入", "提现", "分成", "账单", "钱", "收益"],
-        "版权": ["版权", "侵权", "维权", "保护", "抄袭"],
-        "活动": ["活动", "比赛", "扶持", "补贴", "奖励"],
-    }
-    for cat, kws in kw_map.items():
-        for kw in kws:
-            if kw in text:
-                keywords.append(kw)
-    return keywords or [text[:4]]  # 回退到取前4个字
-
-
 def _guess_category(text: str) -> str | None:
     """猜测问题所属分类"""
-    cat_keywords = {
-        "入驻": ["入驻", "注册", "加入", "开通", "条件"],
-        "上传": ["上传", "格式", "文件", "提交", "发布"],
-        "审核": ["审核", "驳回", "等", "多久"],
-        "结算": ["结算", "钱", "收入", "提现"],
-        "版权": ["版权", "侵权", "维权"],
-        "活动": ["活动", "比赛", "奖"],
-    }
-    for cat, kws in cat_keywords.items():
-        if any(kw in text for kw in kws):
-            return cat
-    return "入驻"
+    return detect_intent(text).category or "入驻"
+
+
+def _is_ragflow_cacheable(value: dict) -> bool:
+    # 降级到本地检索的结果不缓存，RAGFlow 恢复后立即生效
+    return not value.get("error") and "fallback" not in value
+
+
+def _local_search(query: str) -> dict:
+    return search_knowledge.invoke({"query": query, "category": "all"})
+
+
+_FALLBACK_NOTES = {
+    "timeout": "⚠️ RAGFlow 响应超时，已回退到本地基础 FAQ 检索。",
+    "circuit_open": "⚠️ RAGFlow 暂时不可用，已回退到本地基础 FAQ 检索。",
+    "error": "⚠️ 调用 RAGFlow 失败，已回退到本地基础 FAQ 检索。",
+}
 
 
 @tool
+@cached(ttl=settings.TOOL_CACHE_TTL_RAGFLOW, normalize=normalize_query, cacheable=_is_ragflow_cacheable)
 async def ragflow_search(query: str, top_k: int = 5) -> dict:
     """使用 RAGFlow 检索官方客服及操作指南文档。
     如果配置了 RAGFLOW_API_KEY，将调用真实的 RAGFlow 服务。
@@ -310,61 +323,60 @@ async def ragflow_search(query: str, top_k: int = 5) -> dict:
     """
     if not settings.RAGFLOW_API_KEY:
         # 如果没有配置 API Key，回退到本地检索
-        fallback_result = search_knowledge.invoke({"query": query, "category": "all"})
+        fallback_result = _local_search(query)
         fallback_result["note"] = "⚠️ 当前未配置 RAGFlow API Key，已回退到本地基础 FAQ 检索。"
         return fallback_result
 
-    url = f"{settings.RAGFLOW_BASE_URL.rstrip('/')}/api/v1/retrieval"
-    headers = {
-        "Authorization": f"Bearer {settings.RAGFLOW_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "question": query,
-        "dataset_ids": settings.RAGFLOW_KB_ID,
-        "top_k": top_k
-    }
-
+    # RAGFlow 超过 RAGFLOW_HEDGE_DELAY 未返回时提前启动本地检索（对冲），
+    # RAGFlow 在截止时间内失败或超时则直接使用本地结果
+    remote = asyncio.create_task(ragflow_client.retrieve(query, top_k))
+    local: asyncio.Future | None = None
     try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(url, headers=headers, json=payload, timeout=10.0)
-            resp.raise_for_status()
-            data = resp.json()
-            
-            if data.get("code") == 0:
-                chunks = data.get("data", {}).get("chunks", [])
-                results = []
-                for chunk in chunks:
-                    results.append({
-                        "category": "RAGFlow",
-                        "question": "匹配到的相关文档片段",
-                        "answer": chunk.get("content", ""),
-                        "source": chunk.get("document_name", "未知来源"),
-                        "relevance": "high",
-                    })
-                
-                # 若 RAG 没搜到，可用兜底
-                if not results:
-                    return {
-                        "query": query,
-                        "results": [],
-                        "total_found": 0,
-                        "note": "RAGFlow 知识库中未找到相关内容，请尝试换个关键词或联系人工客服。"
-                    }
-
-                return {
-                    "query": query,
-                    "results": results[:top_k],
-                    "total_found": len(results),
-                    "note": "以上信息来自官方文档库，仅供参考。"
-                }
-            else:
-                raise ValueError(f"RAGFlow API Error: {data.get('message', 'Unknown error')}")
-
-    except Exception as e:
+        done, _ = await asyncio.wait({remote}, timeout=settings.RAGFLOW_HEDGE_DELAY)
+        if not done:
+            local = asyncio.ensure_future(asyncio.to_thread(_local_search, query))
+        chunks = await remote
+    except (RagflowError, TimeoutError) as e:
+        reason = (
+            "circuit_open" if isinstance(e, CircuitOpenError)
+            else "timeout" if isinstance(e, TimeoutError)
+            else "error"
+        )
+        logger.warning(f"[RAGFlow] 检索失败（{reason}），使用本地检索: {e or type(e).__name__}")
+        if local is not None:
+            ragflow_client.stats.observe("hedge_win")
+        result = await (local or asyncio.to_thread(_local_search, query))
+        result["fallback"] = reason
+        result["note"] = _FALLBACK_NOTES[reason]
+        return result
+    finally:
+        remote.cancel()
+        if local is not None and not local.done():
+            local.cancel()
+
+    results = [
+        {
+            "category": "RAGFlow",
+            "question": "匹配到的相关文档片段",
+            "answer": chunk.get("content", ""),
+            "source": chunk.get("document_name", "未知来源"),
+            "relevance": "high",
+        }
+        for chunk in chunks
+    ]
+
+    # 若 RAG 没搜到，可用兜底
+    if not results:
         return {
             "query": query,
             "results": [],
-            "error": str(e),
-            "note": "调用 RAGFlow 时发生错误，请稍后再试或联系管理员。"
+            "total_found": 0,
+            "note": "RAGFlow 知识库中未找到相关内容，请尝试换个关键词或联系人工客服。"
         }
+
+    return {
+        "query": query,
+        "results": results[:top_k],
+        "total_found": len(results),
+        "note": "以上信息来自官方文档库，仅供参考。"
+    }
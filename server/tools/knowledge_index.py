@@ -0,0 +1,505 @@
+"""知识库持久化索引 — 内置 FAQ + KNOWLEDGE_BASE_DIR 下的 Markdown 文档
+
+磁盘布局（KNOWLEDGE_INDEX_DIR）::
+
+    CURRENT                 当前代的目录名（原子替换）
+    segments/<sha256>.npz   单个来源（文件 / 内置 FAQ）的词频段，按内容哈希命名
+    segments/<sha256>.json  该来源解析出的条目
+    segments/<sha256>.<sig>.emb.npy  该来源的原始特征哈希向量（sig 为向量化配置签名）
+    gen-<id>/               一代完整索引：BM25 数组、稠密向量矩阵（.npy）、文档库、manifest.json
+
+- 启动时只 stat 文件，与 manifest 记录的 (mtime, size) 一致即直接 mmap 加载，
+  冷启动只需毫秒级；多个 uvicorn worker 共享同一份页缓存
+- 文件变化时只重新解析内容哈希变化的来源，其余 Segment 从磁盘复用，
+  合并与 BM25 计算全部向量化
+- 构建过程持有文件锁（POSIX 用 fcntl.flock，Windows 用 msvcrt.locking），
+  新一代写完后再替换 CURRENT，读者不会看到半成品
+- 索引目录不可写时退化为进程内构建
+- 检索后端（KNOWLEDGE_SEARCH_BACKEND）：bm25 关键词、dense 稠密向量、
+  hybrid 两者得分按各自最高分归一化后等权相加
+
+Markdown 文档格式：可选 YAML Frontmatter（category / source），每个二级标题
+（## ）是一个问题，其后直到下一个标题的正文是答案。未指定 category 时使用
+所在子目录名，位于根目录时使用文件名。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import heapq
+import json
+import logging
+import mmap
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+import yaml
+
+from config import settings
+from tools.bm25 import BM25Index, Document, SearchHit, Segment
+from tools.dense import DenseIndex, HashingEmbedder
+
+try:
+    import fcntl
+    msvcrt = None
+except ImportError:  # pragma: no cover - Windows 没有 fcntl
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger("knowledge_index")
+
+INDEX_FORMAT_VERSION = 1
+BUILTIN_SOURCE = "<builtin>"
+
+
+@dataclass(frozen=True)
+class KnowledgeEntry:
+    category: str
+    question: str
+    answer: str
+    source: str
+
+
+# ── Markdown 解析 ─────────────────────────────────────
+
+def parse_markdown(content: str, default_category: str, default_source: str) -> list[KnowledgeEntry]:
+    metadata: dict = {}
+    body = content
+    if content.startswith("---"):
+        parts = content.split("---", 2)
+        if len(parts) == 3:
+            try:
+                loaded = yaml.safe_load(parts[1])
+            except yaml.YAMLError:
+                loaded = None
+            if isinstance(loaded, dict):
+                metadata = loaded
+                body = parts[2]
+
+    category = str(metadata.get("category") or default_category)
+    source = str(metadata.get("source") or default_source)
+    entries: list[KnowledgeEntry] = []
+    question: str | None = None
+    lines: list[str] = []
+
+    def flush() -> None:
+        answer = "\n".join(lines).strip()
+        if question and answer:
+            entries.append(KnowledgeEntry(category, question, answer, source))
+
+    for line in body.splitlines():
+        if line.startswith("## "):
+            flush()
+            question, lines = line[3:].strip(), []
+        elif question is not None:
+            lines.append(line)
+    flush()
+    return entries
+
+
+def _to_documents(entries: list[KnowledgeEntry]) -> Iterator[Document]:
+    for e in entries:
+        yield Document(text=e.answer, category=e.category, title=e.question)
+
+
+def _embedding_texts(entries: list[KnowledgeEntry]) -> Iterator[str]:
+    # 问题重复一次以提高权重
+    for e in entries:
+        yield f"{e.question}\n{e.question}\n{e.answer}"
+
+
+# ── 文档库 ────────────────────────────────────────────
+
+class DocStore:
+    """按文档编号读取条目；磁盘上为 JSON Lines + 偏移数组，通过 mmap 按需解码"""
+
+    def __init__(self, blob: bytes | mmap.mmap, offsets: np.ndarray):
+        self._blob = blob
+        self._offsets = offsets
+
+    @classmethod
+    def write(cls, directory: Path, entries: list[KnowledgeEntry]) -> None:
+        offsets = [0]
+        with open(directory / "docs.jsonl", "wb") as f:
+            for e in entries:
+                line = json.dumps(asdict(e), ensure_ascii=False).encode("utf-8") + b"\n"
+                f.write(line)
+                offsets.append(offsets[-1] + len(line))
+        np.save(directory / "doc_offsets.npy", np.asarray(offsets, dtype=np.uint64))
+
+    @classmethod
+    def open(cls, directory: Path) -> DocStore:
+        offsets = np.load(directory / "doc_offsets.npy", mmap_mode="r")
+        with open(directory / "docs.jsonl", "rb") as f:
+            # 空文件无法 mmap
+            blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if offsets[-1] else b""
+        return cls(blob, offsets)
+
+    @classmethod
+    def in_memory(cls, entries: list[KnowledgeEntry]) -> DocStore:
+        lines = [json.dumps(asdict(e), ensure_ascii=False).encode("utf-8") + b"\n" for e in entries]
+        offsets = np.cumsum([0] + [len(line) for line in lines], dtype=np.uint64)
+        return cls(b"".join(lines), offsets)
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, doc_id: int) -> KnowledgeEntry:
+        start, end = int(self._offsets[doc_id]), int(self._offsets[doc_id + 1])
+        return KnowledgeEntry(**json.loads(self._blob[start:end]))
+
+
+# ── 索引 ──────────────────────────────────────────────
+
+@dataclass
+class KnowledgeIndex:
+    bm25: BM25Index
+    dense: DenseIndex
+    docs: DocStore
+    generation: str
+
+    def search(
+        self,
+        query: str,
+        k: int = 3,
+        categories: list[str] | None = None,
+        backend: str | None = None,
+    ) -> tuple[list[tuple[KnowledgeEntry, float]], int]:
+        """返回 ([(条目, 得分)], 匹配总数)"""
+        backend = backend or settings.KNOWLEDGE_SEARCH_BACKEND
+        if backend == "bm25":
+            hits, total = self.bm25.search(query, k=k, categories=categories)
+        elif backend == "dense":
+            hits = self._dense_hits([query], k, categories)[0]
+            total = len(hits)
+        else:
+            hits, total = self._hybrid(query, k, categories)
+        return [(self.docs[h.doc_id], h.score) for h in hits], total
+
+    def search_batch(
+        self,
+        queries: list[str],
+        k: int = 3,
+        categories: list[str] | None = None,
+    ) -> list[list[tuple[KnowledgeEntry, float]]]:
+        """稠密检索的批量接口：多条查询一次矩阵乘法打分"""
+        return [
+            [(self.docs[h.doc_id], h.score) for h in hits]
+            for hits in self._dense_hits(queries, k, categories)
+        ]
+
+    def _dense_hits(self, queries: list[str], k: int, categories: list[str] | None) -> list[list[SearchHit]]:
+        mask = self.bm25.category_mask(categories)
+        floor = settings.KNOWLEDGE_DENSE_MIN_SCORE
+        return [
+            [h for h in hits if h.score >= floor]
+            for hits in self.dense.search_batch(queries, k, mask)
+        ]
+
+    def _hybrid(self, query: str, k: int, categories: list[str] | None) -> tuple[list[SearchHit], int]:
+        depth = k * 4
+        lexical, total = self.bm25.search(query, k=depth, categories=categories)
+        semantic = self._dense_hits([query], depth, categories)[0]
+        fused: dict[int, float] = {}
+        for hits in (lexical, semantic):
+            if not hits:
+                continue
+            top = hits[0].score
+            for h in hits:
+                fused[h.doc_id] = fused.get(h.doc_id, 0.0) + 0.5 * h.score / top
+        ranked = heapq.nlargest(k, fused.items(), key=lambda item: item[1])
+        return [SearchHit(doc_id, score) for doc_id, score in ranked], max(total, len(fused))
+
+    def categories(self) -> list[str]:
+        return self.bm25.categories()
+
+
+@dataclass
+class _Source:
+    name: str               # 相对路径，内置 FAQ 为 BUILTIN_SOURCE
+    mtime_ns: int
+    size: int
+    sha256: str = ""
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _lock_file(f) -> None:
+    """阻塞直到获得文件的独占锁"""
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        return
+    # msvcrt 锁定的是当前位置起的字节区间，统一锁第 0 个字节；
+    # LK_LOCK 重试约 10 秒仍失败时抛出 OSError，继续等待
+    f.seek(0)
+    while True:
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            continue
+
+
+def _unlock_file(f) -> None:
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_UN)
+        return
+    f.seek(0)
+    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class KnowledgeIndexManager:
+    """维护当前知识库索引，按 reload_interval 节流检查源文件变化"""
+
+    def __init__(
+        self,
+        builtin: list[KnowledgeEntry],
+        concepts: dict[str, list[str]] | None = None,
+        source_dir: Path | str | None = None,
+        index_dir: Path | str | None = None,
+        reload_interval: float | None = None,
+    ):
+        self._builtin = builtin
+        self._builtin_bytes = json.dumps([asdict(e) for e in builtin], ensure_ascii=False).encode("utf-8")
+        self._builtin_hash = _sha256(self._builtin_bytes)
+        self._embedder = HashingEmbedder(settings.KNOWLEDGE_DENSE_DIM, concepts)
+        self._source_dir = Path(source_dir or settings.KNOWLEDGE_BASE_DIR)
+        self._index_dir = Path(index_dir or settings.KNOWLEDGE_INDEX_DIR)
+        self._reload_interval = (
+            settings.KNOWLEDGE_RELOAD_INTERVAL if reload_interval is None else reload_interval
+        )
+        self._lock = threading.Lock()
+        self._index: KnowledgeIndex | None = None
+        self._manifest: dict[str, dict] = {}
+        self._checked_at = 0.0
+
+    # ── 对外接口 ──
+
+    def get(self) -> KnowledgeIndex:
+        """返回当前索引；节流检查源文件，变化时增量重建（重建期间其它线程继续用旧索引）"""
+        index = self._index
+        now = time.monotonic()
+        if index is not None and (
+            self._reload_interval < 0 or now - self._checked_at < self._reload_interval
+        ):
+            return index
+        if index is not None and not self._lock.acquire(blocking=False):
+            return index
+        if index is None:
+            self._lock.acquire()
+        try:
+            if self._index is None or now - self._checked_at >= self._reload_interval:
+                self._checked_at = now
+                self._refresh()
+            return self._index
+        finally:
+            self._lock.release()
+
+    def reload(self) -> KnowledgeIndex:
+        with self._lock:
+            self._checked_at = time.monotonic()
+            self._refresh()
+            return self._index
+
+    # ── 内部 ──
+
+    def _scan(self) -> list[_Source]:
+        sources = [_Source(BUILTIN_SOURCE, 0, len(self._builtin_bytes), self._builtin_hash)]
+        if not self._source_dir.is_dir():
+            return sources
+        for path in sorted(self._source_dir.rglob("*.md")):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            sources.append(_Source(path.relative_to(self._source_dir).as_posix(), st.st_mtime_ns, st.st_size))
+        return sources
+
+    def _hash_sources(self, sources: list[_Source]) -> None:
+        """stat 与 manifest 一致的文件沿用记录的哈希，否则读取内容重新计算"""
+        for src in sources:
+            if src.sha256:
+                continue
+            known = self._manifest.get(src.name)
+            if known and known["mtime_ns"] == src.mtime_ns and known["size"] == src.size:
+                src.sha256 = known["sha256"]
+            else:
+                src.sha256 = _sha256((self._source_dir / src.name).read_bytes())
+
+    def _generation_id(self, sources: list[_Source]) -> str:
+        key = json.dumps(
+            [INDEX_FORMAT_VERSION, self._embedder.signature] + [(s.name, s.sha256) for s in sources]
+        )
+        return _sha256(key.encode("utf-8"))[:16]
+
+    def _refresh(self) -> None:
+        sources = self._scan()
+        if self._index is None:
+            self._manifest = self._read_manifest(self._current_generation())
+        try:
+            self._hash_sources(sources)
+        except OSError as e:
+            logger.warning(f"[Knowledge] 读取知识库文件失败: {e}")
+            if self._index is not None:
+                return
+            sources = sources[:1]
+        self._manifest = {s.name: asdict(s) for s in sources}
+        generation = self._generation_id(sources)
+        if self._index is not None and self._index.generation == generation:
+            return
+
+        try:
+            index = self._load_or_build(generation, sources)
+        except OSError as e:
+            logger.warning(f"[Knowledge] 索引目录不可用，改为进程内构建: {e}")
+            index = self._build_in_memory(generation, sources)
+        self._index = index
+        logger.info(
+            f"[Knowledge] 知识库索引已就绪: {index.bm25.doc_count} 条, "
+            f"{len(sources)} 个来源 (gen={generation})"
+        )
+
+    def _current_generation(self) -> str | None:
+        try:
+            return (self._index_dir / "CURRENT").read_text(encoding="utf-8").strip() or None
+        except OSError:
+            return None
+
+    def _read_manifest(self, generation: str | None) -> dict[str, dict]:
+        if not generation:
+            return {}
+        try:
+            data = json.loads((self._index_dir / generation / "manifest.json").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+        return {s["name"]: s for s in data.get("sources", [])}
+
+    def _open(self, generation: str) -> KnowledgeIndex:
+        directory = self._index_dir / f"gen-{generation}"
+        return KnowledgeIndex(
+            BM25Index.load(directory),
+            DenseIndex.load(self._embedder, directory),
+            DocStore.open(directory),
+            generation,
+        )
+
+    @contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        with open(self._index_dir / ".lock", "a+") as f:
+            _lock_file(f)
+            try:
+                yield
+            finally:
+                _unlock_file(f)
+
+    def _load_or_build(self, generation: str, sources: list[_Source]) -> KnowledgeIndex:
+        if self._current_generation() == f"gen-{generation}":
+            return self._open(generation)
+
+        self._index_dir.mkdir(parents=True, exist_ok=True)
+        with self._file_lock():
+            # 其它 worker 可能已在等待锁期间建好
+            if self._current_generation() != f"gen-{generation}":
+                self._build(generation, sources)
+        return self._open(generation)
+
+    def _load_source(self, src: _Source) -> tuple[Segment, np.ndarray, list[KnowledgeEntry]]:
+        """从 Segment 缓存读取；没有缓存则解析并写入"""
+        seg_dir = self._index_dir / "segments"
+        seg_path = seg_dir / f"{src.sha256}.npz"
+        emb_path = seg_dir / f"{src.sha256}.{self._embedder.signature}.emb.npy"
+        entries_path = seg_dir / f"{src.sha256}.json"
+        if seg_path.exists() and entries_path.exists():
+            entries = [KnowledgeEntry(**e) for e in json.loads(entries_path.read_text(encoding="utf-8"))]
+            segment = Segment.load(seg_path)
+        else:
+            entries = self._parse_source(src)
+            segment = Segment.from_documents(_to_documents(entries))
+            seg_dir.mkdir(parents=True, exist_ok=True)
+            tmp = seg_dir / f".{src.sha256}.{os.getpid()}.tmp"
+            segment.save(tmp)
+            os.replace(tmp, seg_path)
+            entries_path.write_text(json.dumps([asdict(e) for e in entries], ensure_ascii=False), encoding="utf-8")
+
+        if emb_path.exists():
+            raw = np.load(emb_path)
+        else:
+            raw = self._embedder.embed_many(_embedding_texts(entries))
+            tmp = seg_dir / f".{src.sha256}.{os.getpid()}.emb.tmp"
+            with open(tmp, "wb") as f:
+                np.save(f, raw)
+            os.replace(tmp, emb_path)
+        return segment, raw, entries
+
+    def _parse_source(self, src: _Source) -> list[KnowledgeEntry]:
+        if src.name == BUILTIN_SOURCE:
+            return list(self._builtin)
+        path = self._source_dir / src.name
+        relative = Path(src.name)
+        default_category = relative.parts[0] if len(relative.parts) > 1 else relative.stem
+        return parse_markdown(path.read_text(encoding="utf-8"), default_category, relative.stem)
+
+    def _build(self, generation: str, sources: list[_Source]) -> None:
+        start = time.perf_counter()
+        segments: list[Segment] = []
+        embeddings: list[np.ndarray] = []
+        entries: list[KnowledgeEntry] = []
+        for src in sources:
+            segment, raw, src_entries = self._load_source(src)
+            segments.append(segment)
+            embeddings.append(raw)
+            entries.extend(src_entries)
+
+        tmp_dir = self._index_dir / f".gen-{generation}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        BM25Index.from_segments(segments).save(tmp_dir)
+        DenseIndex.from_raw(self._embedder, embeddings).save(tmp_dir)
+        DocStore.write(tmp_dir, entries)
+        (tmp_dir / "manifest.json").write_text(
+            json.dumps(
+                {"version": INDEX_FORMAT_VERSION, "sources": [asdict(s) for s in sources]},
+                ensure_ascii=False,
+            ),
+            encoding="utf-8",
+        )
+        final_dir = self._index_dir / f"gen-{generation}"
+        shutil.rmtree(final_dir, ignore_errors=True)
+        os.replace(tmp_dir, final_dir)
+
+        current_tmp = self._index_dir / f".CURRENT.{os.getpid()}.tmp"
+        current_tmp.write_text(f"gen-{generation}", encoding="utf-8")
+        os.replace(current_tmp, self._index_dir / "CURRENT")
+        self._collect_garbage(final_dir.name, {s.sha256 for s in sources})
+        logger.info(f"[Knowledge] 已重建索引 gen={generation} ({time.perf_counter() - start:.2f}s)")
+
+    def _collect_garbage(self, keep_generation: str, keep_segments: set[str]) -> None:
+        """删除旧代与不再引用的 Segment（已 mmap 的旧文件在 Linux 上删除后仍可读）"""
+        for path in self._index_dir.iterdir():
+            if path.is_dir() and path.name.startswith("gen-") and path.name != keep_generation:
+                shutil.rmtree(path, ignore_errors=True)
+        seg_dir = self._index_dir / "segments"
+        for path in seg_dir.iterdir():
+            parts = path.name.split(".")
+            stale_embedding = path.name.endswith(".emb.npy") and parts[1] != self._embedder.signature
+            if parts[0] not in keep_segments or stale_embedding:
+                path.unlink(missing_ok=True)
+
+    def _build_in_memory(self, generation: str, sources: list[_Source]) -> KnowledgeIndex:
+        entries: list[KnowledgeEntry] = []
+        for src in sources:
+            try:
+                entries.extend(self._parse_source(src))
+            except OSError as e:
+                logger.warning(f"[Knowledge] 跳过无法读取的文件 {src.name}: {e}")
+        bm25 = BM25Index.build(_to_documents(entries))
+        dense = DenseIndex.from_raw(self._embedder, [self._embedder.embed_many(_embedding_texts(entries))])
+        return KnowledgeIndex(bm25, dense, DocStore.in_memory(entries), generation)
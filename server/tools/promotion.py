@@ -8,6 +8,9 @@ from __future__ import annotations
 import random
 from langchain_core.tools import tool
 
+from config import settings
+from tools.cache import cached
+
 # ── Mock 数据 ─────────────────────────────────────────
 
 _MOCK_SONGS = [
@@ -173,6 +176,7 @@ def generate_promotion_plan(
 
 
 @tool
+@cached(ttl=settings.TOOL_CACHE_TTL_PROMOTION)
 def get_promotion_report(song_name: str = "月光信箱") -> dict:
     """获取歌曲宣推效果复盘报告。
 
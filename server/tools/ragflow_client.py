@@ -0,0 +1,227 @@
+"""RAGFlow 检索客户端 — 共享连接池、截止时间、重试、熔断与延迟统计
+
+- 进程内共享一个 httpx.AsyncClient（连接数上限、keep-alive），应用关闭时释放
+- 每次检索有总截止时间（RAGFLOW_DEADLINE），重试与退避都在截止时间内完成
+- 只对可重试的失败（连接错误、超时、429 / 5xx）重试，退避为带全抖动的指数退避
+- 熔断器：连续失败达到阈值后打开，冷却期内直接失败；冷却后放行一个探测请求（半开），
+  成功则关闭，失败则重新打开
+- 记录请求结果计数与最近若干次请求的延迟分位数（GET /api/ragflow/metrics）
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from typing import Any
+
+import httpx
+
+from config import settings
+
+logger = logging.getLogger("ragflow")
+
+
+class RagflowError(Exception):
+    """RAGFlow 检索失败（retryable 表示值得重试）"""
+
+    def __init__(self, message: str, retryable: bool = False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class CircuitOpenError(RagflowError):
+    """熔断器打开，请求未发出"""
+
+
+# ── 熔断器 ────────────────────────────────────────────
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = max(1, threshold)
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._probing = False
+
+    def allow(self) -> bool:
+        """是否放行本次请求；半开状态同一时间只放行一个探测请求"""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+            self._probing = False
+        if self.state == HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        if self.state != CLOSED:
+            logger.info("[RAGFlow] 熔断器关闭")
+        self.state = CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.threshold:
+            if self.state != OPEN:
+                self.trips += 1
+                logger.warning(f"[RAGFlow] 连续失败 {self.failures} 次，熔断 {self.reset_timeout:.0f}s")
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+            self._probing = False
+
+    def release(self) -> None:
+        """探测请求既未成功也未失败（如被调用方取消）时释放探测名额"""
+        self._probing = False
+
+
+# ── 延迟统计 ──────────────────────────────────────────
+
+class LatencyStats:
+    """按结果计数，并保留最近 window 次延迟用于计算分位数"""
+
+    def __init__(self, window: int = 1024):
+        self._samples: deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.counts: dict[str, int] = {}
+
+    def observe(self, outcome: str, seconds: float | None = None) -> None:
+        with self._lock:
+            self.counts[outcome] = self.counts.get(outcome, 0) + 1
+            if seconds is not None:
+                self._samples.append(seconds)
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            samples = sorted(self._samples)
+            counts = dict(self.counts)
+
+        def pct(p: float) -> float | None:
+            if not samples:
+                return None
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 1)
+
+        return {
+            "counts": counts,
+            "samples": len(samples),
+            "latency_ms": {"p50": pct(0.5), "p90": pct(0.9), "p99": pct(0.99), "max": pct(1.0)},
+        }
+
+
+# ── 客户端 ────────────────────────────────────────────
+
+_RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+
+class RagflowClient:
+    def __init__(self) -> None:
+        self._http: httpx.AsyncClient | None = None
+        self.breaker = CircuitBreaker(settings.RAGFLOW_BREAKER_THRESHOLD, settings.RAGFLOW_BREAKER_RESET)
+        self.stats = LatencyStats()
+
+    def _client(self) -> httpx.AsyncClient:
+        if self._http is None or self._http.is_closed:
+            self._http = httpx.AsyncClient(
+                base_url=settings.RAGFLOW_BASE_URL.rstrip("/"),
+                headers={"Authorization": f"Bearer {settings.RAGFLOW_API_KEY}"},
+                limits=httpx.Limits(
+                    max_connections=settings.RAGFLOW_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.RAGFLOW_MAX_CONNECTIONS,
+                    keepalive_expiry=60.0,
+                ),
+                timeout=httpx.Timeout(settings.RAGFLOW_DEADLINE, connect=settings.RAGFLOW_CONNECT_TIMEOUT),
+            )
+        return self._http
+
+    async def retrieve(self, question: str, top_k: int, deadline: float | None = None) -> list[dict]:
+        """检索文档片段；超过截止时间抛出 asyncio.TimeoutError，其他失败抛出 RagflowError"""
+        if not self.breaker.allow():
+            self.stats.observe("circuit_open")
+            raise CircuitOpenError("RAGFlow 熔断中")
+
+        budget = settings.RAGFLOW_DEADLINE if deadline is None else deadline
+        start = time.monotonic()
+        settled = False
+        try:
+            async with asyncio.timeout(budget):
+                chunks = await self._retrieve_with_retries(question, top_k, start + budget)
+        except TimeoutError:
+            settled = True
+            self.breaker.record_failure()
+            self.stats.observe("timeout", time.monotonic() - start)
+            raise
+        except RagflowError:
+            settled = True
+            self.breaker.record_failure()
+            self.stats.observe("error", time.monotonic() - start)
+            raise
+        finally:
+            if not settled:
+                self.breaker.release()
+        self.breaker.record_success()
+        self.stats.observe("ok", time.monotonic() - start)
+        return chunks
+
+    async def _retrieve_with_retries(self, question: str, top_k: int, deadline_at: float) -> list[dict]:
+        attempt = 0
+        while True:
+            try:
+                return await self._post(question, top_k)
+            except RagflowError as e:
+                if not e.retryable or attempt >= settings.RAGFLOW_MAX_RETRIES:
+                    raise
+                # 全抖动指数退避；剩余时间不够退避就直接放弃
+                delay = random.uniform(0, settings.RAGFLOW_RETRY_BACKOFF * (2 ** attempt))
+                if time.monotonic() + delay >= deadline_at:
+                    raise
+                attempt += 1
+                self.stats.observe("retry")
+                logger.info(f"[RAGFlow] 第 {attempt} 次重试（{delay * 1000:.0f}ms 后）: {e}")
+                await asyncio.sleep(delay)
+
+    async def _post(self, question: str, top_k: int) -> list[dict]:
+        payload = {"question": question, "dataset_ids": settings.RAGFLOW_KB_ID, "top_k": top_k}
+        try:
+            resp = await self._client().post("/api/v1/retrieval", json=payload)
+        except (httpx.TimeoutException, httpx.TransportError) as e:
+            raise RagflowError(f"{type(e).__name__}: {e}", retryable=True) from e
+        if resp.status_code >= 400:
+            raise RagflowError(f"HTTP {resp.status_code}", retryable=resp.status_code in _RETRYABLE_STATUS)
+        try:
+            data = resp.json()
+        except ValueError as e:
+            raise RagflowError("响应不是合法 JSON") from e
+        if data.get("code") != 0:
+            raise RagflowError(f"RAGFlow API Error: {data.get('message', 'Unknown error')}")
+        return (data.get("data") or {}).get("chunks", [])
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            **self.stats.snapshot(),
+            "breaker": {
+                "state": self.breaker.state,
+                "failures": self.breaker.failures,
+                "trips": self.breaker.trips,
+            },
+        }
+
+    async def aclose(self) -> None:
+        if self._http is not None and not self._http.is_closed:
+            await self._http.aclose()
+        self._http = None
+
+
+ragflow_client = RagflowClient()
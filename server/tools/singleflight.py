@@ -0,0 +1,120 @@
+"""请求合并（single-flight）— 相同键的并发调用共享同一次执行
+
+- SingleFlight：异步版本。首个调用方创建执行任务，后续调用方等待同一任务；
+  单个调用方被取消只影响自己，所有调用方都离开后才取消底层任务
+- ThreadSingleFlight：同步版本，供在线程池中执行的同步工具使用
+- 底层执行抛出的异常会传递给所有等待中的调用方；执行结束后立即移除，
+  不缓存结果（缓存由 tools.cache 负责）
+- on_join 回调在调用方加入已有执行（而非自己发起执行）时调用，供调用方分别计数
+"""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+@dataclass
+class _Call:
+    task: asyncio.Future
+    waiters: int = 0
+
+
+class SingleFlight:
+    def __init__(self) -> None:
+        self._calls: dict[Hashable, _Call] = {}
+        self.executions = 0
+        self.shared = 0
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    async def do(
+        self,
+        key: Hashable,
+        fn: Callable[[], Awaitable[T]],
+        on_join: Callable[[], None] | None = None,
+    ) -> T:
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda t: self._finish(key, call))
+            self.executions += 1
+        else:
+            self.shared += 1
+            if on_join is not None:
+                on_join()
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # 最后一个调用方也已离开（取消 / 超时），不再需要结果
+                self._forget(key, call)
+                call.task.cancel()
+
+    def _forget(self, key: Hashable, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def _finish(self, key: Hashable, call: _Call) -> None:
+        self._forget(key, call)
+        # 调用方均已离开时避免 "exception was never retrieved" 警告
+        if not call.task.cancelled():
+            call.task.exception()
+
+
+@dataclass
+class _ThreadCall:
+    done: threading.Event = field(default_factory=threading.Event)
+    result: Any = None
+    error: BaseException | None = None
+
+
+class ThreadSingleFlight:
+    def __init__(self) -> None:
+        self._calls: dict[Hashable, _ThreadCall] = {}
+        self._lock = threading.Lock()
+        self.executions = 0
+        self.shared = 0
+
+    def in_flight(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._calls
+
+    def do(self, key: Hashable, fn: Callable[[], T], on_join: Callable[[], None] | None = None) -> T:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _ThreadCall()
+                self._calls[key] = call
+                self.executions += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            if on_join is not None:
+                on_join()
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
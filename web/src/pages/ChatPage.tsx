@@ -42,6 +42,8 @@ export const ChatPage: React.FC<ChatPageProps> = ({ conversationId, onConversati
     const [quickActions, setQuickActions] = useState<QuickAction[]>([]);
     const messagesEndRef = useRef<HTMLDivElement>(null);
     const textareaRef = useRef<HTMLTextAreaElement>(null);
+    // 当前请求序号：上一条回复的流在 done 之后仍可能开着（等待 follow_ups），不能影响新请求的加载状态
+    const requestSeqRef = useRef(0);
 
     // 加载快捷操作
     useEffect(() => {
@@ -51,10 +53,10 @@ export const ChatPage: React.FC<ChatPageProps> = ({ conversationId, onConversati
             .catch(() => { });
     }, []);
 
-    // 加载会话消息
+    // 加载会话消息（最新一页）
     useEffect(() => {
         if (conversationId) {
-            fetch(`${API_BASE}/conversations/${conversationId}/messages`)
+            fetch(`${API_BASE}/conversations/${conversationId}/messages?direction=backward&limit=50`)
                 .then((r) => r.json())
                 .then((msgs) => {
                     setMessages(
@@ -99,6 +101,7 @@ export const ChatPage: React.FC<ChatPageProps> = ({ conversationId, onConversati
             setMessages((prev) => [...prev, userMsg]);
             setInput('');
             setIsLoading(true);
+            const seq = ++requestSeqRef.current;
 
             // SSE 流式请求
             try {
@@ -185,6 +188,8 @@ export const ChatPage: React.FC<ChatPageProps> = ({ conversationId, onConversati
                                     if (chunk.conversation_id && !conversationId) {
                                         onConversationCreated(chunk.conversation_id);
                                     }
+                                    // 回复已完成即解锁输入；流可能仍在等待迟到的 follow_ups 事件
+                                    if (requestSeqRef.current === seq) setIsLoading(false);
                                     break;
 
                                 case 'error':
@@ -213,7 +218,7 @@ export const ChatPage: React.FC<ChatPageProps> = ({ conversationId, onConversati
                     },
                 ]);
             } finally {
-                setIsLoading(false);
+                if (requestSeqRef.current === seq) setIsLoading(false);
             }
         },
         [conversationId, isLoading, onConversationCreated]